@@ -1,14 +1,22 @@
-import json
-from datetime import timedelta
-from typing import Annotated, AsyncGenerator, Optional
+import asyncio
+from typing import Annotated, AsyncGenerator, Iterable, List, Optional, Type
 
 from core.config import REDIS_URI, settings
 from core.database import MongoClient, RedisClient
-from core.logger import logger
-from core.security.jwt import OAuthJWTBearer
-from crud import UserCRUD
-from fastapi import Depends, HTTPException, Request, status
+from core.responses import NDJSON_MEDIA_TYPE
+from core.security.jwt import AuthContext, OAuthJWTBearer
+from core.services.profiles import ProfileCache
+from core.services.rate_limits import (
+  ANONYMOUS,
+  LocalBuckets,
+  RouteLimits,
+  SharedMemoryLimits,
+)
+from core.services.revocations import RevokedTokens
+from fastapi import Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
+from fastapi.security.utils import get_authorization_scheme_param
+from pydantic import BaseModel
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -28,8 +36,33 @@ limiter = Limiter(
   swallow_errors=False,
 )
 
+# Rate limits by route and role, compiled when the app is created
+route_limits = RouteLimits(
+  limiter,
+  settings.RATE_LIMITS,
+  settings.RATE_LIMIT_STRATEGY,
+  local=(
+    LocalBuckets(
+      settings.RATE_LIMIT_LOCAL_FLUSH_MS / 1000, settings.RATE_LIMIT_LOCAL_ERROR
+    )
+    if settings.RATE_LIMIT_ANONYMOUS_LOCAL
+    else None
+  ),
+  shared=(
+    SharedMemoryLimits(
+      settings.RATE_LIMIT_SHARED_PATH,
+      settings.RATE_LIMIT_SHARED_SLOTS,
+      settings.RATE_LIMIT_SHARED_STRIPES,
+      settings.RATE_LIMIT_SHARED_SYNC_MS / 1000,
+    )
+    if settings.RATE_LIMIT_STORAGE == "shared_memory"
+    else None
+  ),
+)
 
-# OAuth2 scheme for authentication
+
+# OAuth2 scheme for authentication, the token itself is decoded once per
+# request by `get_auth_context`
 oauth2_scheme = OAuth2PasswordBearer(
   tokenUrl=f"{settings.API_V1_STR}/auth/login",
 )
@@ -49,68 +82,68 @@ async def get_redis_client() -> AsyncGenerator[RedisClient, None]:
   yield RedisClient._client
 
 
-async def get_current_user(
-  token: Annotated[str, Depends(oauth2_scheme)],
-  redis: Annotated[RedisClient, Depends(get_redis_client)],
-  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+def get_auth_context(request: Request) -> AuthContext:
+  """
+  Returns the bearer token of the request and its claims, decoding it
+  on first use only. The claims are `None` for missing or invalid
+  tokens.
+  """
+  if (auth := getattr(request.state, "auth", None)) is None:
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    auth = request.state.auth = AuthContext()
+
+    if scheme.lower() == "bearer" and token:
+      auth.token, auth.claims = token, OAuthJWTBearer.decode(token=token)
+
+  return auth
+
+
+# Profile fields read by permission checks
+AUTHORIZATION_FIELDS = ["username", "role", "scopes"]
+
+
+async def _authenticate(
+  auth: AuthContext,
+  redis: RedisClient,
+  mongo: MongoClient,
   security_scopes: SecurityScopes,
+  fields: Optional[List[str]] = None,
 ) -> dict:
-  # Decode the user's JWT
-  if not (payload := OAuthJWTBearer.decode(token=token)):
+  # Claims of the user's JWT, decoded once per request
+  if not (payload := auth.claims):
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Invalid token.",
     )
 
   # Get data from the payload
-  username, jti = payload.get("sub"), payload.get("jti")
+  username, jti, exp = payload.get("sub"), payload.get("jti"), payload.get("exp")
+
+  users_db = mongo.get_database("users")
+  user = None
 
-  # Check if jti is revoked
-  if await OAuthJWTBearer.is_jti_in_blacklist(redis, jti=jti):
+  # Check if jti is revoked, and read the profile through the Redis cache.
+  # Unless the worker knows every revocation, Redis is checked while the
+  # profile is read, so that both share a round trip.
+  if (revoked := RevokedTokens.check(redis, jti)) is None:
+    revoked, user = await asyncio.gather(
+      RevokedTokens.is_revoked(redis, jti, exp),
+      ProfileCache.fetch(redis, users_db, username, fields),
+    )
+  elif not revoked:
+    user = await ProfileCache.fetch(redis, users_db, username, fields)
+
+  if revoked:
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Token has been revoked.",
     )
 
-  redis_key = f"cache:user:{username}:profile"
-  user = None
-
-  # Check if user data exists in Redis cache
-  if user_cache := await redis.get(redis_key):
-    try:
-      user = json.loads(user_cache)
-    except json.JSONDecodeError as e:
-      logger.error(
-        {
-          "message": (
-            "[x] An error occured while decoding user's data from Redis cache."
-          ),
-          "detail": str(e),
-        },
-        exc_info=True,
-      )
-      pass
-
-  # If not in cache or cache failed, check MongoDB
-  if user is None:
-    users_db = mongo.get_database("users")
-
-    if not (
-      user := await UserCRUD(users_db).find(
-        username=username, exclude=["_id", "password"]
-      )
-    ):
-      raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Couldn't validate user credentials.",
-        headers={"WWW-Authenticate": "Bearer"},
-      )
-
-    # Store user profile in Redis cache
-    await redis.setex(
-      f"cache:user:{username}:profile",
-      timedelta(minutes=settings.CACHE_EXPIRE_MINUTES).seconds,
-      json.dumps(user, default=str),
+  if not user:
+    raise HTTPException(
+      status_code=status.HTTP_401_UNAUTHORIZED,
+      detail="Couldn't validate user credentials.",
+      headers={"WWW-Authenticate": "Bearer"},
     )
 
   # Check a user's privileges
@@ -126,54 +159,83 @@ async def get_current_user(
   return user
 
 
-def get_jwt_payload(request: Request) -> Optional[dict]:
-  """Extract and decode JWT payload from Authorization header"""
-  if auth_token := request.headers.get("Authorization"):
-    try:
-      access_token = auth_token.split()[1]
-
-      if payload := OAuthJWTBearer.decode(token=access_token):
-        return payload
-    except Exception:
-      pass
-
-  return
-
-
-def _set_name_from_func(func):
-  """Helper to copy function name/module to decorated function."""
-
-  def decorator(f):
-    f.__name__ = func.__name__
-    f.__module__ = func.__module__
-
-    return f
-
-  return decorator
-
-
-async def limit_dependency(request: Request) -> None:
-  """Dependency that applies rate limiting dynamically based on request.state."""
-  limiter: Limiter = request.app.state.limiter
-
-  @_set_name_from_func(request.scope.get("endpoint"))
-  async def dummy(request: Request):
-    pass
+async def get_current_user(
+  token: Annotated[str, Depends(oauth2_scheme)],
+  auth: Annotated[AuthContext, Depends(get_auth_context)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  security_scopes: SecurityScopes,
+) -> dict:
+  """Returns the profile of the authenticated user."""
+  return await _authenticate(auth, redis, mongo, security_scopes)
 
-  # Get dynamic values from request.state (set by middleware)
-  limit_value = getattr(request.state, "limit_value", settings.RATE_LIMIT_ANONYMOUS)
 
-  def key_func(request: Request) -> str:
-    return getattr(request.state, "identifier", request.client.host)
+async def authorize_user(
+  token: Annotated[str, Depends(oauth2_scheme)],
+  auth: Annotated[AuthContext, Depends(get_auth_context)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  security_scopes: SecurityScopes,
+) -> dict:
+  """
+  Returns the username, role and scopes of the authenticated user,
+  for routes that only check permissions. With the "hash" profile
+  cache layout, only these fields are read from Redis.
+  """
+  return await _authenticate(auth, redis, mongo, security_scopes, AUTHORIZATION_FIELDS)
+
+
+def get_stream_format(
+  request: Request,
+  stream: Annotated[bool, Query()] = False,
+) -> Optional[str]:
+  """
+  Returns the requested streaming format of a list endpoint: "ndjson"
+  for `Accept: application/x-ndjson`, "json" for `?stream=true`.
+  """
+  if NDJSON_MEDIA_TYPE in request.headers.get("Accept", ""):
+    return "ndjson"
+
+  return "json" if stream else None
+
+
+def get_fields(model: Type[BaseModel], *, exclude: Iterable[str] = ()):
+  """
+  Returns a dependency parsing the comma-separated `fields` query
+  parameter into the stored names of the requested `model` fields.
+  """
+  allowed = {}
+
+  for name, field in model.model_fields.items():
+    if name not in exclude:
+      allowed[name] = allowed[field.alias or name] = field.alias or name
+
+  def dependency(
+    fields: Annotated[
+      Optional[str], Query(description="Comma-separated fields to return.")
+    ] = None,
+  ) -> Optional[List[str]]:
+    if not fields:
+      return None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+
+    if unknown := [field for field in requested if field not in allowed]:
+      raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Unknown fields: {', '.join(unknown)}.",
+      )
 
-  endpoint_key = f"{dummy.__module__}.{dummy.__name__}"
-  limiter._route_limits.pop(endpoint_key, None)
+    return list(dict.fromkeys(allowed[field] for field in requested))
 
-  check_request_limit = limiter.limit(
-    limit_value=limit_value,
-    key_func=key_func,
-  )(dummy)
+  return dependency
 
-  await check_request_limit(request)
 
-  return
+async def limit_dependency(
+  request: Request,
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+) -> None:
+  """Applies the rate limit of the route for the role set by the middleware."""
+  await route_limits.check(
+    request, redis, getattr(request.state, "limit_role", ANONYMOUS)
+  )
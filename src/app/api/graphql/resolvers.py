@@ -2,6 +2,11 @@ from typing import List, Optional
 
 from core.database import MongoClient
 from crud import ProductCRUD, UserCRUD
+from crud.base_crud import projection
+
+# Fields exposed by the GraphQL types
+USER_FIELDS = ["username", "email", "role"]
+PRODUCT_FIELDS = ["category", "item", "brand", "title", "price"]
 
 
 async def get_users(role: str) -> List[dict]:
@@ -11,7 +16,7 @@ async def get_users(role: str) -> List[dict]:
 
   users_db = MongoClient._client.get_database("users")
 
-  return await UserCRUD(users_db).read_all(role)
+  return await UserCRUD(users_db).read_all(role, include=USER_FIELDS, exclude=["_id"])
 
 
 async def get_user(username: str) -> Optional[dict]:
@@ -21,7 +26,9 @@ async def get_user(username: str) -> Optional[dict]:
 
   users_db = MongoClient._client.get_database("users")
 
-  return await UserCRUD(users_db).find(username=username)
+  return await UserCRUD(users_db).find(
+    username=username, include=USER_FIELDS, exclude=["_id"]
+  )
 
 
 async def get_products(category: str) -> List[dict]:
@@ -31,4 +38,6 @@ async def get_products(category: str) -> List[dict]:
 
   products_db = MongoClient._client.get_database("products")
 
-  return await ProductCRUD(products_db).read_all(category)
+  return await ProductCRUD(products_db).read_all(
+    category, projection=projection(PRODUCT_FIELDS, ["_id"])
+  )
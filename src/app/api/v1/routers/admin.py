@@ -1,14 +1,18 @@
 from typing import Annotated
 
 from api.dependencies import (
-  get_current_user,
+  authorize_user,
   get_mongo_client,
+  get_redis_client,
   limit_dependency,
 )
-from core.database import MongoClient
+from core.database import MongoClient, RedisClient
 from core.schemas.admin import AdminBase
-from crud import UserCRUD
-from fastapi import APIRouter, Body, Depends, HTTPException, Security, status
+from core.services.categories import CategoryRegistry
+from core.services.profiles import ProfileCache
+from crud import IndexRegistry, ProductCRUD, UserCRUD
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Security, status
+from pymongo.errors import CollectionInvalid
 
 router = APIRouter(tags=["Admin"])
 
@@ -21,13 +25,14 @@ router = APIRouter(tags=["Admin"])
 async def create_admin_account(
   admin: Annotated[AdminBase, Body()],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Creates an initial admin account.
   """
   users_db = mongo.get_database("users")
 
-  if await UserCRUD(users_db).find(username=admin.username):
+  if await UserCRUD(users_db).exists(username=admin.username, email=admin.email):
     raise HTTPException(
       status_code=status.HTTP_409_CONFLICT,
       detail="Admin already exists.",
@@ -35,6 +40,9 @@ async def create_admin_account(
 
   await UserCRUD(users_db).create(admin)
 
+  # Drop cached lookups that missed before the signup
+  await ProfileCache.evict(redis, admin.username, admin.email)
+
   return {"message": "Admin account created successfully."}
 
 
@@ -42,7 +50,7 @@ async def create_admin_account(
   "/dashboard",
   status_code=status.HTTP_200_OK,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -55,25 +63,104 @@ async def admin_dashboard(
   users_db = mongo.get_database("users")
   products_db = mongo.get_database("products")
 
+  user_crud = UserCRUD(users_db)
+
   stats = {
     "users": {
-      "admins": await users_db["admins"].count_documents({}),
-      "sellers": await users_db["sellers"].count_documents({}),
-      "customers": await users_db["customers"].count_documents({}),
+      "admins": await user_crud.count("admins"),
+      "sellers": await user_crud.count("sellers"),
+      "customers": await user_crud.count("customers"),
     },
     "products": {
-      "categories": len(await products_db.list_collection_names()),
+      "categories": len(await CategoryRegistry.get(products_db)),
     },
   }
 
   return stats
 
 
+@router.post(
+  "/categories",
+  status_code=status.HTTP_201_CREATED,
+  dependencies=[
+    Security(authorize_user, scopes=["admin"]),
+    Depends(limit_dependency),
+  ],
+)
+async def create_category(
+  name: Annotated[str, Body(embed=True, pattern=r"^[A-Za-z0-9_-]{1,64}$")],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+):
+  """
+  Creates a product category with its declared indexes.
+  """
+  products_db = mongo.get_database("products")
+
+  try:
+    await products_db.create_collection(name)
+  except CollectionInvalid:
+    raise HTTPException(
+      status_code=status.HTTP_409_CONFLICT, detail="Category already exists."
+    )
+
+  await products_db[name].create_indexes(ProductCRUD.indexes)
+  await CategoryRegistry.invalidate(redis)
+
+  return {"message": f"Category {name} created successfully."}
+
+
+@router.delete(
+  "/categories/{name}",
+  status_code=status.HTTP_200_OK,
+  dependencies=[
+    Security(authorize_user, scopes=["admin"]),
+    Depends(limit_dependency),
+  ],
+)
+async def drop_category(
+  name: Annotated[str, Path()],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+):
+  """
+  Drops a product category with all of its products.
+  """
+  products_db = mongo.get_database("products")
+
+  if not await CategoryRegistry.contains(products_db, name):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND, detail="Category not found."
+    )
+
+  await products_db.drop_collection(name)
+  await CategoryRegistry.invalidate(redis)
+
+  return {"message": f"Category {name} dropped successfully."}
+
+
+@router.get(
+  "/indexes",
+  status_code=status.HTTP_200_OK,
+  dependencies=[
+    Security(authorize_user, scopes=["admin"]),
+    Depends(limit_dependency),
+  ],
+)
+async def index_drift(
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+):
+  """
+  Returns collections whose indexes drifted from the declared ones.
+  """
+  return await IndexRegistry.drift(mongo)
+
+
 @router.patch(
   "/users/{username}/role",
   status_code=status.HTTP_200_OK,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -81,9 +168,11 @@ async def change_user_role(
   username: str,
   new_role: Annotated[str, Body(embed=True)],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
-  Changes a user's role and migrates them between collections.
+  Changes a user's role, migrating them between collections
+  when users are stored per role.
   """
   users_db = mongo.get_database("users")
   user_crud = UserCRUD(users_db)
@@ -96,21 +185,17 @@ async def change_user_role(
   if old_role == new_role:
     return {"message": f"User is already a {new_role}"}
 
-  # Update role in document
-  user["role"] = new_role
-
-  # Set default scopes based on role
-  if new_role == "admins":
-    user["scopes"] = ["admin"]
-  elif new_role == "sellers":
-    user["scopes"] = ["seller"]
+  if user_crud.single_collection:
+    # Single-document update of the indexed role field
+    await user_crud.change_role(user, new_role)
   else:
-    user["scopes"] = ["customer"]
-
-  # Migrate document
-  async with await mongo._client.start_session() as session:
-    async with session.start_transaction():
-      await users_db[new_role].insert_one(user)
-      await users_db[old_role].delete_one({"username": username})
+    # Migrate document between role collections
+    async with await mongo._client.start_session() as session:
+      async with session.start_transaction():
+        await user_crud.change_role(user, new_role, session=session)
+
+  # The cached profile holds the previous role and scopes, under the
+  # stored username read by `get_current_user` and maybe the path
+  await ProfileCache.evict(redis, *{username, user["username"]})
 
   return {"message": f"User {username} role updated from {old_role} to {new_role}"}
@@ -1,19 +1,19 @@
-import json
-from datetime import timedelta
 from typing import Annotated
 
 from api.dependencies import (
-  get_current_user,
+  authorize_user,
+  get_auth_context,
   get_mongo_client,
   get_redis_client,
   limit_dependency,
+  limiter,
 )
-from core.config import settings
 from core.database import MongoClient, RedisClient
-from core.schemas.token import TokenBase, TokenPayload
-from core.security.jwt import OAuthJWTBearer
+from core.schemas.token import TokenPayload
+from core.security.jwt import AuthContext, OAuthJWTBearer
+from core.services.profiles import ProfileCache
 from crud import UserCRUD
-from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(tags=["Authentication"])
@@ -62,11 +62,7 @@ async def login(
   )
 
   # Store user profile in Redis cache
-  await redis.setex(
-    f"cache:user:{username}:profile",
-    timedelta(minutes=settings.CACHE_EXPIRE_MINUTES).seconds,
-    json.dumps(user, default=str),
-  )
+  await ProfileCache.set(redis, username, user)
 
   return TokenPayload(access_token=token.get("jwt"), role=role)
 
@@ -75,17 +71,17 @@ async def login(
   "/token",
   status_code=status.HTTP_200_OK,
   response_model=TokenPayload,
-  dependencies=[Depends(get_current_user), Depends(limit_dependency)],
+  dependencies=[Depends(authorize_user), Depends(limit_dependency)],
 )
 async def auth_token(
-  token: Annotated[TokenBase, Header(alias="Authorization")],
+  auth: Annotated[AuthContext, Depends(get_auth_context)],
   redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Log in using an access token.
   """
-  # Decode a user's JWT
-  if not (payload := OAuthJWTBearer.decode(token.access_token)):
+  # Claims of the user's JWT, decoded once per request
+  if not (payload := auth.claims):
     raise HTTPException(
       status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token."
     )
@@ -98,7 +94,7 @@ async def auth_token(
   )
 
   # Check if jti is revoked
-  if await OAuthJWTBearer.is_jti_in_blacklist(redis, jti=jti):
+  if await OAuthJWTBearer.is_jti_in_blacklist(redis, jti=jti, exp=exp):
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Token has been revoked.",
@@ -112,7 +108,7 @@ async def auth_token(
     )
 
   # Refresh token
-  refresh_token = await OAuthJWTBearer.refresh(payload)
+  refresh_token = await OAuthJWTBearer.refresh(dict(payload))
 
   return TokenPayload(access_token=refresh_token, role=role)
 
@@ -120,21 +116,20 @@ async def auth_token(
 @router.post(
   "/logout",
   status_code=status.HTTP_200_OK,
-  dependencies=[Depends(get_current_user), Depends(limit_dependency)],
+  dependencies=[Depends(authorize_user), Depends(limit_dependency)],
 )
 async def logout(
-  token: Annotated[TokenBase, Header()],
+  auth: Annotated[AuthContext, Depends(get_auth_context)],
   redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Log out from user account.
   """
-  # Decode a user's JWT
-  payload = OAuthJWTBearer.decode(token=token.access_token)
-  jti, exp = payload.get("jti"), payload.get("exp")
+  # Claims of the user's JWT, decoded once per request
+  jti, exp = auth.claims.get("jti"), auth.claims.get("exp")
 
   # Check if jti is revoked
-  if await OAuthJWTBearer.is_jti_in_blacklist(redis, jti=jti):
+  if await OAuthJWTBearer.is_jti_in_blacklist(redis, jti=jti, exp=exp):
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Token has been revoked.",
@@ -148,3 +143,15 @@ async def logout(
     )
 
   return {"message": "Successfully logged out."}
+
+
+@router.get("/jwks.json", status_code=status.HTTP_200_OK)
+@limiter.exempt
+async def jwks(response: Response):
+  """
+  Returns the public keys verifying access tokens, identified by the
+  `kid` header of the tokens.
+  """
+  response.headers["Cache-Control"] = "public, max-age=300"
+
+  return OAuthJWTBearer.keys.jwks()
@@ -1,5 +1,3 @@
-import json
-from datetime import timedelta
 from typing import Annotated
 
 from api.dependencies import (
@@ -13,6 +11,7 @@ from core.database import MongoClient
 from core.logger import logger
 from core.security.jwt import OAuthJWTBearer
 from core.services.oauth import google_oauth
+from core.services.profiles import ProfileCache
 from crud import UserCRUD
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
@@ -94,7 +93,11 @@ async def auth_google(
 
   users_db = mongo.get_database("users")
 
-  if not (user := await UserCRUD(users_db).find(username=user_email)):
+  if not (
+    user := await UserCRUD(users_db).find(
+      username=user_email, exclude=["_id", "password"]
+    )
+  ):
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Couldn't validate credentials",
@@ -110,11 +113,7 @@ async def auth_google(
   )
 
   # Store user profile in Redis cache
-  await redis.setex(
-    f"cache:user:{edbo_id}:profile",
-    timedelta(minutes=settings.CACHE_EXPIRE_MINUTES).seconds,
-    json.dumps(user, default=str),
-  )
+  await ProfileCache.set(redis, str(edbo_id), user)
 
   response = RedirectResponse(url=settings.GOOGLE_FRONTEND_REDIRECT)
   response.set_cookie(
@@ -1,17 +1,18 @@
-import json
-from datetime import timedelta
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
 from api.dependencies import (
-  get_current_user,
+  authorize_user,
+  get_fields,
   get_mongo_client,
   get_redis_client,
+  get_stream_format,
   limit_dependency,
 )
 from core.config import settings
 from core.database import MongoClient, RedisClient
-from core.logger import logger
+from core.responses import partial_response, stream_documents
 from core.schemas.sellers import SellerBase, SellerUpdate
+from core.services.profiles import ProfileCache
 from crud import UserCRUD
 from fastapi import (
   APIRouter,
@@ -19,6 +20,8 @@ from fastapi import (
   Depends,
   HTTPException,
   Path,
+  Query,
+  Response,
   Security,
   status,
 )
@@ -34,13 +37,16 @@ router = APIRouter(tags=["Sellers"])
 async def create_seller_account(
   create_seller: Annotated[SellerBase, Body()],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Creates a seller account.
   """
   users_db = mongo.get_database("users")
 
-  if await UserCRUD(users_db).find(username=create_seller.username):
+  if await UserCRUD(users_db).exists(
+    username=create_seller.username, email=create_seller.email
+  ):
     raise HTTPException(
       status_code=status.HTTP_409_CONFLICT, detail="User already exists."
     )
@@ -48,6 +54,9 @@ async def create_seller_account(
   # Create a seller account
   await UserCRUD(users_db).create(create_seller)
 
+  # Drop cached lookups that missed before the signup
+  await ProfileCache.evict(redis, create_seller.username, create_seller.email)
+
   return {"message": "The seller account was created successfully."}
 
 
@@ -56,19 +65,56 @@ async def create_seller_account(
   status_code=status.HTTP_200_OK,
   response_model=List[SellerBase],
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
 async def read_sellers(
+  response: Response,
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  stream: Annotated[Optional[str], Depends(get_stream_format)],
+  fields: Annotated[
+    Optional[List[str]], Depends(get_fields(SellerBase, exclude=["password"]))
+  ],
+  length: Annotated[
+    int, Query(ge=1, le=settings.PAGINATION_MAX_LENGTH)
+  ] = settings.PAGINATION_DEFAULT_LENGTH,
+  cursor: Annotated[Optional[str], Query()] = None,
 ):
   """
-  Returns all sellers.
+  Returns a page of sellers. The next page is selected by the cursor
+  returned in the `X-Next-Cursor` header.
+
+  Streams all remaining profiles for `Accept: application/x-ndjson`
+  or `?stream=true`. Only the requested `fields` are returned if set.
   """
   users_db = mongo.get_database("users")
+  exclude = ["_id", "password"]
+
+  if stream:
+    return stream_documents(
+      UserCRUD(users_db).stream(
+        "sellers",
+        cursor=cursor,
+        include=fields,
+        exclude=exclude,
+        batch_size=settings.STREAM_BATCH_SIZE,
+      ),
+      None if fields else SellerBase,
+      ndjson=stream == "ndjson",
+    )
+
+  users, next_cursor = await UserCRUD(users_db).read_page(
+    "sellers", length=length, cursor=cursor, include=fields, exclude=exclude
+  )
+  headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+  if fields:
+    return partial_response(users, headers=headers)
 
-  return await UserCRUD(users_db).read_all("sellers")
+  response.headers.update(headers)
+
+  return users
 
 
 @router.get(
@@ -76,7 +122,7 @@ async def read_sellers(
   status_code=status.HTTP_200_OK,
   response_model=SellerBase,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -88,39 +134,12 @@ async def read_seller(
   """
   Returns seller profile by `username`.
   """
-  redis_key = f"cache:user:{username}:profile"
-
-  # Check if user data exists in Redis cache
-  if user_cache := await redis.get(redis_key):
-    try:
-      # Parse user data to the JSON format
-      user = json.loads(user_cache)
-    except json.JSONDecodeError as e:
-      logger.error(
-        {
-          "message": (
-            "[x] An error occured while decoding seller's data from Redis cache."
-          ),
-          "detail": str(e),
-        },
-        exc_info=True,
-      )
-      pass
-  else:
-    # Check if user exists in MongoDB
-    users_db = mongo.get_database("users")
-
-    if not (user := await UserCRUD(users_db).find(username=username)):
-      raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Seller not found.",
-      )
-
-    # Store user data in Redis cache
-    await redis.setex(
-      redis_key,
-      timedelta(minutes=settings.CACHE_EXPIRE_MINUTES).seconds,
-      json.dumps(user, default=str),
+  users_db = mongo.get_database("users")
+
+  # Read the profile through the Redis cache
+  if not (user := await ProfileCache.fetch(redis, users_db, username)):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND, detail="Seller not found."
     )
 
   return user
@@ -129,7 +148,7 @@ async def read_seller(
 @router.patch(
   "/{username}",
   status_code=status.HTTP_200_OK,
-  dependencies=[Security(get_current_user, scopes=["admin"])],
+  dependencies=[Security(authorize_user, scopes=["admin"])],
 )
 async def update_seller(
   username: Annotated[str, Path()],
@@ -143,18 +162,27 @@ async def update_seller(
   users_db = mongo.get_database("users")
 
   # Update the seller data
+  update = update_seller.model_dump(exclude_unset=True)
+
   if not (
-    await UserCRUD(users_db).update(
+    user := await UserCRUD(users_db).update(
       username=username,
-      update=update_seller.model_dump(exclude_unset=True),
+      update=update,
+      role="sellers",
+      exclude=["_id", "password"],
     )
   ):
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND, detail="Seller not found."
     )
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Write the updated profile to Redis cache under the stored username,
+  # which the path may only match regardless of case or by email. The
+  # profile cached under the path by reads is evicted
+  await ProfileCache.write(redis, user["username"], user, update.keys())
+
+  if username != user["username"]:
+    await ProfileCache.evict(redis, username)
 
   return {"message": "The seller account has been updated."}
 
@@ -163,7 +191,7 @@ async def update_seller(
   "/{username}",
   status_code=status.HTTP_200_OK,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -179,12 +207,13 @@ async def delete_seller(
   # Delete the seller account
   users_db = mongo.get_database("users")
 
-  if not await UserCRUD(users_db).delete(username=username):
+  if not (user := await UserCRUD(users_db).delete(username=username, role="sellers")):
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND, detail="Seller not found."
     )
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Delete user profile from Redis cache, under the stored username and
+  # the path
+  await ProfileCache.evict(redis, *{username, user["username"]}, forget_version=True)
 
   return {"message": "The seller account was deleted successfully."}
@@ -1,6 +1,7 @@
 from typing import Annotated
 
 from api.dependencies import (
+  authorize_user,
   get_current_user,
   get_mongo_client,
   get_redis_client,
@@ -10,6 +11,7 @@ from core.database import MongoClient, RedisClient
 from core.schemas.user import UserUpdate
 from core.schemas.utils import PasswordRecovery, UpdateEmail, UpdatePassword
 from core.security.utils import Hash
+from core.services.profiles import ProfileCache
 from crud import UserCRUD
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 
@@ -37,7 +39,7 @@ async def get_active_user(user: Annotated[dict, Depends(get_current_user)]):
 )
 async def update_user_profile(
   user_update: Annotated[UserUpdate, Body()],
-  user: Annotated[dict, Depends(get_current_user)],
+  user: Annotated[dict, Depends(authorize_user)],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
   redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
@@ -48,16 +50,20 @@ async def update_user_profile(
   username = user.get("username")
 
   # Update the user data
+  update = user_update.model_dump(exclude_unset=True)
+
   if not (
-    await UserCRUD(users_db).update(
+    user := await UserCRUD(users_db).update(
       username=username,
-      update=user_update.model_dump(exclude_unset=True),
+      update=update,
+      role=user.get("role"),
+      exclude=["_id", "password"],
     )
   ):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Write the updated profile to Redis cache
+  await ProfileCache.write(redis, username, user, update.keys())
 
   return {"message": "The profile was updated."}
 
@@ -69,7 +75,7 @@ async def update_user_profile(
 )
 async def update_password(
   update_body: Annotated[UpdatePassword, Body()],
-  user: Annotated[dict, Depends(get_current_user)],
+  user: Annotated[dict, Depends(authorize_user)],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
 ):
   """
@@ -93,9 +99,8 @@ async def update_password(
     )
 
   # Update the user data
-  await UserCRUD(users_db).update(
-    username=username,
-    update={"password": Hash.hash(plain=update_body.new_password)},
+  await UserCRUD(users_db).update_by_id(
+    user, {"password": await Hash.ahash(plain=update_body.new_password)}
   )
 
   return {"message": "The password was updated."}
@@ -108,7 +113,7 @@ async def update_password(
 )
 async def update_email(
   user_update: Annotated[UpdateEmail, Body()],
-  user: Annotated[dict, Depends(get_current_user)],
+  user: Annotated[dict, Depends(authorize_user)],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
   redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
@@ -118,7 +123,7 @@ async def update_email(
   # Get user's email from the MongoDB database
   users_db = mongo.get_database("users")
 
-  if await UserCRUD(users_db).find(username=user_update.email):
+  if await UserCRUD(users_db).exists(username=user_update.email):
     raise HTTPException(
       status_code=status.HTTP_409_CONFLICT,
       detail="That email is already associated with another account.",
@@ -139,13 +144,14 @@ async def update_email(
     )
 
   # Update the user data
-  await UserCRUD(users_db).update(
-    username=username,
-    update={"email": {"address": user_update.email, "is_verified": False}},
+  user = await UserCRUD(users_db).update_by_id(
+    user,
+    {"email": {"address": user_update.email, "is_verified": False}},
+    exclude=["_id", "password"],
   )
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Write the updated profile to Redis cache
+  await ProfileCache.write(redis, username, user, ["email"])
 
   return {"message": "Email added to the user account."}
 
@@ -168,7 +174,7 @@ async def password_recovery(
   if not (
     await UserCRUD(users_db).update(
       username=update_body.email,
-      update={"password": Hash.hash(plain=update_body.new_password)},
+      update={"password": await Hash.ahash(plain=update_body.new_password)},
     )
   ):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
@@ -1,17 +1,18 @@
-import json
-from datetime import timedelta
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
 from api.dependencies import (
-  get_current_user,
+  authorize_user,
+  get_fields,
   get_mongo_client,
   get_redis_client,
+  get_stream_format,
   limit_dependency,
 )
 from core.config import settings
 from core.database import MongoClient, RedisClient
-from core.logger import logger
+from core.responses import partial_response, stream_documents
 from core.schemas.user import UserBase, UserUpdate
+from core.services.profiles import ProfileCache
 from crud import UserCRUD
 from fastapi import (
   APIRouter,
@@ -19,6 +20,8 @@ from fastapi import (
   Depends,
   HTTPException,
   Path,
+  Query,
+  Response,
   Security,
   status,
 )
@@ -31,7 +34,7 @@ router = APIRouter(tags=["Users"])
   status_code=status.HTTP_200_OK,
   response_model=UserBase,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -43,39 +46,11 @@ async def read_user(
   """
   Returns user by `username`.
   """
-  redis_key = f"cache:user:{username}:profile"
-
-  # Check if user data exists in Redis cache
-  if user_cache := await redis.get(redis_key):
-    try:
-      # Parse user data to the JSON format
-      user = json.loads(user_cache)
-    except json.JSONDecodeError as e:
-      logger.error(
-        {
-          "message": (
-            "[x] An error occured while decoding user's data from Redis cache."
-          ),
-          "detail": str(e),
-        },
-        exc_info=True,
-      )
-      pass
-  else:
-    # Check if user exists in MongoDB
-    users_db = mongo.get_database("users")
-
-    if not (user := await UserCRUD(users_db).find(username=username)):
-      raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
-      )
-
-    # Store user data in Redis cache
-    await redis.setex(
-      redis_key,
-      timedelta(minutes=settings.CACHE_EXPIRE_MINUTES).seconds,
-      json.dumps(user, default=str),
-    )
+  users_db = mongo.get_database("users")
+
+  # Read the profile through the Redis cache
+  if not (user := await ProfileCache.fetch(redis, users_db, username)):
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
   return user
 
@@ -85,26 +60,63 @@ async def read_user(
   status_code=status.HTTP_200_OK,
   response_model=List[UserBase],
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
 async def read_users(
   role: Annotated[str, Path()],
+  response: Response,
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  stream: Annotated[Optional[str], Depends(get_stream_format)],
+  fields: Annotated[
+    Optional[List[str]], Depends(get_fields(UserBase, exclude=["password"]))
+  ],
+  length: Annotated[
+    int, Query(ge=1, le=settings.PAGINATION_MAX_LENGTH)
+  ] = settings.PAGINATION_DEFAULT_LENGTH,
+  cursor: Annotated[Optional[str], Query()] = None,
 ):
   """
-  Returns all users by role.
+  Returns a page of users by role. The next page is selected by the cursor
+  returned in the `X-Next-Cursor` header.
+
+  Streams all remaining profiles for `Accept: application/x-ndjson`
+  or `?stream=true`. Only the requested `fields` are returned if set.
   """
   users_db = mongo.get_database("users")
+  exclude = ["_id", "password"]
+
+  if stream:
+    return stream_documents(
+      UserCRUD(users_db).stream(
+        role,
+        cursor=cursor,
+        include=fields,
+        exclude=exclude,
+        batch_size=settings.STREAM_BATCH_SIZE,
+      ),
+      None if fields else UserBase,
+      ndjson=stream == "ndjson",
+    )
+
+  users, next_cursor = await UserCRUD(users_db).read_page(
+    role, length=length, cursor=cursor, include=fields, exclude=exclude
+  )
+  headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+  if fields:
+    return partial_response(users, headers=headers)
 
-  return await UserCRUD(users_db).read_all(role)
+  response.headers.update(headers)
+
+  return users
 
 
 @router.patch(
   "/{username}",
   status_code=status.HTTP_200_OK,
-  dependencies=[Security(get_current_user, scopes=["admin"])],
+  dependencies=[Security(authorize_user, scopes=["admin"])],
 )
 async def update_user(
   username: Annotated[str, Path()],
@@ -118,16 +130,24 @@ async def update_user(
   users_db = mongo.get_database("users")
 
   # Update the user data
+  update = update_user.model_dump(exclude_unset=True)
+
   if not (
-    await UserCRUD(users_db).update(
+    user := await UserCRUD(users_db).update(
       username=username,
-      update=update_user.model_dump(exclude_unset=True),
+      update=update,
+      exclude=["_id", "password"],
     )
   ):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Write the updated profile to Redis cache under the stored username,
+  # which the path may only match regardless of case or by email. The
+  # profile cached under the path by reads is evicted
+  await ProfileCache.write(redis, user["username"], user, update.keys())
+
+  if username != user["username"]:
+    await ProfileCache.evict(redis, username)
 
   return {"message": "The user account has been updated."}
 
@@ -136,7 +156,7 @@ async def update_user(
   "/{username}",
   status_code=status.HTTP_200_OK,
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
@@ -152,10 +172,11 @@ async def delete_user(
   # Delete the user account
   users_db = mongo.get_database("users")
 
-  if not await UserCRUD(users_db).delete(username=username):
+  if not (user := await UserCRUD(users_db).delete(username=username)):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
-  # Delete user profile from Redis cache
-  await redis.delete(f"cache:user:{username}:profile")
+  # Delete user profile from Redis cache, under the stored username and
+  # the path
+  await ProfileCache.evict(redis, *{username, user["username"]}, forget_version=True)
 
   return {"message": "The user account was deleted successfully."}
@@ -1,13 +1,28 @@
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Literal, Optional
 
 from api.dependencies import (
-  get_current_user,
+  authorize_user,
+  get_fields,
   get_mongo_client,
+  get_redis_client,
+  get_stream_format,
   limit_dependency,
 )
-from core.database import MongoClient
-from core.schemas.products import ProductCreate, ProductItem, ProductUpdate
+from core.config import settings
+from core.database import MongoClient, RedisClient
+from core.responses import partial_response, stream_documents
+from core.schemas.products import (
+  ProductBulkUpdate,
+  ProductCreate,
+  ProductItem,
+  ProductUpdate,
+)
+from core.schemas.utils import BulkItemResult, BulkWriteResult, ObjectIdStr
+from core.services.categories import CategoryRegistry
+from core.services.products import ProductCache
 from crud import ProductCRUD
+from crud.base_crud import projection
+from crud.pagination import sort_spec
 from fastapi import (
   APIRouter,
   Body,
@@ -15,9 +30,11 @@ from fastapi import (
   HTTPException,
   Path,
   Query,
+  Response,
   Security,
   status,
 )
+from pymongo import ASCENDING, DESCENDING
 
 router = APIRouter(tags=["Products"])
 
@@ -30,7 +47,7 @@ router = APIRouter(tags=["Products"])
 )
 async def create_product(
   product: Annotated[ProductCreate, Body()],
-  user: Annotated[dict, Security(get_current_user, scopes=["seller"])],
+  user: Annotated[dict, Security(authorize_user, scopes=["seller"])],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
 ):
   """
@@ -39,7 +56,7 @@ async def create_product(
 
   products_db = mongo.get_database("products")
 
-  if product.category not in await products_db.list_collection_names():
+  if not await CategoryRegistry.contains(products_db, product.category):
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND, detail="Category not found."
     )
@@ -49,35 +66,229 @@ async def create_product(
   return product
 
 
+@router.get(
+  "/categories",
+  status_code=status.HTTP_200_OK,
+  response_model=List[str],
+  dependencies=[Depends(limit_dependency)],
+)
+async def get_categories(
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+):
+  """
+  Returns the product categories.
+  """
+  products_db = mongo.get_database("products")
+
+  return sorted(await CategoryRegistry.get(products_db))
+
+
+def bulk_write_result(result: dict, ids: List) -> BulkWriteResult:
+  """Builds the per-item response of a bulk write."""
+  errors = result.get("errors", {})
+
+  return BulkWriteResult(
+    inserted=result.get("inserted", 0),
+    matched=result.get("matched", 0),
+    modified=result.get("modified", 0),
+    deleted=result.get("deleted", 0),
+    items=[
+      BulkItemResult(
+        index=index,
+        id=None if index in errors else id,
+        ok=index not in errors,
+        error=errors.get(index),
+      )
+      for index, id in enumerate(ids)
+    ],
+  )
+
+
+@router.post(
+  "/{category}/bulk",
+  status_code=status.HTTP_200_OK,
+  dependencies=[Depends(limit_dependency)],
+  response_model=BulkWriteResult,
+)
+async def bulk_create_products(
+  category: Annotated[str, Path()],
+  products: Annotated[
+    List[ProductCreate], Body(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+  ],
+  user: Annotated[dict, Security(authorize_user, scopes=["seller"])],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+):
+  """
+  Adds products to a category in bulk. Each item gets its own result,
+  so a failing item doesn't reject the others.
+  """
+  products_db = mongo.get_database("products")
+
+  if not await CategoryRegistry.contains(products_db, category):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND, detail="Category not found."
+    )
+
+  if any(product.category != category for product in products):
+    raise HTTPException(
+      status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+      detail="All products must belong to the requested category.",
+    )
+
+  result = await ProductCRUD(products_db).bulk_create(category, products)
+
+  return bulk_write_result(result, result["ids"])
+
+
+@router.patch(
+  "/{category}/bulk",
+  status_code=status.HTTP_200_OK,
+  dependencies=[Depends(limit_dependency)],
+  response_model=BulkWriteResult,
+)
+async def bulk_update_products(
+  category: Annotated[str, Path()],
+  updates: Annotated[
+    List[ProductBulkUpdate],
+    Body(min_length=1, max_length=settings.BULK_MAX_ITEMS),
+  ],
+  user: Annotated[dict, Security(authorize_user, scopes=["seller"])],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+):
+  """
+  Updates products of a category in bulk.
+  """
+  products_db = mongo.get_database("products")
+
+  if not await CategoryRegistry.contains(products_db, category):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND, detail="Category not found."
+    )
+
+  result = await ProductCRUD(products_db).bulk_update_products(
+    category,
+    [(item.id, item.update.model_dump(exclude_unset=True)) for item in updates],
+  )
+  await ProductCache.evict(redis, category, *(item.id for item in updates))
+
+  return bulk_write_result(result, [item.id for item in updates])
+
+
+@router.delete(
+  "/{category}/bulk",
+  status_code=status.HTTP_200_OK,
+  dependencies=[Depends(limit_dependency)],
+  response_model=BulkWriteResult,
+)
+async def bulk_delete_products(
+  category: Annotated[str, Path()],
+  product_ids: Annotated[
+    List[ObjectIdStr], Body(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+  ],
+  user: Annotated[dict, Security(authorize_user, scopes=["admin", "seller"])],
+  mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
+):
+  """
+  Deletes products of a category in bulk by ID.
+  """
+  products_db = mongo.get_database("products")
+
+  if not await CategoryRegistry.contains(products_db, category):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND, detail="Category not found."
+    )
+
+  result = await ProductCRUD(products_db).bulk_delete_products(category, product_ids)
+  await ProductCache.evict(redis, category, *product_ids)
+
+  return bulk_write_result(result, product_ids)
+
+
 @router.get(
   "/{category}",
   status_code=status.HTTP_200_OK,
   response_model=List[ProductItem],
   dependencies=[
-    Security(get_current_user, scopes=["admin"]),
+    Security(authorize_user, scopes=["admin"]),
     Depends(limit_dependency),
   ],
 )
 async def get_all_products(
   category: Annotated[str, Path()],
+  response: Response,
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
-  length: Annotated[Optional[int], Query()] = None,
-  offset: Annotated[int, Query()] = 0,
+  stream: Annotated[Optional[str], Depends(get_stream_format)],
+  fields: Annotated[Optional[List[str]], Depends(get_fields(ProductItem))],
+  length: Annotated[
+    int, Query(ge=1, le=settings.PAGINATION_MAX_LENGTH)
+  ] = settings.PAGINATION_DEFAULT_LENGTH,
+  offset: Annotated[int, Query(ge=0)] = 0,
+  cursor: Annotated[Optional[str], Query()] = None,
+  sort_by: Annotated[Literal["_id", "price", "date"], Query()] = "_id",
+  order: Annotated[Literal["asc", "desc"], Query()] = "asc",
 ):
   """
-  Returns list of all products in a category.
+  Returns a page of products in a category.
+
+  Pages are selected by the `cursor` returned in the `X-Next-Cursor`
+  header of the previous page. `offset` is kept for compatibility,
+  but skipping costs grow with the offset.
+
+  Streams all remaining products for `Accept: application/x-ndjson`
+  or `?stream=true`. Only the requested `fields` are returned if set.
   """
   products_db = mongo.get_database("products")
+  product_crud = ProductCRUD(products_db)
+  direction = ASCENDING if order == "asc" else DESCENDING
+  fields_projection = projection(fields)
+  next_cursor = None
 
-  if not (
-    products := await ProductCRUD(products_db).read_all(
-      category, offset=offset, length=length
+  if stream:
+    return stream_documents(
+      product_crud.stream(
+        category,
+        cursor=cursor,
+        sort_key=sort_by,
+        direction=direction,
+        batch_size=settings.STREAM_BATCH_SIZE,
+        projection=fields_projection,
+      ),
+      None if fields else ProductItem,
+      ndjson=stream == "ndjson",
     )
-  ):
+
+  if offset:
+    products = await product_crud.read_all(
+      category,
+      offset=offset,
+      length=length,
+      sort=sort_spec(sort_by, direction),
+      projection=fields_projection,
+    )
+  else:
+    products, next_cursor = await product_crud.read_page(
+      category,
+      length=length,
+      cursor=cursor,
+      sort_key=sort_by,
+      direction=direction,
+      projection=fields_projection,
+    )
+
+  if not products:
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND, detail="Products not found."
     )
 
+  headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+  if fields:
+    return partial_response(products, headers=headers)
+
+  response.headers.update(headers)
+
   return products
 
 
@@ -91,13 +302,16 @@ async def get_product(
   category: Annotated[str, Path()],
   product_id: Annotated[str, Path()],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Returns product by ID.
   """
   products_db = mongo.get_database("products")
 
-  if not (product := await ProductCRUD(products_db).get_product(category, product_id)):
+  if not (
+    product := await ProductCache.fetch(redis, products_db, category, product_id)
+  ):
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND, detail="Product not found."
     )
@@ -108,14 +322,15 @@ async def get_product(
 @router.patch(
   "/{category}/{product_id}",
   status_code=status.HTTP_200_OK,
-  dependencies=[Security(get_current_user, scopes=["seller"])],
+  dependencies=[Security(authorize_user, scopes=["seller"])],
 )
 async def update_product(
   category: Annotated[str, Path()],
   product_id: Annotated[str, Path()],
   product_update: Annotated[ProductUpdate, Body()],
-  user: Annotated[dict, Security(get_current_user, scopes=["seller"])],
+  user: Annotated[dict, Security(authorize_user, scopes=["seller"])],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Updates product by ID.
@@ -131,19 +346,22 @@ async def update_product(
       status_code=status.HTTP_404_NOT_FOUND, detail="Product not found."
     )
 
+  await ProductCache.evict(redis, category, product_id)
+
   return {"message": "The product has been updated."}
 
 
 @router.delete(
   "/{category}/{product_id}",
   status_code=status.HTTP_200_OK,
-  dependencies=[Security(get_current_user, scopes=["admin", "seller"])],
+  dependencies=[Security(authorize_user, scopes=["admin", "seller"])],
 )
 async def delete_product(
   category: Annotated[str, Path()],
   product_id: Annotated[str, Path()],
-  user: Annotated[dict, Security(get_current_user, scopes=["admin", "seller"])],
+  user: Annotated[dict, Security(authorize_user, scopes=["admin", "seller"])],
   mongo: Annotated[MongoClient, Depends(get_mongo_client)],
+  redis: Annotated[RedisClient, Depends(get_redis_client)],
 ):
   """
   Deletes product by ID.
@@ -155,4 +373,6 @@ async def delete_product(
       status_code=status.HTTP_404_NOT_FOUND, detail="Product not found."
     )
 
+  await ProductCache.evict(redis, category, product_id)
+
   return {"message": "The product was deleted successfully."}
@@ -0,0 +1,682 @@
+import asyncio
+import random
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+  Any,
+  Awaitable,
+  Callable,
+  Dict,
+  Iterable,
+  List,
+  Optional,
+  Tuple,
+  Union,
+)
+
+from core.config import settings
+from core.database import LuaScript, RedisClient
+from core.logger import logger
+
+# Channel of the invalidated keys when client tracking isn't used
+INVALIDATION_CHANNEL = "events:cache:invalidate"
+
+# Sets an entry only if its version isn't older than the cached one
+_SET_IF_NEWER = LuaScript(
+  """
+  local current = tonumber(redis.call("GET", KEYS[2]) or "-1")
+
+  if current > tonumber(ARGV[1]) then
+    return 0
+  end
+
+  redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+  redis.call("SET", KEYS[2], ARGV[1], "EX", ARGV[3])
+
+  return 1
+  """
+)
+
+# Releases a lock only if it's still held by the given token
+_RELEASE_LOCK = LuaScript(
+  """
+  if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+  end
+
+  return 0
+  """
+)
+
+# Replaces a hash entry, if it doesn't exist when ARGV[3] is "1" and,
+# with a version (ARGV[1]), only if it isn't older than the cached one
+_HSET_ENTRY = LuaScript(
+  """
+  if ARGV[3] == "1" and redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+  end
+
+  if ARGV[1] ~= "" then
+    if tonumber(redis.call("GET", KEYS[2]) or "-1") > tonumber(ARGV[1]) then
+      return 0
+    end
+
+    redis.call("SET", KEYS[2], ARGV[1], "EX", ARGV[2])
+  end
+
+  redis.call("DEL", KEYS[1])
+  redis.call("HSET", KEYS[1], unpack(ARGV, 4))
+  redis.call("EXPIRE", KEYS[1], ARGV[2])
+
+  return 1
+  """
+)
+
+# Sets fields of a hash entry if it's cached right before their version,
+# and drops it if an update was missed
+_HSET_FIELDS = LuaScript(
+  """
+  local current = tonumber(redis.call("GET", KEYS[2]) or "-1")
+  local version = tonumber(ARGV[1])
+
+  if current >= version then
+    return 0
+  end
+
+  if current ~= version - 1
+    or redis.call("EXISTS", KEYS[1]) == 0
+    or redis.call("HEXISTS", KEYS[1], ARGV[2]) == 1 then
+    redis.call("DEL", KEYS[1])
+
+    return 0
+  end
+
+  if #ARGV > 2 then
+    redis.call("HSET", KEYS[1], unpack(ARGV, 3))
+  end
+
+  redis.call("SET", KEYS[2], ARGV[1], "KEEPTTL")
+
+  return 1
+  """
+)
+
+
+class LocalCache:
+  """
+  In-process LRU tier in front of Redis, bounded by the number of
+  entries and their total size. Entries are only served while Redis
+  invalidations are received (see `RedisClient.track`), and expire
+  after `ttl` seconds in case an invalidation is lost anyway.
+  """
+
+  def __init__(self, *, max_entries: int, max_bytes: int, ttl: float):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.size = 0
+    # Bumped on every invalidation, see `set`
+    self.epoch = 0
+    self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  @property
+  def enabled(self) -> bool:
+    return RedisClient.tracking
+
+  def get(self, key: str) -> Optional[bytes]:
+    """Returns the cached value of a key, if any."""
+    if not self.enabled or (entry := self._entries.get(key)) is None:
+      return None
+
+    value, expires_at = entry
+
+    if time.monotonic() > expires_at:
+      self._pop(key)
+
+      return None
+
+    self._entries.move_to_end(key)
+
+    return value
+
+  def set(self, key: str, value: bytes, *, epoch: int):
+    """
+    Caches the value of a key read from Redis. The value is dropped if
+    any invalidation arrived since `epoch` was read before the read, as
+    it may be older than the invalidation.
+    """
+    if not self.enabled or epoch != self.epoch or len(value) > self.max_bytes:
+      return
+
+    self._pop(key)
+    self._entries[key] = (value, time.monotonic() + self.ttl)
+    self.size += len(value)
+
+    while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+      self._pop(next(iter(self._entries)))
+
+  def invalidate(self, keys: Union[Iterable[str], str, bytes, None]):
+    """Drops the given keys, or every key for `None`."""
+    self.epoch += 1
+
+    if keys is None:
+      self._entries.clear()
+      self.size = 0
+
+      return
+
+    if isinstance(keys, (str, bytes)):
+      keys = [keys]
+
+    for key in keys:
+      self._pop(key.decode() if isinstance(key, bytes) else key)
+
+  def _pop(self, key: str):
+    if (entry := self._entries.pop(key, None)) is not None:
+      self.size -= len(entry[0])
+
+
+local_cache = LocalCache(
+  max_entries=settings.LOCAL_CACHE_MAX_ENTRIES,
+  max_bytes=settings.LOCAL_CACHE_MAX_BYTES,
+  ttl=settings.LOCAL_CACHE_TTL_SECONDS,
+)
+
+
+@dataclass
+class CacheEntry:
+  value: Any
+  stale: bool = False
+
+
+class ReadThroughCache:
+  """
+  Redis read-through cache of values encoded by `RedisClient.codec`.
+
+  Entries are fresh for `ttl` seconds (with random `jitter`), then
+  served stale for up to `stale_ttl` seconds while a single task
+  refreshes them. Values missing from the source are cached for
+  `negative_ttl` seconds. Concurrent loads of a key are coalesced
+  in-process and across workers through a short Redis lock.
+
+  With a `version_key`, entries are written only if the `version_field`
+  of the value isn't older than the cached one. With `local`, entries
+  are also cached in worker memory by `local_cache`.
+  """
+
+  def __init__(
+    self,
+    key: str,
+    *,
+    ttl: int,
+    stale_ttl: int = 0,
+    negative_ttl: int = 0,
+    jitter: float = 0.0,
+    lock_ttl: float = 5.0,
+    poll_interval: float = 0.05,
+    version_key: Optional[str] = None,
+    version_field: str = "version",
+    local: bool = False,
+  ):
+    self._key = key
+    self._version_key = version_key
+    self.version_field = version_field
+    self.ttl = ttl
+    self.stale_ttl = stale_ttl
+    self.negative_ttl = negative_ttl
+    self.jitter = jitter
+    self.lock_ttl = lock_ttl
+    self.poll_interval = poll_interval
+    self._inflight: Dict[str, asyncio.Future] = {}
+    self.local = local and settings.LOCAL_CACHE_INVALIDATION != "off"
+
+    if self.local:
+      RedisClient.track(key.split("{")[0], local_cache.invalidate)
+
+      if settings.LOCAL_CACHE_INVALIDATION == "pubsub":
+        RedisClient.subscribe(INVALIDATION_CHANNEL, local_cache.invalidate)
+
+  def key(self, id: str) -> str:
+    return self._key.format(id)
+
+  def lock_key(self, id: str) -> str:
+    return f"{self.key(id)}:lock"
+
+  def _soft_ttl(self) -> float:
+    return self.ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+  async def get(
+    self, redis: RedisClient, id: str, fields: Optional[List[str]] = None
+  ) -> Optional[CacheEntry]:
+    """
+    Returns the cached entry, if any, with only the given `fields` of
+    its value. Entries of missing values hold `None`.
+    """
+    key = self.key(id)
+
+    if self.local and (cached := local_cache.get(key)) is not None:
+      entry = self._decode(key, cached)
+    else:
+      entry = await self._read(redis, id, fields)
+
+    if entry is not None:
+      entry.value = self._project(entry.value, fields)
+
+    return entry
+
+  async def _read(
+    self, redis: RedisClient, id: str, fields: Optional[List[str]]
+  ) -> Optional[CacheEntry]:
+    """Reads an entry from Redis, caching it in worker memory."""
+    key, epoch = self.key(id), local_cache.epoch
+
+    if not (cached := await redis.get(key)):
+      return None
+
+    if self.local:
+      local_cache.set(key, cached, epoch=epoch)
+
+    return self._decode(key, cached)
+
+  def _decode(self, key: str, cached: bytes) -> Optional[CacheEntry]:
+    """
+    Decodes an entry. Values cached without an envelope are considered
+    fresh.
+    """
+    try:
+      data = RedisClient.codec.decode(cached)
+    except Exception as e:
+      logger.error(
+        {
+          "message": f"[x] An error occured while decoding {key} cache.",
+          "detail": str(e),
+        },
+        exc_info=True,
+      )
+
+      return None
+
+    if isinstance(data, dict) and data.keys() == {"v", "s"}:
+      return CacheEntry(data["v"], stale=time.time() > data["s"])
+
+    return CacheEntry(data)
+
+  @staticmethod
+  def _project(value: Optional[Any], fields: Optional[List[str]]) -> Optional[Any]:
+    """Returns only the given fields of a value."""
+    if fields is None or value is None:
+      return value
+
+    return {field: value[field] for field in fields if field in value}
+
+  async def set(self, redis: RedisClient, id: str, value: Any) -> bool:
+    """Caches a value. Returns whether it was written."""
+    soft_ttl, version = self._soft_ttl(), None
+    ttl = int(soft_ttl + self.stale_ttl) or 1
+
+    if self._version_key:
+      value = dict(value)
+      version = value.pop(self.version_field, 0)
+
+    if written := await self._write(
+      redis, id, value, version=version, soft_expiry=time.time() + soft_ttl, ttl=ttl
+    ):
+      await self._invalidate_local(redis, self.key(id))
+
+    return bool(written)
+
+  async def _write(
+    self,
+    redis: RedisClient,
+    id: str,
+    value: Any,
+    *,
+    version: Optional[int],
+    soft_expiry: float,
+    ttl: int,
+  ) -> bool:
+    """Writes an entry to Redis."""
+    payload = RedisClient.codec.encode({"v": value, "s": soft_expiry})
+
+    if version is None:
+      return await redis.set(self.key(id), payload, ex=ttl)
+
+    return await _SET_IF_NEWER(
+      redis,
+      keys=[self.key(id), self._version_key.format(id)],
+      args=[version, payload, ttl],
+    )
+
+  async def write(
+    self,
+    redis: RedisClient,
+    id: str,
+    value: Any,
+    *,
+    fields: Optional[Iterable[str]] = None,
+  ) -> bool:
+    """
+    Caches an updated value whose `fields` changed. Returns whether it
+    was written.
+    """
+    return await self.set(redis, id, value)
+
+  async def set_missing(
+    self, redis: RedisClient, id: str, *, replace: bool = False
+  ) -> bool:
+    """
+    Caches the absence of a value. Unless `replace` is set, a value
+    cached meanwhile is kept.
+    """
+    if not self.negative_ttl:
+      if replace:
+        await self.evict(redis, id)
+
+      return False
+
+    soft_expiry = time.time() + self.negative_ttl
+
+    if written := await self._write_missing(
+      redis, id, soft_expiry=soft_expiry, replace=replace
+    ):
+      await self._invalidate_local(redis, self.key(id))
+
+    return bool(written)
+
+  async def _write_missing(
+    self, redis: RedisClient, id: str, *, soft_expiry: float, replace: bool
+  ) -> bool:
+    """Writes the entry of a missing value to Redis."""
+    payload = RedisClient.codec.encode({"v": None, "s": soft_expiry})
+
+    return await redis.set(self.key(id), payload, ex=self.negative_ttl, nx=not replace)
+
+  async def evict(self, redis: RedisClient, *ids: str, forget_version: bool = False):
+    """
+    Removes entries from the cache. With `forget_version`, their cached
+    versions are removed too, for values deleted from the source whose
+    versions start over when they're created again.
+    """
+    keys = [self.key(id) for id in ids if id]
+    versions = (
+      [self._version_key.format(id) for id in ids if id]
+      if forget_version and self._version_key
+      else []
+    )
+
+    await redis.delete(*keys, *versions)
+    await self._invalidate_local(redis, *keys)
+
+  async def _invalidate_local(self, redis: RedisClient, *keys: str):
+    """
+    Drops written keys from the local tier of this worker right away,
+    and of the other workers when client tracking isn't used.
+    """
+    if not self.local:
+      return
+
+    local_cache.invalidate(keys)
+
+    if settings.LOCAL_CACHE_INVALIDATION == "pubsub":
+      for key in keys:
+        await redis.publish(INVALIDATION_CHANNEL, key)
+
+  async def fetch(
+    self,
+    redis: RedisClient,
+    id: str,
+    loader: Callable[[], Awaitable[Optional[Any]]],
+    *,
+    fields: Optional[List[str]] = None,
+  ) -> Optional[Any]:
+    """
+    Returns the cached value, or only its `fields`, loading it with
+    `loader` on misses. Stale values are returned as is while they're
+    refreshed in the background.
+    """
+    if (entry := await self.get(redis, id, fields)) is not None:
+      if entry.stale:
+        self._single_flight(f"refresh:{id}", lambda: self._refresh(redis, id, loader))
+
+      return entry.value
+
+    value = await asyncio.shield(
+      self._single_flight(id, lambda: self._load(redis, id, loader))
+    )
+
+    return self._project(value, fields)
+
+  def _single_flight(
+    self, name: str, load: Callable[[], Awaitable[Any]]
+  ) -> asyncio.Future:
+    """Returns the pending task of a name, starting it if needed."""
+    if (task := self._inflight.get(name)) is None:
+      task = self._inflight[name] = asyncio.ensure_future(load())
+      task.add_done_callback(lambda _: self._inflight.pop(name, None))
+
+    return task
+
+  def _unversioned(self, value: Optional[Any]) -> Optional[Any]:
+    """Returns a loaded value as it's cached, without its version."""
+    if self._version_key and value is not None:
+      value = {k: v for k, v in value.items() if k != self.version_field}
+
+    return value
+
+  async def _store(
+    self,
+    redis: RedisClient,
+    id: str,
+    value: Optional[Any],
+    *,
+    replace: bool = False,
+  ):
+    """Caches a loaded value or its absence."""
+    if value is None:
+      await self.set_missing(redis, id, replace=replace)
+    else:
+      await self.set(redis, id, value)
+
+  async def _load(
+    self,
+    redis: RedisClient,
+    id: str,
+    loader: Callable[[], Awaitable[Optional[Any]]],
+  ) -> Optional[Any]:
+    """
+    Loads a missing value. Only the worker holding the lock queries the
+    source, the others wait for its result until the lock expires.
+    """
+    lock, token = self.lock_key(id), secrets.token_hex(8)
+
+    if await redis.set(lock, token, px=int(self.lock_ttl * 1000), nx=True):
+      try:
+        value = await loader()
+        await self._store(redis, id, value)
+
+        return self._unversioned(value)
+      finally:
+        await _RELEASE_LOCK(redis, keys=[lock], args=[token])
+
+    deadline = time.monotonic() + self.lock_ttl
+
+    while time.monotonic() < deadline:
+      await asyncio.sleep(self.poll_interval)
+
+      if (entry := await self.get(redis, id)) is not None:
+        return entry.value
+
+    value = await loader()
+    await self._store(redis, id, value)
+
+    return self._unversioned(value)
+
+  async def _refresh(
+    self,
+    redis: RedisClient,
+    id: str,
+    loader: Callable[[], Awaitable[Optional[Any]]],
+  ):
+    """Refreshes a stale value, unless another worker already does."""
+    lock, token = self.lock_key(id), secrets.token_hex(8)
+
+    try:
+      if not await redis.set(lock, token, px=int(self.lock_ttl * 1000), nx=True):
+        return
+
+      try:
+        await self._store(redis, id, await loader(), replace=True)
+      finally:
+        await _RELEASE_LOCK(redis, keys=[lock], args=[token])
+    except Exception as e:
+      logger.error(
+        {
+          "message": f"[x] Failed to refresh {self.key(id)} cache.",
+          "detail": str(e),
+        },
+        exc_info=True,
+      )
+
+
+class HashReadThroughCache(ReadThroughCache):
+  """
+  Read-through cache storing each field of the (dict) values in a Redis
+  hash, so readers can fetch some fields with HMGET and updates only
+  write the changed fields (see `write`). Fields are encoded
+  separately by `RedisClient.codec`.
+  """
+
+  # Fields holding the soft expiry and the absence of the value
+  SOFT_EXPIRY = "~s"
+  MISSING = "~missing"
+
+  def _keys(self, id: str) -> List[str]:
+    if self._version_key:
+      return [self.key(id), self._version_key.format(id)]
+
+    return [self.key(id)]
+
+  @staticmethod
+  def _pairs(value: dict) -> List[Any]:
+    """Flattens the fields of a value into HSET arguments."""
+    pairs = []
+
+    for field, item in value.items():
+      pairs.extend([field, RedisClient.codec.encode(item)])
+
+    return pairs
+
+  async def _read(
+    self, redis: RedisClient, id: str, fields: Optional[List[str]]
+  ) -> Optional[CacheEntry]:
+    """
+    Reads the given fields of an entry, or the whole entry, which is
+    then also cached in worker memory.
+    """
+    key, epoch = self.key(id), local_cache.epoch
+    decode = RedisClient.codec.decode
+
+    if fields is not None:
+      names = [self.SOFT_EXPIRY, self.MISSING, *fields]
+      mapping = dict(zip(names, await redis.hmget(key, *names)))
+    else:
+      mapping = await redis.hgetall(key)
+
+    try:
+      data = {
+        field.decode() if isinstance(field, bytes) else field: decode(item)
+        for field, item in mapping.items()
+        if item is not None
+      }
+    except Exception as e:
+      logger.error(
+        {
+          "message": f"[x] An error occured while decoding {key} cache.",
+          "detail": str(e),
+        },
+        exc_info=True,
+      )
+
+      return None
+
+    if (soft_expiry := data.pop(self.SOFT_EXPIRY, None)) is None:
+      return None
+
+    value = None if data.pop(self.MISSING, False) else data
+
+    if self.local and fields is None:
+      local_cache.set(
+        key, RedisClient.codec.encode({"v": value, "s": soft_expiry}), epoch=epoch
+      )
+
+    return CacheEntry(value, stale=time.time() > soft_expiry)
+
+  async def _write(
+    self,
+    redis: RedisClient,
+    id: str,
+    value: dict,
+    *,
+    version: Optional[int],
+    soft_expiry: float,
+    ttl: int,
+  ) -> bool:
+    return await _HSET_ENTRY(
+      redis,
+      keys=self._keys(id),
+      args=[
+        "" if version is None else version,
+        ttl,
+        0,
+        *self._pairs({**value, self.SOFT_EXPIRY: soft_expiry}),
+      ],
+    )
+
+  async def _write_missing(
+    self, redis: RedisClient, id: str, *, soft_expiry: float, replace: bool
+  ) -> bool:
+    return await _HSET_ENTRY(
+      redis,
+      keys=[self.key(id)],
+      args=[
+        "",
+        self.negative_ttl,
+        0 if replace else 1,
+        *self._pairs({self.MISSING: True, self.SOFT_EXPIRY: soft_expiry}),
+      ],
+    )
+
+  async def write(
+    self,
+    redis: RedisClient,
+    id: str,
+    value: dict,
+    *,
+    fields: Optional[Iterable[str]] = None,
+  ) -> bool:
+    """
+    Caches an updated value. With a `version_key`, only its changed
+    `fields` are written, if the entry is cached at the previous
+    version; otherwise it's dropped, since an update was missed.
+    """
+    if fields is None or not self._version_key:
+      return await self.set(redis, id, value)
+
+    changed = {
+      field: value[field]
+      for field in fields
+      if field in value and field != self.version_field
+    }
+    written = await _HSET_FIELDS(
+      redis,
+      keys=self._keys(id),
+      args=[value.get(self.version_field, 0), self.MISSING, *self._pairs(changed)],
+    )
+    await self._invalidate_local(redis, self.key(id))
+
+    return bool(written)
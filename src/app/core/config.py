@@ -1,4 +1,4 @@
-from typing import Annotated, Any, Dict, List, Optional, TypeVar
+from typing import Annotated, Any, Dict, List, Literal, Optional, TypeVar
 
 from pydantic import AnyUrl, BaseModel, BeforeValidator, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -59,6 +59,20 @@ class Settings(BaseSettings):
   MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 10000
   MONGO_RETRY_WRITES: bool = True
 
+  # Reconcile the indexes declared by CRUD classes at startup, building
+  # them in the background without blocking application startup
+  MONGO_SYNC_INDEXES: bool = True
+  MONGO_INDEX_BACKGROUND: bool = True
+
+  # User storage settings
+  # - "per_role": one collection per role (admins, sellers, customers)
+  # - "single": all users in one collection with an indexed `role` field
+  USERS_STORAGE_MODE: Literal["per_role", "single"] = "per_role"
+  USERS_COLLECTION: str = "accounts"
+  # Also look up profiles missing the lowercase lookup fields by their
+  # raw username and email, until `manage.py backfill-users` has run
+  USERS_LOOKUP_FALLBACK: bool = False
+
   @computed_field  # type: ignore[prop-decorator]
   @property
   def MONGO_URI(self) -> str:
@@ -85,10 +99,74 @@ class Settings(BaseSettings):
   REDIS_PASSWORD: str = ""
   REDIS_DB: int = 0
 
+  REDIS_PUBSUB_RETRY_SECONDS: int = 5
+  # Send the commands issued in the same event loop iteration together
+  REDIS_AUTO_PIPELINE: bool = True
+
   CACHE_EXPIRE_MINUTES: int = 60
+  # Expired entries are served while refreshed for up to this long
+  CACHE_STALE_SECONDS: int = 60
+  # Lookups of missing entries are cached for this long
+  CACHE_NEGATIVE_SECONDS: int = 30
+  # Fraction of the TTL randomized to spread expirations
+  CACHE_TTL_JITTER: float = 0.1
+  # Lock held by the worker loading a missing entry
+  CACHE_LOCK_SECONDS: float = 5.0
+  # Encoding of cached values, compressed from the given size
+  CACHE_CODEC: Literal["msgpack", "orjson", "json"] = "msgpack"
+  CACHE_COMPRESSION: Literal["zstd", "zlib", "none"] = "zstd"
+  CACHE_COMPRESSION_MIN_BYTES: int = 1024
+  # Write updated profiles to the cache instead of evicting them
+  PROFILE_CACHE_WRITE_THROUGH: bool = True
+  # Layout of cached profiles
+  # - "string": one encoded value per profile
+  # - "hash": one hash field per profile field, updated field by field
+  PROFILE_CACHE_LAYOUT: Literal["string", "hash"] = "string"
+
+  # In-process tier of the profile and product caches, kept coherent
+  # with Redis client tracking or, without it, pub/sub ("off" disables)
+  LOCAL_CACHE_INVALIDATION: Literal["tracking", "pubsub", "off"] = "tracking"
+  LOCAL_CACHE_MAX_ENTRIES: int = 10_000
+  LOCAL_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+  LOCAL_CACHE_TTL_SECONDS: float = 60.0
+
+  # Pagination of list endpoints
+  PAGINATION_DEFAULT_LENGTH: int = 100
+  PAGINATION_MAX_LENGTH: int = 1000
+
+  # Cursor batch size of streamed list responses
+  STREAM_BATCH_SIZE: int = 500
+
+  # Bulk writes: operations per `bulk_write` call and items per request
+  BULK_WRITE_BATCH_SIZE: int = 1000
+  BULK_MAX_ITEMS: int = 10000
+
+  # Product categories are cached in-process and refreshed after the TTL
+  CATEGORY_REGISTRY_TTL_SECONDS: int = 300
 
   # Rate limits
+  # - "gcra": one Lua script call and key per limit, with `RateLimit-*` headers
+  # - "moving-window": SlowAPI moving windows, one list entry per request
+  RATE_LIMIT_STRATEGY: Literal["gcra", "moving-window"] = "gcra"
   RATE_LIMIT_ANONYMOUS: str = "100/minute"
+  # Count anonymous requests of the "gcra" strategy in worker memory,
+  # synchronized with Redis this often. Between synchronizations each
+  # worker admits at most this fraction of a limit per client, which
+  # bounds how much the limit may be exceeded by.
+  RATE_LIMIT_ANONYMOUS_LOCAL: bool = False
+  RATE_LIMIT_LOCAL_FLUSH_MS: int = 20
+  RATE_LIMIT_LOCAL_ERROR: float = 0.05
+  # Storage of the "gcra" limits
+  # - "redis": checked by a Lua script in Redis
+  # - "shared_memory": checked in a memory-mapped file shared by the
+  #   workers of the host, split in lock stripes. The requests admitted
+  #   by a worker are added to the Redis keys this often so the limits
+  #   hold across hosts (0 limits every host separately).
+  RATE_LIMIT_STORAGE: Literal["redis", "shared_memory"] = "redis"
+  RATE_LIMIT_SHARED_PATH: str = "/dev/shm/fastapi-rate-limits"
+  RATE_LIMIT_SHARED_SLOTS: int = 65_536
+  RATE_LIMIT_SHARED_STRIPES: int = 64
+  RATE_LIMIT_SHARED_SYNC_MS: int = 100
   RATE_LIMIT_SELLER: str = "500/minute"
   RATE_LIMIT_CUSTOMER: str = "200/minute"
 
@@ -99,6 +177,11 @@ class Settings(BaseSettings):
 
   SECRET_KEY: str = "changeme"
 
+  # Password hashing threads, and hashes queued or running before
+  # requests fail with 503
+  PASSWORD_HASH_WORKERS: int = 4
+  PASSWORD_HASH_MAX_PENDING: int = 64
+
   @computed_field  # type: ignore[prop-decorator]
   @property
   def RATE_LIMITS(self) -> Dict[str, str]:
@@ -108,12 +191,27 @@ class Settings(BaseSettings):
       "customers": self.RATE_LIMIT_ANONYMOUS,
     }
 
-  # JWT settings
+  # JWT settings. JWT_ALGORITHM applies to RSA keys, while EC and EdDSA
+  # keys always use the algorithm of their curve
   JWT_ALGORITHM: str = "RS256"
   JWT_EXPIRE_MINUTES: int = 60
+  # Verified tokens whose claims are cached in worker memory (0 disables)
+  JWT_CACHE_MAX_ENTRIES: int = 10_000
+  # Revoked tokens are known by every worker and reloaded from Redis
+  # this often, scanning this many blacklist keys per call
+  REVOCATION_RESYNC_SECONDS: int = 300
+  REVOCATION_SCAN_COUNT: int = 1000
+  # Storage of the revocations in Redis
+  # - "keys": one blacklist key per revoked token
+  # - "buckets": sets of jti fingerprints per expiry minute, split in shards
+  REVOCATION_STORAGE: Literal["keys", "buckets"] = "keys"
+  REVOCATION_BUCKET_SHARDS: int = 8
 
   PRIVATE_KEY_PEM: str
   PUBLIC_KEY_PEM: str
+  # Public keys of previous private keys, verifying their tokens until
+  # they expire (JSON list)
+  JWT_PREVIOUS_PUBLIC_KEYS_PEM: List[str] = []
 
 
 settings = Settings()
@@ -1,4 +1,4 @@
-__all__ = ["MongoClient", "RedisClient"]
+__all__ = ["LuaScript", "MongoClient", "RedisClient"]
 
 from .mongo import MongoClient
-from .redis import RedisClient
+from .redis import LuaScript, RedisClient
@@ -0,0 +1,138 @@
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Union
+
+from bson import ObjectId
+from core.logger import logger
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# Encoded values start with a header byte `0x10 | compression << 2 | format`,
+# which can't start a JSON document, so values cached as JSON text are
+# still decoded
+_HEADER = 0x10
+_MSGPACK, _JSON = 1, 2
+_NONE, _ZLIB, _ZSTD = 0, 1, 2
+
+# msgpack extension types
+_EXT_OBJECT_ID = 1
+_EXT_NAIVE_DATETIME = 2
+
+
+def _msgpack_default(obj: Any) -> Any:
+  if isinstance(obj, ObjectId):
+    return msgpack.ExtType(_EXT_OBJECT_ID, obj.binary)
+
+  if isinstance(obj, datetime):
+    if obj.tzinfo is not None:
+      return msgpack.Timestamp.from_datetime(obj)
+
+    # MongoDB returns naive UTC datetimes, keep them naive
+    timestamp = msgpack.Timestamp.from_datetime(obj.replace(tzinfo=timezone.utc))
+
+    return msgpack.ExtType(_EXT_NAIVE_DATETIME, timestamp.to_bytes())
+
+  return str(obj)
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+  if code == _EXT_OBJECT_ID:
+    return ObjectId(data)
+
+  if code == _EXT_NAIVE_DATETIME:
+    return msgpack.Timestamp.from_bytes(data).to_datetime().replace(tzinfo=None)
+
+  return msgpack.ExtType(code, data)
+
+
+class CacheCodec:
+  """
+  Encodes cached values to bytes with msgpack, keeping ObjectIds and
+  datetimes, or JSON (with orjson when installed), and compresses
+  values of at least `compress_min_bytes` with zstd or zlib.
+  Unavailable libraries fall back to JSON and zlib.
+  """
+
+  def __init__(
+    self,
+    format: str = "msgpack",
+    compression: str = "zstd",
+    compress_min_bytes: int = 1024,
+  ):
+    if format == "msgpack" and msgpack is None:
+      logger.warning("msgpack isn't installed, caching values as JSON.")
+      format = "orjson"
+
+    if compression == "zstd" and zstandard is None:
+      logger.warning("zstandard isn't installed, compressing values with zlib.")
+      compression = "zlib"
+
+    self.format = _MSGPACK if format == "msgpack" else _JSON
+    self.compression = {"none": _NONE, "zlib": _ZLIB, "zstd": _ZSTD}[compression]
+    self.compress_min_bytes = compress_min_bytes
+
+    if zstandard is not None:
+      self._zstd_compressor = zstandard.ZstdCompressor()
+      self._zstd_decompressor = zstandard.ZstdDecompressor()
+    else:
+      self._zstd_decompressor = None
+
+  def _serialize(self, value: Any) -> bytes:
+    if self.format == _MSGPACK:
+      return msgpack.packb(value, default=_msgpack_default, datetime=False)
+
+    if orjson is not None:
+      return orjson.dumps(value, default=str)
+
+    return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+  def encode(self, value: Any) -> bytes:
+    """Encodes a value to bytes."""
+    data, compression = self._serialize(value), _NONE
+
+    if self.compression and len(data) >= self.compress_min_bytes:
+      if self.compression == _ZSTD:
+        data = self._zstd_compressor.compress(data)
+      else:
+        data = zlib.compress(data)
+
+      compression = self.compression
+
+    return bytes([_HEADER | compression << 2 | self.format]) + data
+
+  def decode(self, data: Union[bytes, str]) -> Any:
+    """Decodes a value encoded by any codec, or a JSON document."""
+    if isinstance(data, str):
+      return json.loads(data)
+
+    if not data or data[0] & 0xF0 != _HEADER:
+      return orjson.loads(data) if orjson is not None else json.loads(data)
+
+    header, data = data[0], data[1:]
+
+    if (compression := header >> 2 & 0b11) == _ZSTD:
+      if self._zstd_decompressor is None:
+        raise ValueError("zstandard is required to decode the value.")
+
+      data = self._zstd_decompressor.decompress(data)
+    elif compression == _ZLIB:
+      data = zlib.decompress(data)
+
+    if header & 0b11 == _MSGPACK:
+      return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, timestamp=3)
+
+    return orjson.loads(data) if orjson is not None else json.loads(data)
@@ -1,15 +1,134 @@
-from typing import Optional
+import asyncio
+import hashlib
+import inspect
+import time
+from typing import (
+  Any,
+  Callable,
+  Dict,
+  List,
+  Optional,
+  Sequence,
+  Set,
+  Tuple,
+  Union,
+)
 
 import redis.asyncio as aioredis
 from core.config import settings
 from core.logger import logger
 from core.security.utils import DBConnection
+from redis.asyncio.client import Pipeline
+from redis.asyncio.connection import Connection
+from redis.exceptions import NoScriptError
+
+from .codecs import CacheCodec
+
+
+class LuaScript:
+  """
+  Lua script run with EVALSHA, falling back to EVAL when the script
+  isn't cached by the server yet (e.g. after a restart or failover).
+  """
+
+  def __init__(self, source: str):
+    self.source = source
+    self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+  async def __call__(
+    self,
+    redis: aioredis.Redis,
+    keys: Sequence[str] = (),
+    args: Sequence[Any] = (),
+  ) -> Any:
+    try:
+      return await redis.evalsha(self.sha, len(keys), *keys, *args)
+    except NoScriptError:
+      return await redis.eval(self.source, len(keys), *keys, *args)
+
+
+class AutoPipelineRedis(aioredis.Redis):
+  """
+  Redis client sending the commands issued during the same event loop
+  iteration as one pipeline, so concurrent coroutines share a round
+  trip. Errors are raised by the command that caused them.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._queue: List[Tuple[tuple, dict, asyncio.Future]] = []
+    self._batches: Set[asyncio.Task] = set()
+
+  async def execute_command(self, *args, **options) -> Any:
+    loop = asyncio.get_running_loop()
+
+    # The batch is sent once the ready coroutines have issued their commands
+    if not self._queue:
+      loop.call_soon(self._flush)
+
+    self._queue.append((args, options, future := loop.create_future()))
+
+    return await future
+
+  def _flush(self):
+    batch, self._queue = self._queue, []
+    task = asyncio.ensure_future(self._send(batch))
+    self._batches.add(task)
+    task.add_done_callback(self._batches.discard)
+
+  async def _send(self, batch: List[Tuple[tuple, dict, asyncio.Future]]):
+    try:
+      try:
+        if len(batch) == 1:
+          args, options, _ = batch[0]
+          results = [await super().execute_command(*args, **options)]
+        else:
+          async with self.pipeline(transaction=False) as pipe:
+            for args, options, _ in batch:
+              pipe.execute_command(*args, **options)
+
+            results = await pipe.execute(raise_on_error=False)
+      except Exception as e:
+        results = [e] * len(batch)
+
+      for (_, _, future), result in zip(batch, results):
+        if future.done():
+          continue
+
+        if isinstance(result, Exception):
+          future.set_exception(result)
+        else:
+          future.set_result(result)
+    finally:
+      # Commands of a cancelled batch are cancelled too
+      for _, _, future in batch:
+        if not future.done():
+          future.cancel()
 
 
 class RedisClient(DBConnection):
   _instance: Optional["RedisClient"] = None
   _client: Optional[aioredis.Redis] = None
 
+  # Pub/sub handlers by channel, served by a single listener task
+  _handlers: Dict[str, List[Callable[[Any], Any]]] = {}
+  _listener: Optional[asyncio.Task] = None
+
+  # Encodes the cached values, which are stored and returned as bytes
+  codec = CacheCodec(
+    settings.CACHE_CODEC,
+    settings.CACHE_COMPRESSION,
+    settings.CACHE_COMPRESSION_MIN_BYTES,
+  )
+
+  # Key prefixes whose invalidations are redirected to the listener
+  INVALIDATION_CHANNEL = "__redis__:invalidate"
+  _tracked_prefixes: Set[str] = set()
+  # Whether the listener currently receives the invalidations
+  tracking: bool = False
+  # Monotonic time the listener last subscribed, `None` while it's down
+  subscribed_at: Optional[float] = None
+
   @classmethod
   def __new__(cls, *args, **kwargs):
     """Implement singleton pattern."""
@@ -24,12 +143,15 @@ class RedisClient(DBConnection):
     Establish Redis connection.
     """
     try:
-      cls._client = aioredis.Redis(
+      client_class = (
+        AutoPipelineRedis if settings.REDIS_AUTO_PIPELINE else aioredis.Redis
+      )
+      cls._client = client_class(
         host=settings.REDIS_HOST,
         port=settings.REDIS_PORT,
         username=settings.REDIS_USERNAME,
         password=settings.REDIS_PASSWORD,
-        decode_responses=True,
+        decode_responses=False,
         db=settings.REDIS_DB,
       )
       alive = await cls._client.ping()
@@ -63,6 +185,10 @@ class RedisClient(DBConnection):
     """
     Close Redis connection.
     """
+    if cls._listener is not None:
+      cls._listener.cancel()
+      cls._listener = None
+
     if cls._client is not None:
       try:
         await cls._client.aclose()
@@ -78,6 +204,134 @@ class RedisClient(DBConnection):
       finally:
         cls._client = None
 
+  @classmethod
+  def subscribe(cls, channel: str, handler: Callable[[Any], Any]):
+    """
+    Registers a handler called with the data of every message published
+    on the channel. Handlers may be coroutine functions.
+    """
+    if handler not in (handlers := cls._handlers.setdefault(channel, [])):
+      handlers.append(handler)
+
+  @classmethod
+  def track(cls, prefix: str, handler: Callable[[Any], Any]):
+    """
+    Registers a handler called with the keys starting with `prefix`
+    whenever they're modified or expire, or with `None` when tracked
+    keys may have been missed (e.g. flushes or listener reconnects).
+    Keys are tracked with server-assisted client-side caching in
+    broadcasting mode.
+    """
+    cls._tracked_prefixes.add(prefix)
+    cls.subscribe(cls.INVALIDATION_CHANNEL, handler)
+
+  @classmethod
+  async def _enable_tracking(cls, pubsub) -> Connection:
+    """
+    Redirects the invalidations of the tracked prefixes to the pub/sub
+    connection. Returns the connection holding the tracking state, which
+    lasts until it's closed.
+    """
+    await pubsub.connect()
+    await pubsub.connection.send_command("CLIENT", "ID")
+    client_id = await pubsub.connection.read_response()
+
+    prefixes = []
+
+    for prefix in sorted(cls._tracked_prefixes):
+      prefixes.extend(["PREFIX", prefix])
+
+    tracker = cls._client.connection_pool.make_connection()
+
+    try:
+      await tracker.connect()
+      await tracker.send_command(
+        "CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST", *prefixes
+      )
+      await tracker.read_response()
+    except Exception:
+      await tracker.disconnect()
+      raise
+
+    return tracker
+
+  @classmethod
+  async def _dispatch(cls, channel: str, data: Any):
+    """Calls the handlers of a channel with the message data."""
+    for handler in cls._handlers.get(channel, []):
+      try:
+        if inspect.isawaitable(result := handler(data)):
+          await result
+      except Exception as e:
+        logger.error(
+          {
+            "message": f"[x] Pub/sub handler failed on channel {channel}.",
+            "detail": str(e),
+          },
+          exc_info=True,
+        )
+
+  @classmethod
+  def start_listener(cls):
+    """Starts the task dispatching pub/sub messages to the handlers."""
+    if cls._listener is None and cls._handlers:
+      cls._listener = asyncio.create_task(cls._listen())
+
+  @classmethod
+  async def _listen(cls):
+    """Listens on the subscribed channels, reconnecting on failures."""
+    while True:
+      pubsub, tracker = cls._client.pubsub(), None
+
+      try:
+        if cls._tracked_prefixes and settings.LOCAL_CACHE_INVALIDATION == "tracking":
+          try:
+            tracker = await cls._enable_tracking(pubsub)
+          except aioredis.ResponseError as e:
+            logger.warning(
+              {
+                "message": "[x] Redis client tracking is unavailable.",
+                "detail": str(e),
+              }
+            )
+
+        await pubsub.subscribe(*cls._handlers)
+        cls.subscribed_at = time.monotonic()
+        cls.tracking = tracker is not None or (
+          settings.LOCAL_CACHE_INVALIDATION == "pubsub"
+        )
+
+        async for message in pubsub.listen():
+          if message["type"] != "message":
+            continue
+
+          channel = message["channel"]
+
+          if isinstance(channel, bytes):
+            channel = channel.decode()
+
+          await cls._dispatch(channel, message["data"])
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(
+          {"message": "[x] Redis pub/sub listener disconnected.", "detail": str(e)}
+        )
+      finally:
+        # Invalidations may be missed until the listener is back
+        cls.subscribed_at = None
+
+        if cls.tracking:
+          cls.tracking = False
+          await cls._dispatch(cls.INVALIDATION_CHANNEL, None)
+
+        if tracker is not None:
+          await tracker.disconnect()
+
+        await pubsub.aclose()
+
+      await asyncio.sleep(settings.REDIS_PUBSUB_RETRY_SECONDS)
+
   # Proxy methods to the underlying Redis client
   def __getattr__(self, name) -> aioredis.Redis:
     """Delegate attribute access to the underlying Redis client."""
@@ -86,12 +340,16 @@ class RedisClient(DBConnection):
 
     return getattr(self._client, name)
 
-  async def get(self, key: str) -> Optional[str]:
+  def pipeline(self, transaction: bool = True) -> Pipeline:
+    """Returns a pipeline sending the queued commands in one round trip."""
+    return self._client.pipeline(transaction=transaction)
+
+  async def get(self, key: str) -> Optional[bytes]:
     "Return the value at key name, or None if the key doesn't exist"
 
     return await self._client.get(key)
 
-  async def setex(self, key: str, time: int, value: str) -> bool:
+  async def setex(self, key: str, time: int, value: Union[bytes, str]) -> bool:
     """Set the value of key name to value that expires in time seconds."""
     return await self._client.setex(key, time, value)
 
@@ -1,4 +1,10 @@
-__all__ = ["rate_limit_exceeded_handler"]
+__all__ = [
+  "hash_pool_busy_handler",
+  "invalid_cursor_handler",
+  "rate_limit_exceeded_handler",
+]
 
 
+from .hashing import hash_pool_busy_handler
 from .limiter import rate_limit_exceeded_handler
+from .pagination import invalid_cursor_handler
@@ -0,0 +1,11 @@
+from core.security.utils import HashPoolBusy
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+
+async def hash_pool_busy_handler(request: Request, exc: HashPoolBusy):
+  return JSONResponse(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    content={"detail": "The server is busy. Please try again later."},
+    headers={"Retry-After": "1"},
+  )
@@ -1,10 +1,22 @@
+import math
+
 from fastapi import Request, status
 from fastapi.responses import JSONResponse
 from slowapi.errors import RateLimitExceeded
 
 
 async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+  headers = None
+
+  # Set by the GCRA limiter
+  if (rate_limit := getattr(request.state, "rate_limit", None)) is not None:
+    headers = {
+      **rate_limit.headers(),
+      "Retry-After": str(math.ceil(rate_limit.retry_after)),
+    }
+
   return JSONResponse(
     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
     content={"detail": "Rate limit exceeded. Please try again later."},
+    headers=headers,
   )
@@ -0,0 +1,10 @@
+from crud.pagination import InvalidCursor
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+  return JSONResponse(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    content={"detail": "Invalid pagination cursor."},
+  )
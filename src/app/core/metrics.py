@@ -0,0 +1,32 @@
+from prometheus_client import Counter, Histogram
+
+# Verified JWT claims cached in worker memory, see `OAuthJWTBearer.decode`
+JWT_CACHE_HITS = Counter(
+  "jwt_cache_hits_total", "Bearer tokens served from the verified token cache."
+)
+JWT_CACHE_MISSES = Counter(
+  "jwt_cache_misses_total", "Bearer tokens verified with their signature."
+)
+JWT_CACHE_EVICTIONS = Counter(
+  "jwt_cache_evictions_total",
+  "Verified tokens dropped from the cache.",
+  ["reason"],
+)
+
+# Password hashes run on the thread pool, see `Hash.ahash`/`Hash.averify`
+PASSWORD_HASH_QUEUE_SECONDS = Histogram(
+  "password_hash_queue_seconds",
+  "Time password hashes waited for a worker.",
+  ["operation"],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+  "password_hash_seconds",
+  "Time spent hashing or verifying passwords.",
+  ["operation"],
+  buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+PASSWORD_HASH_REJECTED = Counter(
+  "password_hash_rejected_total",
+  "Password hashes rejected because too many were pending.",
+  ["operation"],
+)
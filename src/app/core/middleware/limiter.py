@@ -1,5 +1,5 @@
-from api.dependencies import get_jwt_payload
-from core.config import settings
+from api.dependencies import get_auth_context
+from core.services.rate_limits import ANONYMOUS
 from slowapi.util import get_remote_address
 from starlette.middleware.base import BaseHTTPMiddleware
 
@@ -9,18 +9,20 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     super().__init__(app, dispatch)
 
   async def dispatch(self, request, call_next):
-    if payload := get_jwt_payload(request):
+    # The claims are shared with the dependencies through `request.state`
+    if payload := get_auth_context(request).claims:
       role, jti = payload.get("role"), payload.get("jti")
 
-      request.state.limit_value = settings.RATE_LIMITS.get(
-        role, settings.RATE_LIMIT_ANONYMOUS
-      )
-
+      request.state.limit_role = role
       request.state.identifier = f"{role}:{jti}"
     else:
-      request.state.limit_value = settings.RATE_LIMIT_ANONYMOUS
+      request.state.limit_role = ANONYMOUS
       request.state.identifier = f"anonymous:{get_remote_address(request)}"
 
     response = await call_next(request)
 
+    # State of the rate limit checked by the route, if any
+    if (rate_limit := getattr(request.state, "rate_limit", None)) is not None:
+      response.headers.update(rate_limit.headers())
+
     return response
@@ -0,0 +1,70 @@
+import json
+from typing import Any, AsyncIterator, Optional, Type
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_documents(documents: Any) -> Any:
+  """Encodes raw MongoDB documents to JSON compatible data."""
+  return jsonable_encoder(documents, custom_encoder={ObjectId: str})
+
+
+def partial_response(documents: Any, **kwargs) -> JSONResponse:
+  """
+  Returns documents read with a `fields` projection as is, since they
+  don't carry the fields required by the response model.
+  """
+  return JSONResponse(encode_documents(documents), **kwargs)
+
+
+def stream_documents(
+  documents: AsyncIterator[dict],
+  model: Optional[Type[BaseModel]],
+  *,
+  ndjson: bool = True,
+  chunk_size: int = 100,
+) -> StreamingResponse:
+  """
+  Streams documents serialized one by one through `model`, either as
+  newline-delimited JSON or as a JSON array. Serialized documents are
+  flushed every `chunk_size` items to keep the writes reasonably sized.
+  Documents are encoded as is without a `model`.
+  """
+
+  async def body():
+    chunk, count = [], 0
+
+    if not ndjson:
+      chunk.append("[")
+
+    async for document in documents:
+      if model:
+        item = model.model_validate(document).model_dump_json(by_alias=True)
+      else:
+        item = json.dumps(encode_documents(document))
+
+      if ndjson:
+        chunk.append(item + "\n")
+      else:
+        chunk.append(item if count == 0 else "," + item)
+
+      count += 1
+
+      if len(chunk) >= chunk_size:
+        yield "".join(chunk)
+        chunk = []
+
+    if not ndjson:
+      chunk.append("]")
+
+    if chunk:
+      yield "".join(chunk)
+
+  return StreamingResponse(
+    body(), media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json"
+  )
@@ -3,7 +3,7 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
-from .utils import PyObjectId
+from .utils import ObjectIdStr, PyObjectId
 
 
 class ProductBase(BaseModel):
@@ -30,3 +30,8 @@ class ProductUpdate(BaseModel):
   title: Optional[str] = None
   description: Optional[str] = None
   price: Optional[int] = None
+
+
+class ProductBulkUpdate(BaseModel):
+  id: ObjectIdStr
+  update: ProductUpdate
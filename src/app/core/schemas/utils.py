@@ -1,9 +1,19 @@
-from typing import Annotated, Optional
+from typing import Annotated, List, Optional
+
+from bson import ObjectId
+from pydantic import AfterValidator, BaseModel, BeforeValidator, EmailStr, Field
+
+
+def check_object_id(v: str) -> str:
+  if not ObjectId.is_valid(v):
+    raise ValueError("Invalid ObjectId.")
+
+  return v
 
-from pydantic import BaseModel, BeforeValidator, EmailStr, Field
 
 PASSWORDstr = Annotated[str, Field(..., min_length=8, max_length=128)]
 PyObjectId = Annotated[str, BeforeValidator(str)]
+ObjectIdStr = Annotated[str, AfterValidator(check_object_id)]
 
 
 class HealthCheck(BaseModel):
@@ -23,3 +33,18 @@ class UpdateEmail(BaseModel):
 class PasswordRecovery(BaseModel):
   email: str
   new_password: PASSWORDstr
+
+
+class BulkItemResult(BaseModel):
+  index: int
+  id: Optional[PyObjectId] = None
+  ok: bool = True
+  error: Optional[str] = None
+
+
+class BulkWriteResult(BaseModel):
+  inserted: int = 0
+  matched: int = 0
+  modified: int = 0
+  deleted: int = 0
+  items: List[BulkItemResult] = []
@@ -1,4 +1,8 @@
+import hashlib
+import time
 import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -6,18 +10,96 @@ import jwt
 from core.config import settings
 from core.database import RedisClient
 from core.logger import logger
+from core.metrics import JWT_CACHE_EVICTIONS, JWT_CACHE_HITS, JWT_CACHE_MISSES
+from core.security.keys import KeyManager
+from core.services.revocations import RevokedTokens
 
 # https://www.iana.org/assignments/jwt/jwt.xhtml#claims
 
 
+@dataclass
+class AuthContext:
+  """
+  Bearer token of a request and its verified claims, decoded once per
+  request (see `api.dependencies.get_auth_context`).
+  """
+
+  token: Optional[str] = None
+  claims: Optional[dict] = None
+
+
+class ClaimsCache:
+  """
+  In-process LRU of verified JWT claims, keyed by the SHA-256 digest of
+  the token so tokens aren't kept in memory. Entries expire with their
+  token.
+  """
+
+  def __init__(self, max_entries: int):
+    self.max_entries = max_entries
+    self._entries: "OrderedDict[bytes, dict]" = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  @staticmethod
+  def key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+  def get(self, key: bytes) -> Optional[dict]:
+    """Returns the claims of a verified token, if cached and unexpired."""
+    if (claims := self._entries.get(key)) is None:
+      JWT_CACHE_MISSES.inc()
+
+      return None
+
+    if time.time() >= claims["exp"]:
+      del self._entries[key]
+      JWT_CACHE_EVICTIONS.labels(reason="expired").inc()
+      JWT_CACHE_MISSES.inc()
+
+      return None
+
+    self._entries.move_to_end(key)
+    JWT_CACHE_HITS.inc()
+
+    # Callers may update the claims, e.g. to refresh the token
+    return dict(claims)
+
+  def set(self, key: bytes, claims: dict):
+    """Caches the claims of a verified token expiring at `exp`."""
+    if not isinstance(claims.get("exp"), (int, float)):
+      return
+
+    self._entries[key] = dict(claims)
+    self._entries.move_to_end(key)
+
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+      JWT_CACHE_EVICTIONS.labels(reason="capacity").inc()
+
+  def clear(self):
+    self._entries.clear()
+
+
 class OAuthJWTBearer:
   """
   JSON Web Token (JWT) is a compact, URL-safe means of representing
   claims to be transferred between two parties.
   """
 
-  @staticmethod
-  def encode(payload: dict) -> dict:
+  # Signing and verification keys, parsed once
+  keys = KeyManager(
+    settings.PRIVATE_KEY_PEM,
+    [settings.PUBLIC_KEY_PEM, *settings.JWT_PREVIOUS_PUBLIC_KEYS_PEM],
+    rsa_algorithm=settings.JWT_ALGORITHM,
+  )
+
+  # Claims of verified tokens, checked before verifying signatures
+  claims_cache = ClaimsCache(settings.JWT_CACHE_MAX_ENTRIES)
+
+  @classmethod
+  def encode(cls, payload: dict) -> dict:
     """Encodes a given payload into a JWT,
     Args:
         payload (dict):
@@ -39,24 +121,33 @@ class OAuthJWTBearer:
     return {
       "jwt": jwt.encode(
         payload=payload,
-        key=settings.PRIVATE_KEY_PEM,
-        algorithm=settings.JWT_ALGORITHM,
+        key=cls.keys.private_key,
+        algorithm=cls.keys.algorithm,
+        headers={"kid": cls.keys.kid},
       ),
       "jti": jti,
     }
 
-  @staticmethod
-  def decode(token: str) -> Optional[dict]:
+  @classmethod
+  def decode(cls, token: str) -> Optional[dict]:
     """
-    Decodes a JWT, returning the payload.
+    Decodes a JWT, returning the payload. Tokens verified recently are
+    served from `claims_cache` without checking their signature again.
     """
+    cache = cls.claims_cache
+    key = cache.key(token) if cache.max_entries else None
+
+    if key is not None and (payload := cache.get(key)) is not None:
+      return payload
+
     try:
-      return jwt.decode(
+      verification_key = cls.keys.verification_key(token)
+      payload = jwt.decode(
         jwt=token,
-        key=settings.PUBLIC_KEY_PEM,
-        algorithms=settings.JWT_ALGORITHM,
+        key=verification_key.key,
+        algorithms=[verification_key.algorithm],
       )
-    except (jwt.DecodeError, jwt.ExpiredSignatureError) as e:
+    except jwt.InvalidTokenError as e:
       logger.exception(
         {"message": "Unable to decode a JWT.", "detail": str(e)},
         exc_info=False,
@@ -64,8 +155,13 @@ class OAuthJWTBearer:
 
       return
 
-  @staticmethod
-  async def refresh(payload: dict) -> str:
+    if key is not None:
+      cache.set(key, payload)
+
+    return payload
+
+  @classmethod
+  async def refresh(cls, payload: dict) -> str:
     """
     Refreshes the claims of a JWT, updating expiry time.
     """
@@ -80,8 +176,9 @@ class OAuthJWTBearer:
 
     return jwt.encode(
       payload=payload,
-      key=settings.PRIVATE_KEY_PEM,
-      algorithm=settings.JWT_ALGORITHM,
+      key=cls.keys.private_key,
+      algorithm=cls.keys.algorithm,
+      headers={"kid": cls.keys.kid},
     )
 
   @staticmethod
@@ -97,14 +194,18 @@ class OAuthJWTBearer:
 
       return False
 
-    # Store jti in the blacklist entry in Redis
-    await redis.setex(f"session:blacklist:jti:{jti}", ttl, "Revoked")
+    # Store jti in the blacklist entry in Redis and notify the workers
+    await RevokedTokens.revoke(redis, jti, exp)
 
     return True
 
   @staticmethod
-  async def is_jti_in_blacklist(redis: RedisClient, *, jti: str) -> bool:
+  async def is_jti_in_blacklist(redis: RedisClient, *, jti: str, exp: int) -> bool:
     """
-    Checks if the `jti` is in blacklist.
+    Checks if the `jti` is in blacklist, with the revoked tokens known
+    by the worker when they're up to date.
     """
-    return await redis.exists(f"session:blacklist:jti:{jti}")
+    if (revoked := RevokedTokens.check(redis, jti)) is not None:
+      return revoked
+
+    return await RevokedTokens.is_revoked(redis, jti, exp)
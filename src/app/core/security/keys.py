@@ -0,0 +1,134 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Dict, Iterable, Union
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+  load_pem_private_key,
+  load_pem_public_key,
+)
+
+PrivateKey = Union[
+  rsa.RSAPrivateKey,
+  ec.EllipticCurvePrivateKey,
+  ed25519.Ed25519PrivateKey,
+  ed448.Ed448PrivateKey,
+]
+PublicKey = Union[
+  rsa.RSAPublicKey,
+  ec.EllipticCurvePublicKey,
+  ed25519.Ed25519PublicKey,
+  ed448.Ed448PublicKey,
+]
+
+# Algorithms of the elliptic curve keys by curve
+EC_ALGORITHMS = {"secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512"}
+
+# Members of the JWK thumbprint by key type (RFC 7638)
+THUMBPRINT_MEMBERS = {
+  "RSA": ("e", "kty", "n"),
+  "EC": ("crv", "kty", "x", "y"),
+  "OKP": ("crv", "kty", "x"),
+}
+
+
+def key_algorithm(key: PublicKey, rsa_algorithm: str = "RS256") -> str:
+  """Returns the JWS algorithm of a key, `rsa_algorithm` for RSA keys."""
+  if isinstance(key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+    return "EdDSA"
+
+  if isinstance(key, ec.EllipticCurvePublicKey):
+    if key.curve.name not in EC_ALGORITHMS:
+      raise ValueError(f"Unsupported elliptic curve: {key.curve.name}.")
+
+    return EC_ALGORITHMS[key.curve.name]
+
+  return rsa_algorithm
+
+
+@dataclass(frozen=True)
+class VerificationKey:
+  kid: str
+  algorithm: str
+  key: PublicKey
+
+  @classmethod
+  def load(cls, key: PublicKey, rsa_algorithm: str = "RS256") -> "VerificationKey":
+    """Wraps a public key, identified by its JWK thumbprint."""
+    algorithm = key_algorithm(key, rsa_algorithm)
+    jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(key, as_dict=True)
+    members = {name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk["kty"]]}
+    digest = hashlib.sha256(
+      json.dumps(members, separators=(",", ":"), sort_keys=True).encode()
+    ).digest()
+
+    return cls(
+      kid=base64.urlsafe_b64encode(digest).rstrip(b"=").decode(),
+      algorithm=algorithm,
+      key=key,
+    )
+
+  def jwk(self) -> dict:
+    """Returns the public key as a JWK."""
+    jwk = jwt.get_algorithm_by_name(self.algorithm).to_jwk(self.key, as_dict=True)
+
+    return {**jwk, "kid": self.kid, "alg": self.algorithm, "use": "sig"}
+
+
+class KeyManager:
+  """
+  JWT keys parsed once into `cryptography` key objects. Tokens are
+  signed with the private key and carry its `kid` header, and are
+  verified with the public key of their `kid`, so the public keys of
+  previous signing keys can stay valid while their tokens expire.
+  """
+
+  def __init__(
+    self,
+    private_key_pem: str,
+    public_key_pems: Iterable[str] = (),
+    *,
+    rsa_algorithm: str = "RS256",
+  ):
+    self.private_key: PrivateKey = load_pem_private_key(
+      private_key_pem.encode(), password=None
+    )
+    self.signing_key = VerificationKey.load(
+      self.private_key.public_key(), rsa_algorithm
+    )
+    self.keys: Dict[str, VerificationKey] = {self.signing_key.kid: self.signing_key}
+
+    for pem in public_key_pems:
+      key = VerificationKey.load(load_pem_public_key(pem.encode()), rsa_algorithm)
+      self.keys.setdefault(key.kid, key)
+
+  @property
+  def kid(self) -> str:
+    return self.signing_key.kid
+
+  @property
+  def algorithm(self) -> str:
+    return self.signing_key.algorithm
+
+  def verification_key(self, token: str) -> VerificationKey:
+    """
+    Returns the key verifying a token. Tokens without a `kid`, issued
+    before keys were identified, are verified with the signing key.
+    """
+    if (kid := jwt.get_unverified_header(token).get("kid")) is None:
+      return self.signing_key
+
+    if not isinstance(kid, str):
+      raise jwt.DecodeError("Invalid key ID, it must be a string.")
+
+    if (key := self.keys.get(kid)) is None:
+      raise jwt.DecodeError(f"Unknown signing key: {kid}.")
+
+    return key
+
+  def jwks(self) -> dict:
+    """Returns the public keys as a JSON Web Key Set."""
+    return {"keys": [key.jwk() for key in self.keys.values()]}
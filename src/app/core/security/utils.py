@@ -1,11 +1,29 @@
+import asyncio
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
 
+from core.config import settings
+from core.metrics import (
+  PASSWORD_HASH_QUEUE_SECONDS,
+  PASSWORD_HASH_REJECTED,
+  PASSWORD_HASH_SECONDS,
+)
 from passlib.context import CryptContext
 
 
+class HashPoolBusy(Exception):
+  """Raised when too many password hashes are already pending."""
+
+
 class Hash:
   context = CryptContext(schemes=["argon2"], deprecated="auto")
 
+  # Async hashes run on a bounded thread pool, as argon2 releases the GIL
+  _executor: Optional[ThreadPoolExecutor] = None
+  _pending = 0
+
   @classmethod
   def hash(cls, plain: str) -> str:
     """Return hashed password."""
@@ -16,6 +34,68 @@ class Hash:
     """Return bool type of the verified password."""
     return cls.context.verify(secret=plain, hash=hashed)
 
+  @classmethod
+  async def ahash(cls, plain: str) -> str:
+    """Return hashed password, hashed off the event loop."""
+    return await cls._run("hash", cls.hash, plain)
+
+  @classmethod
+  async def averify(cls, plain: str, hashed: str) -> bool:
+    """Return bool type of the verified password, verified off the event loop."""
+    return await cls._run("verify", cls.verify, plain, hashed)
+
+  @classmethod
+  async def _run(cls, operation: str, func: Callable[..., Any], *args) -> Any:
+    """
+    Runs a hash function on the pool. Raises `HashPoolBusy` when
+    `PASSWORD_HASH_MAX_PENDING` calls are already queued or running.
+    """
+    if cls._pending >= settings.PASSWORD_HASH_MAX_PENDING:
+      PASSWORD_HASH_REJECTED.labels(operation=operation).inc()
+
+      raise HashPoolBusy()
+
+    if cls._executor is None:
+      cls._executor = ThreadPoolExecutor(
+        max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="hash"
+      )
+
+    queued_at = time.perf_counter()
+
+    def run() -> Any:
+      started_at = time.perf_counter()
+      PASSWORD_HASH_QUEUE_SECONDS.labels(operation=operation).observe(
+        started_at - queued_at
+      )
+
+      try:
+        return func(*args)
+      finally:
+        PASSWORD_HASH_SECONDS.labels(operation=operation).observe(
+          time.perf_counter() - started_at
+        )
+
+    cls._pending += 1
+    future = asyncio.get_running_loop().run_in_executor(cls._executor, run)
+    future.add_done_callback(cls._release)
+
+    # A cancelled caller doesn't free the slot until the hash is done
+    return await asyncio.shield(future)
+
+  @classmethod
+  def _release(cls, future: asyncio.Future):
+    cls._pending -= 1
+
+  @classmethod
+  def close(cls):
+    """
+    Shuts the pool down without waiting for the running hashes, and
+    cancels the queued ones. The next hash starts a new pool.
+    """
+    if cls._executor is not None:
+      cls._executor.shutdown(wait=False, cancel_futures=True)
+      cls._executor = None
+
 
 class DBConnection(ABC):
   """Abstract base class for DB instance client."""
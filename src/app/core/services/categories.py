@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Any, Set
+
+from core.config import settings
+from core.database import RedisClient
+from core.logger import logger
+from pymongo.asynchronous.database import AsyncDatabase
+
+
+class CategoryRegistry:
+  """
+  In-process cache of the product categories, i.e. the collections of
+  the products database. The cache is loaded at startup, refreshed
+  after `CATEGORY_REGISTRY_TTL_SECONDS` and invalidated across workers
+  through Redis pub/sub when categories are created or dropped.
+  """
+
+  CHANNEL = "events:products:categories"
+
+  _categories: Set[str] = set()
+  _loaded_at: float = 0.0
+  _lock = asyncio.Lock()
+
+  @classmethod
+  def is_stale(cls) -> bool:
+    return (
+      not cls._loaded_at
+      or time.monotonic() - cls._loaded_at > settings.CATEGORY_REGISTRY_TTL_SECONDS
+    )
+
+  @classmethod
+  async def load(cls, db: AsyncDatabase) -> Set[str]:
+    """Loads the categories from MongoDB."""
+    cls._categories = set(await db.list_collection_names())
+    cls._loaded_at = time.monotonic()
+
+    return cls._categories
+
+  @classmethod
+  async def get(cls, db: AsyncDatabase) -> Set[str]:
+    """Returns the cached categories, reloading them once stale."""
+    if cls.is_stale():
+      async with cls._lock:
+        if cls.is_stale():
+          await cls.load(db)
+
+    return cls._categories
+
+  @classmethod
+  async def contains(cls, db: AsyncDatabase, category: str) -> bool:
+    """Checks if the category exists."""
+    return category in await cls.get(db)
+
+  @classmethod
+  def expire(cls, *args: Any):
+    """Marks the local cache as stale, so the next access reloads it."""
+    cls._loaded_at = 0.0
+
+  @classmethod
+  async def invalidate(cls, redis: RedisClient):
+    """Invalidates the cache of every worker."""
+    cls.expire()
+
+    try:
+      await redis.publish(cls.CHANNEL, "invalidate")
+    except Exception as e:
+      logger.error(
+        {
+          "message": "[x] Failed to publish the categories invalidation.",
+          "detail": str(e),
+        },
+        exc_info=True,
+      )
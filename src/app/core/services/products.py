@@ -0,0 +1,39 @@
+from typing import Optional
+
+from core.cache import ReadThroughCache
+from core.config import settings
+from core.database import RedisClient
+from crud import ProductCRUD
+from pymongo.asynchronous.database import AsyncDatabase
+
+
+class ProductCache:
+  """Read-through cache of products, keyed by category and ID."""
+
+  cache = ReadThroughCache(
+    "cache:product:{}",
+    ttl=settings.CACHE_EXPIRE_MINUTES * 60,
+    stale_ttl=settings.CACHE_STALE_SECONDS,
+    negative_ttl=settings.CACHE_NEGATIVE_SECONDS,
+    jitter=settings.CACHE_TTL_JITTER,
+    lock_ttl=settings.CACHE_LOCK_SECONDS,
+    local=True,
+  )
+
+  @classmethod
+  async def fetch(
+    cls, redis: RedisClient, db: AsyncDatabase, category: str, product_id: str
+  ) -> Optional[dict]:
+    """Returns the product from the cache, loading it from MongoDB on misses."""
+    return await cls.cache.fetch(
+      redis,
+      f"{category}:{product_id}",
+      lambda: ProductCRUD(db).get_product(category, product_id),
+    )
+
+  @classmethod
+  async def evict(cls, redis: RedisClient, category: str, *product_ids: str):
+    """Removes products of a category from the cache."""
+    await cls.cache.evict(
+      redis, *(f"{category}:{product_id}" for product_id in product_ids)
+    )
@@ -0,0 +1,110 @@
+from typing import Iterable, List, Optional
+
+from core.cache import HashReadThroughCache, ReadThroughCache
+from core.config import settings
+from core.database import RedisClient
+from core.logger import logger
+from crud import UserCRUD
+from pymongo.asynchronous.database import AsyncDatabase
+
+
+class ProfileCache:
+  """
+  Redis cache of user profiles keyed by username. Each profile is
+  stored along with the `version` of its MongoDB document, so a slow
+  refill can't overwrite a profile written after a newer update. Hot
+  profiles are also served from worker memory.
+
+  With the "hash" `PROFILE_CACHE_LAYOUT`, profiles are stored as hashes
+  so permission checks only read a few fields and updates only write
+  the changed ones.
+  """
+
+  hash_layout = settings.PROFILE_CACHE_LAYOUT == "hash"
+
+  cache = (HashReadThroughCache if hash_layout else ReadThroughCache)(
+    "cache:user:{}:fields" if hash_layout else "cache:user:{}:profile",
+    version_key="cache:user:{}:version",
+    ttl=settings.CACHE_EXPIRE_MINUTES * 60,
+    stale_ttl=settings.CACHE_STALE_SECONDS,
+    negative_ttl=settings.CACHE_NEGATIVE_SECONDS,
+    jitter=settings.CACHE_TTL_JITTER,
+    lock_ttl=settings.CACHE_LOCK_SECONDS,
+    local=True,
+  )
+
+  @classmethod
+  async def get(
+    cls, redis: RedisClient, username: str, fields: Optional[List[str]] = None
+  ) -> Optional[dict]:
+    """Returns the cached profile, or only its `fields`, if any."""
+    entry = await cls.cache.get(redis, username, fields)
+
+    return entry.value if entry else None
+
+  @classmethod
+  async def fetch(
+    cls,
+    redis: RedisClient,
+    db: AsyncDatabase,
+    username: str,
+    fields: Optional[List[str]] = None,
+  ) -> Optional[dict]:
+    """
+    Returns the profile, or only its `fields`, from the cache, loading
+    it from MongoDB on misses.
+    """
+    return await cls.cache.fetch(
+      redis,
+      username,
+      lambda: UserCRUD(db).find(username=username, exclude=["_id", "password"]),
+      fields=fields,
+    )
+
+  @classmethod
+  async def set(cls, redis: RedisClient, username: str, profile: dict) -> bool:
+    """
+    Caches a profile read from MongoDB unless a newer version is cached.
+    Returns whether the profile was written.
+    """
+    return await cls.cache.set(redis, username, profile)
+
+  @classmethod
+  async def evict(
+    cls, redis: RedisClient, *usernames: Optional[str], forget_version: bool = False
+  ):
+    """
+    Removes profiles, or cached misses of new users, from the cache.
+    Deleted users also forget their version, since the profile of a
+    user signing up again with the same username starts over.
+    """
+    await cls.cache.evict(redis, *usernames, forget_version=forget_version)
+
+  @classmethod
+  async def write(
+    cls,
+    redis: RedisClient,
+    username: str,
+    profile: Optional[dict],
+    fields: Optional[Iterable[str]] = None,
+  ) -> None:
+    """
+    Refreshes the cache after a profile mutation with its post-image,
+    whose `fields` changed, or evicts the profile when write-through
+    is disabled.
+    """
+    if profile is not None and settings.PROFILE_CACHE_WRITE_THROUGH:
+      try:
+        await cls.cache.write(redis, username, profile, fields=fields)
+
+        return
+      except Exception as e:
+        logger.error(
+          {
+            "message": "[x] Failed to write user profile to Redis cache.",
+            "detail": str(e),
+          },
+          exc_info=True,
+        )
+
+    await cls.evict(redis, username)
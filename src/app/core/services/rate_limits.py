@@ -0,0 +1,762 @@
+import asyncio
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core.database import LuaScript, RedisClient
+from core.logger import logger
+from fastapi.dependencies.models import Dependant
+from fastapi.routing import APIRoute
+from limits import RateLimitItem, parse_many
+from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
+from slowapi.wrappers import Limit
+from starlette.requests import Request
+from starlette.routing import BaseRoute
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+ANONYMOUS = "anonymous"
+
+# Generic cell rate algorithm over the limits of a request, all updated
+# or none. Every limit stores the theoretical arrival time (ms) of its
+# next request, allowing bursts of the limit's amount. Returns the index
+# of the limit to report, its remaining requests and the milliseconds
+# until it resets and, when the request is rejected, until it's allowed.
+_GCRA = LuaScript(
+  """
+local time = redis.call("TIME")
+local now = time[1] * 1000 + time[2] / 1000
+local cost = tonumber(ARGV[1])
+local tats = {}
+local index, remaining, reset, retry = 0, math.huge, 0, 0
+
+for i = 1, #KEYS do
+  local emission = tonumber(ARGV[i * 2])
+  local period = tonumber(ARGV[i * 2 + 1])
+  local tat = math.max(tonumber(redis.call("GET", KEYS[i])) or now, now)
+  local wait
+
+  tats[i] = tat + emission * cost
+  wait = tats[i] - period - now
+
+  if wait > 0 then
+    if wait > retry then
+      index, remaining, reset, retry = i, 0, tat - now, wait
+    end
+  elseif retry == 0 then
+    local left = math.floor((period - tats[i] + now) / emission)
+
+    if left < remaining then
+      index, remaining, reset = i, left, tats[i] - now
+    end
+  end
+end
+
+if retry == 0 then
+  for i = 1, #KEYS do
+    local ttl = math.ceil(tats[i] - now)
+    redis.call("SET", KEYS[i], string.format("%.17g", tats[i]), "PX", ttl)
+  end
+end
+
+return {index, remaining, math.ceil(reset), math.ceil(retry)}
+"""
+)
+
+# Adds the requests admitted by a worker to the GCRA keys, even beyond
+# their limit, and returns the requests remaining for every key
+_GCRA_CONSUME = LuaScript(
+  """
+local time = redis.call("TIME")
+local now = time[1] * 1000 + time[2] / 1000
+local remaining = {}
+
+for i = 1, #KEYS do
+  local emission = tonumber(ARGV[i * 3 - 2])
+  local period = tonumber(ARGV[i * 3 - 1])
+  local delta = tonumber(ARGV[i * 3])
+  local tat = math.max(tonumber(redis.call("GET", KEYS[i])) or now, now)
+
+  if delta > 0 then
+    tat = tat + emission * delta
+    local ttl = math.ceil(tat - now)
+    redis.call("SET", KEYS[i], string.format("%.17g", tat), "PX", ttl)
+  end
+
+  remaining[i] = math.max(math.floor((period - tat + now) / emission), 0)
+end
+
+return remaining
+"""
+)
+
+
+def _identifier(request: Request) -> str:
+  return getattr(request.state, "identifier", request.client.host)
+
+
+@dataclass(frozen=True)
+class RateLimitStatus:
+  """State of the most restrictive limit of a request."""
+
+  limit: RateLimitItem
+  remaining: int
+  # Seconds until the limit is fully available again
+  reset: float
+  # Seconds until the request is allowed, 0 when it was
+  retry_after: float = 0.0
+
+  def headers(self) -> Dict[str, str]:
+    """Returns the `RateLimit-*` headers of the limit."""
+    return {
+      "RateLimit-Limit": str(self.limit.amount),
+      "RateLimit-Remaining": str(self.remaining),
+      "RateLimit-Reset": str(math.ceil(self.reset)),
+      "RateLimit-Policy": f"{self.limit.amount};w={self.limit.get_expiry()}",
+    }
+
+
+@dataclass(frozen=True)
+class CompiledLimits:
+  limits: Tuple[Limit, ...]
+  # Suffixes of the GCRA keys, and the emission interval and period (ms)
+  # of every limit as passed to the script
+  suffixes: Tuple[str, ...]
+  args: Tuple[float, ...]
+
+
+class _Bucket:
+  __slots__ = (
+    "emission",
+    "period",
+    "remaining",
+    "delta",
+    "pending",
+    "sync",
+    "used_at",
+    "blocked_until",
+  )
+
+  def __init__(self, emission: float, period: float, remaining: int):
+    # Emission interval and period of the limit (ms)
+    self.emission, self.period = emission, period
+    # Requests remaining when last synchronized, admitted since, and
+    # being added to the key by the running sync
+    self.remaining, self.delta, self.pending = remaining, 0, 0
+    self.sync: Optional[asyncio.Future] = None
+    self.used_at = self.blocked_until = 0.0
+
+  @property
+  def admitted(self) -> int:
+    """Requests admitted by the worker unknown to the last sync."""
+    return self.delta + self.pending
+
+
+class LocalBuckets:
+  """
+  Approximate GCRA limits checked in worker memory, synchronized with
+  the keys of the "gcra" strategy every `flush_seconds` by one script
+  call per batch of keys. Between synchronizations a worker admits at
+  most `error` times a limit per key, so limits are exceeded by at most
+  that much per worker, and requests beyond it synchronize their keys
+  first. Rejected identifiers are rejected locally until they're
+  expected to be allowed.
+  """
+
+  BATCH_SIZE = 500
+
+  def __init__(self, flush_seconds: float, error: float):
+    self.flush_seconds = flush_seconds
+    self.error = error
+    self._buckets: Dict[str, _Bucket] = {}
+    # Keys used since the last flush
+    self._dirty: Set[str] = set()
+    self._swept_at = time.monotonic()
+    self._redis: Optional[RedisClient] = None
+    self._flusher: Optional[asyncio.Task] = None
+
+  async def hit(
+    self, redis: RedisClient, keys: List[str], compiled: CompiledLimits
+  ) -> Tuple[int, RateLimitStatus]:
+    """
+    Counts a request against the limits stored at `keys`, returning the
+    index of the most restrictive limit and its state.
+    """
+    now, buckets = time.monotonic(), []
+
+    for i, key in enumerate(keys):
+      if (bucket := self._buckets.get(key)) is None:
+        emission, period = compiled.args[i * 2 : i * 2 + 2]
+        bucket = _Bucket(emission, period, compiled.limits[i].limit.amount)
+        self._buckets[key] = bucket
+
+      if now < bucket.blocked_until:
+        return i, self._status(compiled, i, bucket, bucket.blocked_until - now)
+
+      bucket.used_at = now
+      buckets.append(bucket)
+      self._dirty.add(key)
+
+    # Keys are synchronized before a worker admits more than its allowance,
+    # waiting for the running sync of the keys if any
+    synced = False
+
+    while full := [
+      i
+      for i, bucket in enumerate(buckets)
+      if bucket.admitted >= min(bucket.remaining, self._allowance(compiled, i))
+    ]:
+      for i in full if synced else ():
+        if (bucket := buckets[i]).admitted >= bucket.remaining:
+          retry = (bucket.admitted + 1 - bucket.remaining) * bucket.emission / 1000
+          bucket.blocked_until = now + retry
+
+          return i, self._status(compiled, i, bucket, retry)
+
+      if running := {bucket.sync for bucket in buckets if bucket.sync is not None}:
+        await asyncio.wait(running)
+      else:
+        await self._sync(redis, keys)
+
+      synced = True
+
+    for bucket in buckets:
+      bucket.delta += 1
+
+    if self._flusher is None:
+      self._redis = redis
+      self._flusher = asyncio.ensure_future(self._flush_periodically())
+      self._flusher.add_done_callback(lambda _: setattr(self, "_flusher", None))
+
+    index = min(
+      range(len(buckets)), key=lambda i: buckets[i].remaining - buckets[i].admitted
+    )
+
+    return index, self._status(compiled, index, buckets[index])
+
+  def _allowance(self, compiled: CompiledLimits, index: int) -> int:
+    """Requests a worker may admit between synchronizations."""
+    return max(int(compiled.limits[index].limit.amount * self.error), 1)
+
+  @staticmethod
+  def _status(
+    compiled: CompiledLimits, index: int, bucket: _Bucket, retry: float = 0.0
+  ) -> RateLimitStatus:
+    limit = compiled.limits[index].limit
+    remaining = max(bucket.remaining - bucket.admitted, 0)
+
+    return RateLimitStatus(
+      limit, remaining, (limit.amount - remaining) * bucket.emission / 1000, retry
+    )
+
+  async def _sync(self, redis: RedisClient, keys: List[str]):
+    """Adds the requests admitted since the last sync to the keys."""
+    buckets = [self._buckets[key] for key in keys]
+    sync = asyncio.get_running_loop().create_future()
+    args = []
+
+    for bucket in buckets:
+      bucket.pending, bucket.delta, bucket.sync = bucket.delta, 0, sync
+      args.extend([bucket.emission, bucket.period, bucket.pending])
+
+    try:
+      remaining = await _GCRA_CONSUME(redis, keys=keys, args=args)
+
+      for bucket, left in zip(buckets, remaining):
+        bucket.remaining, bucket.pending = left, 0
+    finally:
+      # Requests of a failed sync are counted again by the next one
+      for bucket in buckets:
+        bucket.delta += bucket.pending
+        bucket.pending, bucket.sync = 0, None
+
+      sync.set_result(None)
+
+  async def flush(self):
+    """Synchronizes the keys used since the last flush."""
+    now, dirty = time.monotonic(), self._dirty
+    self._dirty = set()
+
+    # Buckets unused for a whole period have refilled
+    if now - self._swept_at > 1:
+      self._swept_at = now
+      self._buckets = {
+        key: bucket
+        for key, bucket in self._buckets.items()
+        if bucket.admitted or now - bucket.used_at < bucket.period / 1000
+      }
+
+    keys = [key for key in dirty if key in self._buckets]
+
+    for start in range(0, len(keys), self.BATCH_SIZE):
+      batch = []
+
+      # Keys being synchronized by a request are flushed next time
+      for key in keys[start : start + self.BATCH_SIZE]:
+        if self._buckets[key].sync is None:
+          batch.append(key)
+        else:
+          self._dirty.add(key)
+
+      if not batch:
+        continue
+
+      try:
+        await self._sync(self._redis, batch)
+      except BaseException as e:
+        # Flushed next time, including when the flusher is stopped
+        self._dirty.update(keys[start:])
+
+        if not isinstance(e, Exception):
+          raise
+
+        logger.warning(
+          {"message": "[x] Failed to flush the local rate limits.", "detail": str(e)}
+        )
+
+        return
+
+  async def _flush_periodically(self):
+    while self._buckets:
+      await asyncio.sleep(self.flush_seconds)
+      await self.flush()
+
+  async def close(self):
+    """Stops the periodic flushes and flushes the pending requests."""
+    if self._flusher is not None:
+      self._flusher.cancel()
+      self._flusher = None
+
+      await self.flush()
+
+
+class SharedMemoryLimits:
+  """
+  GCRA limits stored in a memory-mapped file shared by the workers of a
+  host, such as one in `/dev/shm`, so checks don't leave the host. The
+  file is a table of (key hash, theoretical arrival time) slots split in
+  `stripes`, each guarded by a byte-range lock on the file, and slots of
+  expired keys are reused. Limits are checked like the "gcra" script.
+
+  Every `sync_seconds` each worker adds the requests it admitted to the
+  Redis keys of the "gcra" strategy and takes their state back, so the
+  limits hold across hosts up to what the other hosts admitted since.
+  Keys unknown to the host are read from Redis first. With no sync, the
+  limits apply to every host separately. `hit` returns `None` when the
+  limits can't be stored in the table, and the request is checked in
+  Redis instead.
+  """
+
+  BATCH_SIZE = 500
+  # Slots probed for a key before the table is considered full
+  MAX_PROBES = 32
+
+  # Magic, number of slots and stripes
+  HEADER = struct.Struct("<8sQQ")
+  MAGIC = b"GCRASHM1"
+  # Key hash (0 when unused) and theoretical arrival time (ms since epoch)
+  SLOT = struct.Struct("<Qd")
+
+  def __init__(self, path: str, slots: int, stripes: int, sync_seconds: float):
+    self.path = path
+    self.stripes = stripes
+    self.per_stripe = max(slots // stripes, 1)
+    self.sync_seconds = sync_seconds
+    self._fd: Optional[int] = None
+    self._map: Optional[mmap.mmap] = None
+    # Requests admitted by the worker since the last sync by key, with
+    # the key hash and the emission interval and period of its limit
+    self._admitted: Dict[str, List[Any]] = {}
+    self._redis: Optional[RedisClient] = None
+    self._flusher: Optional[asyncio.Task] = None
+    self._full = False
+
+    if fcntl is None:
+      logger.warning("fcntl isn't available, checking rate limits in Redis.")
+
+  def _open(self):
+    """Maps the file, creating it when it doesn't exist."""
+    size = self.HEADER.size + self.stripes * self.per_stripe * self.SLOT.size
+    header = self.HEADER.pack(self.MAGIC, self.stripes * self.per_stripe, self.stripes)
+    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    try:
+      fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+
+      try:
+        if os.fstat(fd).st_size == 0:
+          os.ftruncate(fd, size)
+          os.pwrite(fd, header, 0)
+        elif os.pread(fd, self.HEADER.size, 0) != header:
+          raise RuntimeError(
+            f"{self.path} holds rate limits of another layout, remove it first."
+          )
+      finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+
+      self._map = mmap.mmap(fd, size)
+      self._fd = fd
+    except BaseException:
+      os.close(fd)
+      raise
+
+  @staticmethod
+  def _hash(key: str) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little") or 1
+
+  def _lock(self, stripes: List[int]):
+    # Stripes are locked in order so workers can't deadlock
+    for stripe in stripes:
+      fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + stripe)
+
+  def _unlock(self, stripes: List[int]):
+    for stripe in stripes:
+      fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + stripe)
+
+  def _find(self, key_hash: int, now: float, taken: Set[int]) -> Optional[int]:
+    """
+    Returns the offset of the slot of a key, or of a free slot for it,
+    with the lock of the key's stripe held.
+    """
+    stripe = key_hash % self.stripes
+    base = self.HEADER.size + stripe * self.per_stripe * self.SLOT.size
+    start, free = key_hash // self.stripes, None
+
+    for probe in range(min(self.MAX_PROBES, self.per_stripe)):
+      offset = base + (start + probe) % self.per_stripe * self.SLOT.size
+      stored, tat = self.SLOT.unpack_from(self._map, offset)
+
+      if stored == key_hash:
+        return offset
+
+      # Slots of expired keys are free but don't end the probe sequence
+      if free is None and (stored == 0 or tat <= now) and offset not in taken:
+        free = offset
+
+      if stored == 0:
+        break
+
+    return free
+
+  async def hit(
+    self, redis: RedisClient, keys: List[str], compiled: CompiledLimits
+  ) -> Optional[Tuple[int, RateLimitStatus]]:
+    """
+    Counts a request against the limits stored at `keys`, returning the
+    index of the most restrictive limit and its state.
+    """
+    if fcntl is None:
+      return None
+
+    if self._map is None:
+      self._open()
+
+    hashes = [self._hash(key) for key in keys]
+    stripes = sorted({key_hash % self.stripes for key_hash in hashes})
+
+    if self.sync_seconds and (
+      unknown := [i for i, key_hash in enumerate(hashes) if not self._known(key_hash)]
+    ):
+      await self._seed(redis, keys, hashes, compiled, unknown)
+
+    now = time.time() * 1000
+    index, remaining, reset, retry = 0, math.inf, 0.0, 0.0
+    offsets, tats = [], []
+
+    self._lock(stripes)
+
+    try:
+      for i, key_hash in enumerate(hashes):
+        if (offset := self._find(key_hash, now, set(offsets))) is None:
+          if not self._full:
+            self._full = True
+            logger.warning(
+              {"message": f"[x] Shared rate limits table {self.path} is full."}
+            )
+
+          return None
+
+        emission, period = compiled.args[i * 2 : i * 2 + 2]
+        stored, tat = self.SLOT.unpack_from(self._map, offset)
+        tat = max(tat, now) if stored == key_hash else now
+        offsets.append(offset)
+        tats.append(tat + emission)
+
+        if (wait := tats[i] - period - now) > 0:
+          if wait > retry:
+            index, remaining, reset, retry = i, 0, tat - now, wait
+        elif (
+          not retry
+          and (left := math.floor((period - tats[i] + now) / emission)) < remaining
+        ):
+          index, remaining, reset = i, left, tats[i] - now
+
+      if not retry:
+        for key_hash, offset, tat in zip(hashes, offsets, tats):
+          self.SLOT.pack_into(self._map, offset, key_hash, tat)
+    finally:
+      self._unlock(stripes)
+
+    if not retry and self.sync_seconds:
+      for i, (key, key_hash) in enumerate(zip(keys, hashes)):
+        if (admitted := self._admitted.get(key)) is None:
+          emission, period = compiled.args[i * 2 : i * 2 + 2]
+          admitted = self._admitted[key] = [key_hash, emission, period, 0]
+
+        admitted[3] += 1
+
+      if self._flusher is None:
+        self._redis = redis
+        self._flusher = asyncio.ensure_future(self._flush_periodically())
+        self._flusher.add_done_callback(lambda _: setattr(self, "_flusher", None))
+
+    return index, RateLimitStatus(
+      compiled.limits[index].limit, remaining, reset / 1000, retry / 1000
+    )
+
+  def _known(self, key_hash: int) -> bool:
+    """Whether the host has a slot for a key, read without locking."""
+    if (offset := self._find(key_hash, time.time() * 1000, set())) is None:
+      return False
+
+    return self.SLOT.unpack_from(self._map, offset)[0] == key_hash
+
+  async def _seed(
+    self,
+    redis: RedisClient,
+    keys: List[str],
+    hashes: List[int],
+    compiled: CompiledLimits,
+    indexes: List[int],
+  ):
+    """Copies the state of keys from Redis, left to the host if it fails."""
+    args = []
+
+    for i in indexes:
+      args.extend([*compiled.args[i * 2 : i * 2 + 2], 0])
+
+    try:
+      remaining = await _GCRA_CONSUME(redis, keys=[keys[i] for i in indexes], args=args)
+    except Exception as e:
+      logger.warning(
+        {"message": "[x] Failed to read the shared rate limits.", "detail": str(e)}
+      )
+
+      return
+
+    for i, left in zip(indexes, remaining):
+      self._merge(hashes[i], *compiled.args[i * 2 : i * 2 + 2], left)
+
+  def _merge(self, key_hash: int, emission: float, period: float, remaining: int):
+    """Moves the arrival time of a key to the one implied by Redis if later."""
+    now = time.time() * 1000
+    tat = max(now + period - remaining * emission, now)
+    stripes = [key_hash % self.stripes]
+    self._lock(stripes)
+
+    try:
+      if (offset := self._find(key_hash, now, set())) is not None:
+        stored, current = self.SLOT.unpack_from(self._map, offset)
+
+        if stored != key_hash or current < tat:
+          self.SLOT.pack_into(self._map, offset, key_hash, tat)
+    finally:
+      self._unlock(stripes)
+
+  async def flush(self):
+    """Adds the requests admitted since the last flush to the Redis keys."""
+    admitted, self._admitted = self._admitted, {}
+    keys = list(admitted)
+
+    for start in range(0, len(keys), self.BATCH_SIZE):
+      batch, args = keys[start : start + self.BATCH_SIZE], []
+
+      for key in batch:
+        _, emission, period, count = admitted[key]
+        args.extend([emission, period, count])
+
+      try:
+        remaining = await _GCRA_CONSUME(self._redis, keys=batch, args=args)
+      except BaseException as e:
+        # Added next time, including when the flusher is stopped
+        for key in keys[start:]:
+          if (current := self._admitted.get(key)) is None:
+            self._admitted[key] = admitted[key]
+          else:
+            current[3] += admitted[key][3]
+
+        if not isinstance(e, Exception):
+          raise
+
+        logger.warning(
+          {"message": "[x] Failed to sync the shared rate limits.", "detail": str(e)}
+        )
+
+        return
+
+      for key, left in zip(batch, remaining):
+        key_hash, emission, period, _ = admitted[key]
+        self._merge(key_hash, emission, period, left)
+
+  async def _flush_periodically(self):
+    while self._admitted:
+      await asyncio.sleep(self.sync_seconds)
+      await self.flush()
+
+  async def close(self):
+    """Stops the periodic syncs, syncing the pending requests, and unmaps."""
+    if self._flusher is not None:
+      self._flusher.cancel()
+      self._flusher = None
+
+      await self.flush()
+
+    if self._map is not None:
+      self._map.close()
+      os.close(self._fd)
+      self._map = self._fd = None
+
+
+class RouteLimits:
+  """
+  Rate limits of the routes by role, parsed once per (route, role) when
+  the routes are registered instead of on every request.
+
+  With the "gcra" strategy, the limits of a request are checked by one
+  Lua script storing a single timestamp per identifier and limit, and
+  the state of the most restrictive limit is kept in
+  `request.state.rate_limit` for the `RateLimit-*` headers. With
+  "moving-window", requests are counted by the slowapi limiter storage
+  under the same keys as slowapi route limits.
+
+  Given `local` buckets, anonymous requests of the "gcra" strategy are
+  checked in worker memory instead, approximately, while authenticated
+  roles are still checked in Redis by every request. Given `shared`
+  limits, requests of every role are checked in the memory shared by
+  the workers of the host.
+  """
+
+  PREFIX = "ratelimit:"
+
+  def __init__(
+    self,
+    limiter: Limiter,
+    limits: Dict[str, str],
+    strategy: str,
+    local: Optional[LocalBuckets] = None,
+    shared: Optional[SharedMemoryLimits] = None,
+  ):
+    self.limiter = limiter
+    self.limits = limits
+    self.strategy = strategy
+    self.local = local
+    self.shared = shared
+    # Compiled limits of the routes by endpoint, then by role
+    self._routes: Dict[Callable[..., Any], Dict[str, CompiledLimits]] = {}
+
+  def _compile(self, endpoint: Callable[..., Any]) -> Dict[str, CompiledLimits]:
+    scope = f"{endpoint.__module__}.{endpoint.__name__}"
+    compiled = {}
+
+    for role, value in self.limits.items():
+      items, args = parse_many(value), []
+
+      for item in items:
+        period = item.get_expiry() * 1000
+        args.extend([period / item.amount, period])
+
+      compiled[role] = CompiledLimits(
+        limits=tuple(
+          Limit(item, _identifier, scope, False, None, None, None, 1, True)
+          for item in items
+        ),
+        suffixes=tuple(f":{scope}:{item.amount}/{item.get_expiry()}" for item in items),
+        args=tuple(args),
+      )
+
+    self._routes[endpoint] = compiled
+
+    return compiled
+
+  def compile(self, routes: Iterable[BaseRoute], dependency: Callable[..., Any]):
+    """Compiles the limits of the routes depending on `dependency`."""
+
+    def depends_on(dependant: Dependant) -> bool:
+      return any(
+        sub.call is dependency or depends_on(sub) for sub in dependant.dependencies
+      )
+
+    for route in routes:
+      if isinstance(route, APIRoute) and depends_on(route.dependant):
+        self._compile(route.endpoint)
+
+  async def check(self, request: Request, redis: RedisClient, role: str = ANONYMOUS):
+    """
+    Counts a request against the limits of its route for `role`, the
+    anonymous limits for unknown roles, and raises `RateLimitExceeded`
+    when one of them is exceeded.
+    """
+    if not self.limiter.enabled:
+      return
+
+    endpoint = request.scope["endpoint"]
+
+    if (routes := self._routes.get(endpoint)) is None:
+      routes = self._compile(endpoint)
+
+    compiled = routes.get(role) or routes[ANONYMOUS]
+    identifier = _identifier(request)
+
+    if self.strategy != "gcra":
+      for limit in compiled.limits:
+        if not self.limiter.limiter.hit(limit.limit, identifier, limit.scope):
+          raise RateLimitExceeded(limit)
+
+      return
+
+    if not compiled.limits:
+      return
+
+    keys = [f"{self.PREFIX}{identifier}{suffix}" for suffix in compiled.suffixes]
+
+    result = None
+
+    if self.shared is not None:
+      result = await self.shared.hit(redis, keys, compiled)
+    elif self.local is not None and role == ANONYMOUS:
+      result = await self.local.hit(redis, keys, compiled)
+
+    if result is not None:
+      index, status = result
+    else:
+      index, remaining, reset, retry = await _GCRA(
+        redis, keys=keys, args=[1, *compiled.args]
+      )
+      index -= 1
+      status = RateLimitStatus(
+        compiled.limits[index].limit, remaining, reset / 1000, retry / 1000
+      )
+
+    request.state.rate_limit = status
+
+    if status.retry_after:
+      raise RateLimitExceeded(compiled.limits[index])
+
+  async def close(self):
+    """Flushes the requests counted in worker or shared memory."""
+    if self.local is not None:
+      await self.local.close()
+
+    if self.shared is not None:
+      await self.shared.close()
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, Optional
+
+from core.config import settings
+from core.database import LuaScript, RedisClient
+from core.logger import logger
+
+# Adds a fingerprint to its bucket, which expires once its tokens have
+_REVOKE = LuaScript(
+  """
+  redis.call("SADD", KEYS[1], ARGV[1])
+
+  return redis.call("EXPIREAT", KEYS[1], ARGV[2])
+  """
+)
+
+# Whether a fingerprint is in its bucket, or the token has a blacklist
+# key, written before the revocations were bucketed
+_IS_REVOKED = LuaScript(
+  """
+  if redis.call("SISMEMBER", KEYS[1], ARGV[1]) == 1 then
+    return 1
+  end
+
+  return redis.call("EXISTS", KEYS[2])
+  """
+)
+
+
+class RevokedTokens:
+  """
+  In-process set of the revoked JWT ids, so checking a token makes no
+  Redis round trip. The set is loaded from the blacklist keys once the
+  pub/sub listener is subscribed, kept current by the revocations
+  published on `CHANNEL`, and reloaded every
+  `REVOCATION_RESYNC_SECONDS`. While the listener is down or the set
+  isn't loaded, `check` returns `None` so Redis is queried instead.
+
+  With `REVOCATION_STORAGE="buckets"`, revocations are stored as 64-bit
+  fingerprints of their jti in sets shared by the tokens expiring in
+  the same minute, split in `REVOCATION_BUCKET_SHARDS` sets small
+  enough to be encoded as intsets (see `set-max-intset-entries`), with
+  one TTL per set instead of one key per token.
+  """
+
+  CHANNEL = "events:jti:revoked"
+  PREFIX = "session:blacklist:jti:"
+  BUCKET_PREFIX = "session:blacklist:exp:"
+  BUCKET_SECONDS = 60
+
+  # Expiry (epoch) of the revoked tokens by jti fingerprint
+  _revoked: Dict[int, float] = {}
+  # Monotonic time the last complete load started
+  _synced_at: Optional[float] = None
+  _sync: Optional[asyncio.Task] = None
+
+  @classmethod
+  def key(cls, jti: str) -> str:
+    return f"{cls.PREFIX}{jti}"
+
+  @staticmethod
+  def fingerprint(jti: str) -> int:
+    """Returns the signed 64-bit fingerprint identifying a jti."""
+    digest = hashlib.blake2b(jti.encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, "big", signed=True)
+
+  @classmethod
+  def bucket(cls, fingerprint: int, exp: float) -> str:
+    """Returns the key of the set of a token expiring at `exp`."""
+    shard = fingerprint % settings.REVOCATION_BUCKET_SHARDS
+
+    return f"{cls.BUCKET_PREFIX}{int(exp) // cls.BUCKET_SECONDS}:{shard}"
+
+  @classmethod
+  def is_synced(cls) -> bool:
+    """Whether every revocation since the listener subscribed is known."""
+    return (
+      RedisClient.subscribed_at is not None
+      and cls._synced_at is not None
+      and cls._synced_at >= RedisClient.subscribed_at
+    )
+
+  @classmethod
+  def check(cls, redis: RedisClient, jti: str) -> Optional[bool]:
+    """
+    Returns whether the token is revoked, or `None` when the local set
+    may be incomplete, in which case it's reloaded in the background.
+    """
+    if not cls.is_synced() or (
+      time.monotonic() - cls._synced_at > settings.REVOCATION_RESYNC_SECONDS
+    ):
+      cls.resync(redis)
+
+    if not cls.is_synced():
+      return None
+
+    return cls._revoked.get(cls.fingerprint(jti), 0) > time.time()
+
+  @classmethod
+  def add(cls, jti: str, exp: float):
+    """Records a revoked token expiring at `exp`."""
+    cls._add(cls.fingerprint(jti), exp)
+
+  @classmethod
+  def _add(cls, fingerprint: int, exp: float):
+    cls._revoked[fingerprint] = max(float(exp), cls._revoked.get(fingerprint, 0))
+
+  @classmethod
+  def receive(cls, data: Optional[bytes]):
+    """Handles a revocation published as `{jti}:{exp}`."""
+    if data is None:
+      return
+
+    if isinstance(data, bytes):
+      data = data.decode()
+
+    jti, _, exp = data.rpartition(":")
+    cls.add(jti, float(exp))
+
+  @classmethod
+  async def revoke(cls, redis: RedisClient, jti: str, exp: int):
+    """Blacklists a token in Redis and notifies every worker."""
+    cls.add(jti, exp)
+
+    if settings.REVOCATION_STORAGE == "buckets":
+      fingerprint = cls.fingerprint(jti)
+      # Every token of the bucket has expired by the end of its minute
+      expires_at = (int(exp) // cls.BUCKET_SECONDS + 1) * cls.BUCKET_SECONDS
+      write = _REVOKE(
+        redis, keys=[cls.bucket(fingerprint, exp)], args=[fingerprint, expires_at]
+      )
+    else:
+      write = redis.setex(cls.key(jti), max(exp - int(time.time()), 1), exp)
+
+    # Sent together when the client pipelines concurrent commands
+    await asyncio.gather(write, redis.publish(cls.CHANNEL, f"{jti}:{exp}"))
+
+  @classmethod
+  async def is_revoked(cls, redis: RedisClient, jti: str, exp: int) -> bool:
+    """Checks in Redis whether a token expiring at `exp` is revoked."""
+    if settings.REVOCATION_STORAGE == "buckets":
+      fingerprint = cls.fingerprint(jti)
+
+      return bool(
+        await _IS_REVOKED(
+          redis, keys=[cls.bucket(fingerprint, exp), cls.key(jti)], args=[fingerprint]
+        )
+      )
+
+    return bool(await redis.exists(cls.key(jti)))
+
+  @classmethod
+  def resync(cls, redis: RedisClient):
+    """Starts reloading the revoked tokens, unless already reloading."""
+    if RedisClient.subscribed_at is not None and cls._sync is None:
+      cls._sync = asyncio.ensure_future(cls._load(redis))
+      cls._sync.add_done_callback(lambda _: setattr(cls, "_sync", None))
+
+  @classmethod
+  async def _load(cls, redis: RedisClient):
+    """
+    Loads the blacklist keys and buckets of both layouts, dropping the
+    expired tokens.
+    """
+    started_at, now = time.monotonic(), time.time()
+
+    try:
+      await cls._load_keys(redis, now)
+      await cls._load_buckets(redis)
+    except Exception as e:
+      logger.error(
+        {"message": "[x] Failed to load the revoked tokens.", "detail": str(e)},
+        exc_info=True,
+      )
+
+      return
+
+    cls._revoked = {
+      fingerprint: exp for fingerprint, exp in cls._revoked.items() if exp > now
+    }
+    cls._synced_at = started_at
+
+  @classmethod
+  async def _load_keys(cls, redis: RedisClient, now: float):
+    cursor = 0
+
+    while True:
+      cursor, keys = await redis.scan(
+        cursor, match=f"{cls.PREFIX}*", count=settings.REVOCATION_SCAN_COUNT
+      )
+
+      if keys:
+        for key, exp in zip(keys, await redis.mget(keys)):
+          if isinstance(key, bytes):
+            key = key.decode()
+
+          # Keys set before expiries were stored last for a token lifetime
+          if exp is None or not exp.isdigit():
+            exp = now + settings.JWT_EXPIRE_MINUTES * 60
+
+          cls.add(key.removeprefix(cls.PREFIX), float(exp))
+
+      if not int(cursor):
+        break
+
+  @classmethod
+  async def _load_buckets(cls, redis: RedisClient):
+    cursor = 0
+
+    while True:
+      cursor, keys = await redis.scan(
+        cursor,
+        match=f"{cls.BUCKET_PREFIX}*",
+        count=settings.REVOCATION_SCAN_COUNT,
+      )
+
+      if keys:
+        # One round trip per page of buckets
+        async with redis.pipeline(transaction=False) as pipe:
+          for key in keys:
+            pipe.smembers(key)
+
+          members = await pipe.execute()
+
+        for key, fingerprints in zip(keys, members):
+          if isinstance(key, bytes):
+            key = key.decode()
+
+          minute = int(key.removeprefix(cls.BUCKET_PREFIX).split(":")[0])
+
+          for fingerprint in fingerprints:
+            cls._add(int(fingerprint), (minute + 1) * cls.BUCKET_SECONDS)
+
+      if not int(cursor):
+        break
@@ -1,5 +1,6 @@
-__all__ = ["BaseCRUD", "UserCRUD", "ProductCRUD"]
+__all__ = ["BaseCRUD", "IndexRegistry", "UserCRUD", "ProductCRUD"]
 
 from .base_crud import BaseCRUD
+from .indexes import IndexRegistry
 from .product_crud import ProductCRUD
 from .user_crud import UserCRUD
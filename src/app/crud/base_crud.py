@@ -1,20 +1,78 @@
-from typing import Any, Optional
+from typing import (
+  Any,
+  AsyncIterator,
+  ClassVar,
+  Dict,
+  Iterable,
+  List,
+  Optional,
+  Tuple,
+)
 
-from core.config import ModelType
+from core.config import ModelType, settings
+from pymongo import ASCENDING, DeleteOne, IndexModel, InsertOne, UpdateOne
 from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import BulkWriteError
+
+from .pagination import decode_cursor, encode_cursor, keyset, merge_filters
+
+
+def projection(
+  include: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None
+) -> Optional[dict]:
+  """
+  Returns the MongoDB projection returning only the `include` fields,
+  or every field except the `exclude` ones. As MongoDB can't mix both,
+  only `_id` is honoured from `exclude` when fields are included.
+  """
+  if include:
+    fields = {field: True for field in include}
+
+    if exclude and "_id" in exclude and "_id" not in fields:
+      fields["_id"] = False
+
+    return fields
+
+  return {field: False for field in exclude} if exclude else None
+
+
+def returns(projection: Optional[dict], field: str) -> bool:
+  """Checks if documents read with a projection contain the given field."""
+  if not projection:
+    return True
+
+  if field in projection:
+    return bool(projection[field])
+
+  # `_id` is returned unless excluded; other fields unless some are included
+  return field == "_id" or not any(
+    value for key, value in projection.items() if key != "_id"
+  )
 
 
 class BaseCRUD:
+  # Indexes required on every collection managed by the class
+  indexes: ClassVar[List[IndexModel]] = []
+
   def __init__(self, db: AsyncDatabase):
     self.db = db
 
+  async def declared_indexes(self) -> Dict[str, List[IndexModel]]:
+    """Returns the indexes required per collection."""
+    if not self.indexes:
+      return {}
+
+    return {name: self.indexes for name in await self.db.list_collection_names()}
+
   async def create(self, collection: str, model: ModelType):
     """Creates an object."""
     return await self.db[collection].insert_one(model.model_dump())
 
-  async def read(self, collection: str, filter: Any):
+  async def read(
+    self, collection: str, filter: Any, *, projection: Optional[dict] = None
+  ):
     """Reads specific object."""
-    return await self.db[collection].find_one(filter)
+    return await self.db[collection].find_one(filter, projection=projection)
 
   async def read_all(
     self,
@@ -23,11 +81,178 @@ class BaseCRUD:
     filter: Any = {},
     offset: int = 0,
     length: Optional[int] = None,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    projection: Optional[dict] = None,
   ):
-    """Reads all objects."""
-    objects = await self.db[collection].find(filter).to_list(length)
+    """Reads all objects, skipping and limiting on the server."""
+    cursor = self.db[collection].find(
+      filter, projection=projection, sort=sort, skip=offset, limit=length or 0
+    )
+
+    return await cursor.to_list(length)
+
+  async def read_page(
+    self,
+    collection: str,
+    *,
+    filter: Any = {},
+    length: int,
+    cursor: Optional[str] = None,
+    sort_key: str = "_id",
+    direction: int = ASCENDING,
+    projection: Optional[dict] = None,
+  ) -> Tuple[List[dict], Optional[str]]:
+    """
+    Reads a page of objects after the `cursor` using a range on the sort
+    key, so every page costs the same as the first one. Returns the
+    objects and the cursor of the next page, if any.
+    """
+    range_filter, sort = keyset(
+      decode_cursor(cursor) if cursor else None,
+      sort_key=sort_key,
+      direction=direction,
+    )
+
+    # The next cursor is built from the sort key and `_id` of the last
+    # object, so they are fetched even if the projection omits them
+    hidden = [f for f in {sort_key, "_id"} if not returns(projection, f)]
+
+    if hidden:
+      projection = dict(projection)
+
+      for field in hidden:
+        if projection.pop(field, None) is None:
+          projection[field] = True
+
+    cursor = self.db[collection].find(
+      merge_filters(filter, range_filter),
+      projection=projection,
+      sort=sort,
+      limit=length + 1,
+    )
+    objects = await cursor.to_list(length + 1)
+
+    next_cursor = None
+
+    if len(objects) > length:
+      objects = objects[:length]
+      next_cursor = encode_cursor(objects[-1], sort_key=sort_key, direction=direction)
+
+    for field in hidden:
+      for object in objects:
+        object.pop(field, None)
+
+    return objects, next_cursor
+
+  def stream(
+    self,
+    collection: str,
+    *,
+    filter: Any = {},
+    cursor: Optional[str] = None,
+    sort_key: str = "_id",
+    direction: int = ASCENDING,
+    batch_size: Optional[int] = None,
+    projection: Optional[dict] = None,
+  ) -> AsyncIterator[dict]:
+    """
+    Returns an async iterator over the objects after the `cursor`,
+    fetched from MongoDB in batches of `batch_size` without
+    materializing the result. The cursor is validated eagerly.
+    """
+    range_filter, sort = keyset(
+      decode_cursor(cursor) if cursor else None,
+      sort_key=sort_key,
+      direction=direction,
+    )
+
+    return self.db[collection].find(
+      merge_filters(filter, range_filter),
+      projection=projection,
+      sort=sort,
+      batch_size=batch_size or 0,
+    )
+
+  async def bulk_write(
+    self,
+    collection: str,
+    requests: List,
+    *,
+    batch_size: Optional[int] = None,
+    ids: Optional[List[Any]] = None,
+    once: bool = False,
+  ) -> dict:
+    """
+    Executes write requests with unordered `bulk_write` calls of up to
+    `batch_size` operations. A failing operation doesn't stop the
+    others; its error is reported under its index in `errors`.
+
+    Given the `ids` of the objects the requests target, requests whose
+    object doesn't exist, found by a single query beforehand, are
+    reported as "not found" errors. With `once`, repeated IDs only match
+    the first time, as their object is deleted.
+    """
+    batch_size = batch_size or settings.BULK_WRITE_BATCH_SIZE
+    result = {"inserted": 0, "matched": 0, "modified": 0, "deleted": 0, "errors": {}}
+    found = set()
+
+    if ids is not None:
+      cursor = self.db[collection].find({"_id": {"$in": list(set(ids))}}, {"_id": 1})
+      documents = await cursor.to_list(None)
+      found = {document["_id"] for document in documents}
+
+    for start in range(0, len(requests), batch_size):
+      try:
+        response = await self.db[collection].bulk_write(
+          requests[start : start + batch_size], ordered=False
+        )
+        details = response.bulk_api_result
+      except BulkWriteError as e:
+        details = e.details
+
+      result["inserted"] += details.get("nInserted", 0)
+      result["matched"] += details.get("nMatched", 0)
+      result["modified"] += details.get("nModified", 0)
+      result["deleted"] += details.get("nRemoved", 0)
+
+      for error in details.get("writeErrors", []):
+        result["errors"][start + error["index"]] = error.get("errmsg")
+
+    for index, id in enumerate(ids or []):
+      if id not in found:
+        result["errors"].setdefault(index, "not found")
+      elif once:
+        found.discard(id)
+
+    return result
+
+  async def bulk_create(
+    self, collection: str, models: List[ModelType], **kwargs
+  ) -> dict:
+    """Creates objects in bulk. Returns the result with the `ids` of the objects."""
+    documents = [model.model_dump() for model in models]
+    result = await self.bulk_write(
+      collection, [InsertOne(document) for document in documents], **kwargs
+    )
+    result["ids"] = [document.get("_id") for document in documents]
+
+    return result
+
+  async def bulk_update(
+    self, collection: str, updates: List[Tuple[Any, dict]], **kwargs
+  ) -> dict:
+    """Updates objects in bulk from (filter, update) pairs."""
+    return await self.bulk_write(
+      collection,
+      [UpdateOne(filter, {"$set": update}) for filter, update in updates],
+      **kwargs,
+    )
 
-    return objects[offset:] if objects else []
+  async def bulk_delete(self, collection: str, filters: List[Any], **kwargs) -> dict:
+    """Deletes objects in bulk."""
+    return await self.bulk_write(
+      collection, [DeleteOne(filter) for filter in filters], **kwargs
+    )
 
   async def update(self, collection: str, *, update: dict, filter: Any = {}):
     """Updates an object."""
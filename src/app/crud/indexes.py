@@ -0,0 +1,124 @@
+from typing import Dict, List, Tuple, Type
+
+from core.logger import logger
+from pymongo import IndexModel
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+
+# Index options that don't change the index definition
+_IGNORED_OPTIONS = {"name", "key", "v", "ns", "background"}
+
+
+def _differs(declared: dict, existing: dict) -> bool:
+  """Checks if an existing index differs from its declaration."""
+  if list(declared["key"].items()) != [tuple(k) for k in existing["key"]]:
+    return True
+
+  options = (set(declared) | set(existing)) - _IGNORED_OPTIONS
+
+  return any(declared.get(option) != existing.get(option) for option in options)
+
+
+class IndexRegistry:
+  """
+  Registry of the indexes declared by CRUD classes. Each registered
+  class exposes `declared_indexes()` mapping collection names to the
+  `IndexModel`s they need.
+  """
+
+  _entries: List[Tuple[str, Type]] = []
+
+  @classmethod
+  def register(cls, database: str):
+    """Class decorator registering a CRUD class for a database."""
+
+    def decorator(crud: Type) -> Type:
+      cls._entries.append((database, crud))
+
+      return crud
+
+    return decorator
+
+  @classmethod
+  async def declared(cls, client: AsyncMongoClient) -> Dict[Tuple[str, str], list]:
+    """Returns the declared indexes keyed by (database, collection)."""
+    declared = {}
+
+    for database, crud in cls._entries:
+      db = client.get_database(database)
+
+      for collection, indexes in (await crud(db).declared_indexes()).items():
+        declared.setdefault((database, collection), []).extend(indexes)
+
+    return declared
+
+  @classmethod
+  async def drift(cls, client: AsyncMongoClient) -> List[dict]:
+    """
+    Compares the declared indexes with the existing ones. Returns the
+    collections with missing, changed or undeclared (extra) indexes.
+    """
+    report = []
+
+    for (database, collection), indexes in (await cls.declared(client)).items():
+      existing = await client.get_database(database)[collection].index_information()
+      declared = {index.document["name"]: index.document for index in indexes}
+
+      entry = {
+        "database": database,
+        "collection": collection,
+        "missing": [name for name in declared if name not in existing],
+        "changed": [
+          name
+          for name, document in declared.items()
+          if name in existing and _differs(document, existing[name])
+        ],
+        "extra": [name for name in existing if name != "_id_" and name not in declared],
+      }
+
+      if entry["missing"] or entry["changed"] or entry["extra"]:
+        report.append(entry)
+
+    return report
+
+  @classmethod
+  async def reconcile(
+    cls,
+    client: AsyncMongoClient,
+    *,
+    background: bool = False,
+    prune: bool = False,
+  ) -> List[dict]:
+    """
+    Creates the missing declared indexes and optionally drops the
+    undeclared ones. Changed indexes are only reported, since
+    rebuilding them may require dropping a unique constraint.
+    Returns the drift found before reconciling.
+    """
+    report = await cls.drift(client)
+    declared = await cls.declared(client)
+
+    for entry in report:
+      key = (entry["database"], entry["collection"])
+      collection = client.get_database(key[0])[key[1]]
+
+      if missing := [
+        IndexModel(
+          list(index.document["key"].items()),
+          **{k: v for k, v in index.document.items() if k != "key"},
+          **({"background": True} if background else {}),
+        )
+        for index in declared[key]
+        if index.document["name"] in entry["missing"]
+      ]:
+        await collection.create_indexes(missing)
+        logger.info(f"[+] Created indexes {entry['missing']} on {'.'.join(key)}.")
+
+      if prune:
+        for name in entry["extra"]:
+          await collection.drop_index(name)
+          logger.info(f"[+] Dropped undeclared index {name} on {'.'.join(key)}.")
+
+      if entry["changed"]:
+        logger.warning(f"Indexes {entry['changed']} on {'.'.join(key)} have drifted.")
+
+    return report
@@ -0,0 +1,87 @@
+import base64
+import binascii
+from typing import Any, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import ASCENDING
+
+
+class InvalidCursor(ValueError):
+  """Raised when a pagination cursor can't be decoded."""
+
+
+def encode_cursor(document: dict, *, sort_key: str, direction: int) -> str:
+  """Returns an opaque cursor pointing after the given document."""
+  payload = json_util.dumps(
+    {
+      "k": sort_key,
+      "d": direction,
+      "v": document.get(sort_key),
+      "id": document.get("_id"),
+    }
+  )
+
+  return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> dict:
+  """Decodes an opaque cursor produced by `encode_cursor`."""
+  padded = token + "=" * (-len(token) % 4)
+
+  try:
+    payload = json_util.loads(base64.urlsafe_b64decode(padded))
+  except (binascii.Error, TypeError, ValueError) as e:
+    raise InvalidCursor(str(e)) from e
+
+  if not isinstance(payload, dict) or not {"k", "d", "v", "id"} <= payload.keys():
+    raise InvalidCursor("Malformed cursor.")
+
+  return payload
+
+
+def sort_spec(
+  sort_key: str = "_id", direction: int = ASCENDING
+) -> List[Tuple[str, int]]:
+  """Returns the sort on the given key, breaking ties by `_id`."""
+  if sort_key == "_id":
+    return [("_id", direction)]
+
+  return [(sort_key, direction), ("_id", direction)]
+
+
+def keyset(
+  cursor: Optional[dict], *, sort_key: str = "_id", direction: int = ASCENDING
+) -> Tuple[dict, List[Tuple[str, int]]]:
+  """
+  Returns the range filter and sort selecting the documents after the
+  cursor.
+  """
+  sort = sort_spec(sort_key, direction)
+
+  if cursor is None:
+    return {}, sort
+
+  if cursor["k"] != sort_key or cursor["d"] != direction:
+    raise InvalidCursor("Cursor doesn't match the requested sort order.")
+
+  op = "$gt" if direction == ASCENDING else "$lt"
+
+  if sort_key == "_id":
+    return {"_id": {op: cursor["id"]}}, sort
+
+  return {
+    "$or": [
+      {sort_key: {op: cursor["v"]}},
+      {sort_key: cursor["v"], "_id": {op: cursor["id"]}},
+    ]
+  }, sort
+
+
+def merge_filters(*filters: Any) -> dict:
+  """Combines filters with `$and`, skipping the empty ones."""
+  filters = [f for f in filters if f]
+
+  if len(filters) > 1:
+    return {"$and": filters}
+
+  return filters[0] if filters else {}
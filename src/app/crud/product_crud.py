@@ -1,9 +1,20 @@
+from typing import List, Tuple
+
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 from .base_crud import BaseCRUD
+from .indexes import IndexRegistry
 
 
+@IndexRegistry.register("products")
 class ProductCRUD(BaseCRUD):
+  # Indexes of every category collection, backing sorted listings
+  indexes = [
+    IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price__id"),
+    IndexModel([("date", DESCENDING), ("_id", DESCENDING)], name="date__id"),
+  ]
+
   def __init__(self, db):
     super().__init__(db)
 
@@ -20,3 +31,27 @@ class ProductCRUD(BaseCRUD):
     return await self.update(
       category, update=update_data, filter={"_id": ObjectId(product_id)}
     )
+
+  async def bulk_update_products(self, category: str, updates: List[Tuple[str, dict]]):
+    """
+    Updates products in bulk from (product ID, update) pairs. Missing
+    products are reported as "not found" errors.
+    """
+    ids = [ObjectId(product_id) for product_id, _ in updates]
+
+    return await self.bulk_update(
+      category,
+      [({"_id": id}, update) for id, (_, update) in zip(ids, updates)],
+      ids=ids,
+    )
+
+  async def bulk_delete_products(self, category: str, product_ids: List[str]):
+    """
+    Deletes products in bulk by ID. Missing products are reported as
+    "not found" errors.
+    """
+    ids = [ObjectId(product_id) for product_id in product_ids]
+
+    return await self.bulk_delete(
+      category, [{"_id": id} for id in ids], ids=ids, once=True
+    )
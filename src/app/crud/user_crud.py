@@ -1,47 +1,171 @@
-from typing import List, Optional, Union
+from typing import Any, ClassVar, Dict, List, Optional, Union
 
-from core.config import ModelType
+from core.config import ModelType, settings
 from core.logger import logger
 from core.security.utils import Hash
+from pymongo import ASCENDING, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 
-from .base_crud import BaseCRUD
+from .base_crud import BaseCRUD, projection
+from .indexes import IndexRegistry
 
+# Default scopes granted to each role
+ROLE_SCOPES: Dict[str, List[str]] = {
+  "admins": ["admin"],
+  "sellers": ["seller"],
+  "customers": ["customer"],
+}
 
+# Normalized fields backing case-insensitive exact lookups
+LOOKUP_FIELDS = ("username_lc", "email_lc")
+
+LOOKUP_INDEXES = [
+  IndexModel(
+    [(field, ASCENDING)],
+    name=f"{field}_unique",
+    unique=True,
+    partialFilterExpression={field: {"$type": "string"}},
+  )
+  for field in LOOKUP_FIELDS
+]
+# Serves role filters sorted by `_id`, as used by paginated listings
+ROLE_INDEX = IndexModel([("role", ASCENDING), ("_id", ASCENDING)], name="role__id")
+
+
+def _email_address(email: Any) -> Optional[str]:
+  """Returns the address of an email stored either as a string or a document."""
+  if isinstance(email, dict):
+    email = email.get("address")
+
+  return email if isinstance(email, str) else None
+
+
+def lookup_keys(user: dict) -> dict:
+  """Returns the normalized lookup fields of a user profile."""
+  keys = {}
+
+  if (username := user.get("username")) is not None:
+    keys["username_lc"] = str(username).lower()
+
+  if "email" in user:
+    email = _email_address(user.get("email"))
+    keys["email_lc"] = email.lower() if email else None
+
+  return keys
+
+
+@IndexRegistry.register("users")
 class UserCRUD(BaseCRUD):
+  # Whether profiles missing the lookup fields, until they're backfilled,
+  # are also looked up by their raw username and email
+  lookup_fallback: ClassVar[bool] = settings.USERS_LOOKUP_FALLBACK
+
   def __init__(self, db):
     super().__init__(db)
+    self.single_collection = settings.USERS_STORAGE_MODE == "single"
+
+  def collection_for(self, role: str) -> str:
+    """Returns the collection name holding users of a role."""
+    return settings.USERS_COLLECTION if self.single_collection else role
+
+  def role_filter(self, role: Optional[str]) -> dict:
+    """Returns the filter selecting users of a role."""
+    return {"role": role} if role and self.single_collection else {}
+
+  async def collections(self) -> List[str]:
+    """Returns the collection names holding user profiles."""
+    if self.single_collection:
+      return [settings.USERS_COLLECTION]
+
+    return await self.db.list_collection_names()
+
+  async def collections_for(self, role: Optional[str] = None) -> List[str]:
+    """
+    Returns the collection names possibly holding a user, narrowed to
+    the collection of the role when it's known.
+    """
+    if role:
+      return [self.collection_for(role)]
+
+    return await self.collections()
+
+  async def declared_indexes(self) -> Dict[str, List[IndexModel]]:
+    """
+    Returns the indexes required by the storage mode. Lookup fields are
+    unique per collection, so in per-role mode uniqueness across roles
+    is still enforced by the signup conflict checks.
+    """
+    if self.single_collection:
+      return {settings.USERS_COLLECTION: [*LOOKUP_INDEXES, ROLE_INDEX]}
+
+    return {
+      collection: LOOKUP_INDEXES
+      for collection in sorted(set(ROLE_SCOPES) | set(await self.collections()))
+    }
+
+  @staticmethod
+  def lookup_filter(*keys: Union[str, int, None]) -> dict:
+    """Returns an index-backed filter matching usernames or emails exactly."""
+    values = list({str(key).lower() for key in keys if key is not None})
+
+    # Without any key, nothing is matched
+    return {
+      "$or": [
+        {field: values[0] if len(values) == 1 else {"$in": values}}
+        for field in LOOKUP_FIELDS
+      ]
+    }
+
+  def lookup_filters(self, *keys: Union[str, int, None]) -> List[dict]:
+    """
+    Returns the filters tried in turn to match usernames or emails: the
+    lookup fields and, with `USERS_LOOKUP_FALLBACK`, the raw fields of
+    the profiles without them. The fallback isn't indexed, so it's
+    only meant to be enabled until `manage.py backfill-users` has run.
+    """
+    filters = [self.lookup_filter(*keys)]
+
+    if UserCRUD.lookup_fallback:
+      raw = {str(key) for key in keys if key is not None}
+      values = sorted(raw | {value.lower() for value in raw})
+      filters.append(
+        {
+          "username_lc": {"$exists": False},
+          "$or": [
+            {field: {"$in": values}} for field in ("username", "email", "email.address")
+          ],
+        }
+      )
+
+    return filters
+
+  @staticmethod
+  def projection(
+    include: Optional[List[str]] = None, exclude: Optional[List[str]] = None
+  ) -> dict:
+    """Returns the projection of user profiles, omitting the lookup fields."""
+    return projection(include, [*(exclude or []), *LOOKUP_FIELDS])
 
   async def find(
-    self, *, username: str, exclude: Optional[List] = None
+    self,
+    *,
+    username: str,
+    exclude: Optional[List] = None,
+    include: Optional[List] = None,
   ) -> Union[dict, None]:
-    """Finds user profile using username."""
+    """
+    Finds user profile using username or email (case-insensitive).
+    The `include`/`exclude` fields are applied as a MongoDB projection.
+    """
     try:
-      user = None
-
-      for collection in await self.db.list_collection_names():
-        if user := await self.db[collection].find_one(
-          {
-            "$or": [
-              {
-                "username": {
-                  "$regex": username,
-                  "$options": "i",
-                }
-              },
-              {"email": {"$regex": username, "$options": "i"}},
-            ]
-          }
-        ):
-          break
-
-      if not user:
-        return None
+      fields = self.projection(include, exclude)
 
-      if exclude:
-        for key in exclude:
-          user.pop(key)
+      for filter in self.lookup_filters(username):
+        for collection in await self.collections():
+          if user := await self.db[collection].find_one(filter, projection=fields):
+            return user
 
-      return user
+      return None
     except Exception as e:
       logger.error(
         {
@@ -53,30 +177,169 @@ class UserCRUD(BaseCRUD):
 
       return
 
+  async def exists(
+    self, *, username: Union[str, int], email: Optional[str] = None
+  ) -> bool:
+    """Checks if the username or email is taken by any user profile."""
+    for filter in self.lookup_filters(username, email):
+      for collection in await self.collections():
+        if await self.db[collection].find_one(filter, projection={"_id": True}):
+          return True
+
+    return False
+
   async def create(self, user: ModelType):
     """Creates a user profile."""
-    user.password = Hash.hash(plain=user.password)
-    await self.db[user.role].insert_one(user.model_dump())
+    user.password = await Hash.ahash(plain=user.password)
+    document = user.model_dump()
+    document.update(lookup_keys(document))
+
+    await self.db[self.collection_for(user.role)].insert_one(document)
 
     return user
 
-  async def update(self, username: Union[str, int], update: dict) -> Union[dict, None]:
-    """Updates a user profile."""
-    if not (user := await self.find(username=username)):
-      return
+  async def read_all(
+    self,
+    role: str,
+    *,
+    filter: dict = {},
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    **kwargs,
+  ):
+    """Reads all user profiles of a role."""
+    return await super().read_all(
+      self.collection_for(role),
+      filter={**filter, **self.role_filter(role)},
+      projection=self.projection(include, exclude),
+      **kwargs,
+    )
 
-    return await self.db[user.get("role")].find_one_and_update(
-      filter=user, update={"$set": update}
+  async def read_page(
+    self,
+    role: str,
+    *,
+    filter: dict = {},
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    **kwargs,
+  ):
+    """Reads a page of user profiles of a role."""
+    return await super().read_page(
+      self.collection_for(role),
+      filter={**filter, **self.role_filter(role)},
+      projection=self.projection(include, exclude),
+      **kwargs,
     )
 
-  async def delete(self, username: Union[str, int]):
-    """Deletes a user profile."""
-    if not (user := await self.find(username=username)):
-      return
+  def stream(
+    self,
+    role: str,
+    *,
+    filter: dict = {},
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    **kwargs,
+  ):
+    """Iterates over the user profiles of a role."""
+    return super().stream(
+      self.collection_for(role),
+      filter={**filter, **self.role_filter(role)},
+      projection=self.projection(include, exclude),
+      **kwargs,
+    )
+
+  async def count(self, role: str) -> int:
+    """Counts user profiles of a role."""
+    return await self.db[self.collection_for(role)].count_documents(
+      self.role_filter(role)
+    )
+
+  @staticmethod
+  def update_spec(update: dict) -> dict:
+    """
+    Returns the update setting the fields and bumping the profile
+    `version`, which orders the profiles written to the cache.
+    """
+    return {"$set": {**update, **lookup_keys(update)}, "$inc": {"version": 1}}
+
+  async def update(
+    self,
+    username: Union[str, int],
+    update: dict,
+    *,
+    role: Optional[str] = None,
+    exclude: Optional[List[str]] = None,
+  ) -> Union[dict, None]:
+    """
+    Updates a user profile matched by the indexed lookup fields and
+    returns the updated profile. A single round trip is needed in
+    single-collection mode or when the `role` is known, in which case
+    only users of that role are matched.
+    """
+    for filter in self.lookup_filters(username):
+      for collection in await self.collections_for(role):
+        if user := await self.db[collection].find_one_and_update(
+          {**filter, **self.role_filter(role)},
+          self.update_spec(update),
+          projection=self.projection(exclude=exclude),
+          return_document=ReturnDocument.AFTER,
+        ):
+          return user
+
+    return None
 
-    result = await self.db[user.get("role")].delete_one(user)
+  async def update_by_id(
+    self,
+    user: dict,
+    update: dict,
+    *,
+    exclude: Optional[List[str]] = None,
+  ) -> Union[dict, None]:
+    """Updates an already fetched user profile by `_id`."""
+    return await self.db[self.collection_for(user.get("role"))].find_one_and_update(
+      {"_id": user["_id"]},
+      self.update_spec(update),
+      projection=self.projection(exclude=exclude),
+      return_document=ReturnDocument.AFTER,
+    )
+
+  async def change_role(self, user: dict, new_role: str, *, session=None):
+    """
+    Changes a user's role, resetting the scopes to the role defaults.
+    In per-role mode the profile is moved between collections, so the
+    caller should pass a `session` with an active transaction.
+    """
+    update = {"role": new_role, "scopes": ROLE_SCOPES.get(new_role, ["customer"])}
+
+    if self.single_collection:
+      return await self.db[settings.USERS_COLLECTION].update_one(
+        {"_id": user["_id"]}, self.update_spec(update), session=session
+      )
+
+    old_role = user.get("role")
+    user.update(update)
+    user["version"] = user.get("version", 0) + 1
+    user.update(lookup_keys(user))
+
+    await self.db[new_role].insert_one(user, session=session)
+    await self.db[old_role].delete_one({"_id": user["_id"]}, session=session)
+
+  async def delete(
+    self, username: Union[str, int], *, role: Optional[str] = None
+  ) -> Union[dict, None]:
+    """
+    Deletes a user profile matched by the indexed lookup fields and
+    returns its `_id` and stored `username`.
+    """
+    for filter in self.lookup_filters(username):
+      for collection in await self.collections_for(role):
+        if user := await self.db[collection].find_one_and_delete(
+          {**filter, **self.role_filter(role)}, projection={"username": True}
+        ):
+          return user
 
-    return result.deleted_count
+    return None
 
   async def authenticate(
     self,
@@ -85,14 +348,102 @@ class UserCRUD(BaseCRUD):
     plain_pwd: str,
     exclude: Optional[List] = None,
   ) -> Union[dict, None]:
-    """Authenticates a user using credentials."""
-    user = await self.find(username=username)
+    """
+    Authenticates a user using credentials. The password hash is always
+    fetched to be verified, and dropped afterwards if excluded.
+    """
+    exclude = exclude or []
+    user = await self.find(
+      username=username, exclude=[key for key in exclude if key != "password"]
+    )
 
-    if not user or not Hash.verify(plain_pwd, user.get("password")):
+    if not user or not await Hash.averify(plain_pwd, user.get("password")):
       return
 
-    if exclude:
-      for key in exclude:
-        user.pop(key)
+    if "password" in exclude:
+      user.pop("password")
 
     return user
+
+  async def migrate_to_single_collection(
+    self, *, drop: bool = False, batch_size: int = 1000
+  ) -> Dict[str, int]:
+    """
+    Moves users from the per-role collections into the single users
+    collection. Documents are upserted by `_id`, so the migration can
+    be safely re-run. Returns the number of moved documents per role.
+    """
+    target = self.db[settings.USERS_COLLECTION]
+    moved = {}
+
+    for role in await self.db.list_collection_names():
+      if role == settings.USERS_COLLECTION:
+        continue
+
+      requests, moved[role] = [], 0
+
+      async for user in self.db[role].find({}, batch_size=batch_size):
+        user["role"] = role
+        user.update(lookup_keys(user))
+        requests.append(ReplaceOne({"_id": user["_id"]}, user, upsert=True))
+
+        if len(requests) >= batch_size:
+          await target.bulk_write(requests, ordered=False)
+          moved[role] += len(requests)
+          requests = []
+
+      if requests:
+        await target.bulk_write(requests, ordered=False)
+        moved[role] += len(requests)
+
+      if drop:
+        await self.db.drop_collection(role)
+
+      logger.info(f"[+] Migrated {moved[role]} users from '{role}' collection.")
+
+    await target.create_indexes([*LOOKUP_INDEXES, ROLE_INDEX])
+
+    return moved
+
+  async def backfill_lookup_keys(self, *, batch_size: int = 1000) -> int:
+    """
+    Sets the normalized lookup fields on profiles created before they
+    were introduced. Returns the number of updated documents. Profiles
+    conflicting with another one once normalized are logged and left
+    as they are.
+    """
+    updated = 0
+
+    async def write(collection: str, requests: List[UpdateOne]) -> int:
+      try:
+        await self.db[collection].bulk_write(requests, ordered=False)
+
+        return len(requests)
+      except BulkWriteError as e:
+        logger.warning(
+          {
+            "message": f"[x] Couldn't backfill the lookup fields of '{collection}'.",
+            "detail": str(e),
+          }
+        )
+
+        return e.details.get("nModified", 0)
+
+    for collection in await self.collections():
+      requests = []
+
+      async for user in self.db[collection].find(
+        {"username_lc": {"$exists": False}},
+        projection={"username": True, "email": True},
+        batch_size=batch_size,
+      ):
+        requests.append(UpdateOne({"_id": user["_id"]}, {"$set": lookup_keys(user)}))
+
+        if len(requests) >= batch_size:
+          updated += await write(collection, requests)
+          requests = []
+
+      if requests:
+        updated += await write(collection, requests)
+
+    return updated
@@ -1,11 +1,22 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from api.api import api_main_router
-from api.dependencies import limiter
+from api.dependencies import limit_dependency, limiter, route_limits
 from core.config import settings
 from core.database import MongoClient, RedisClient
-from core.errors import rate_limit_exceeded_handler
+from core.errors import (
+  hash_pool_busy_handler,
+  invalid_cursor_handler,
+  rate_limit_exceeded_handler,
+)
+from core.logger import logger
 from core.middleware import RateLimitMiddleware
+from core.security.utils import Hash, HashPoolBusy
+from core.services.categories import CategoryRegistry
+from core.services.revocations import RevokedTokens
+from crud import IndexRegistry
+from crud.pagination import InvalidCursor
 from fastapi import FastAPI
 from prometheus_fastapi_instrumentator import Instrumentator
 
@@ -15,15 +26,54 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
 
+async def sync_indexes():
+  """Reconciles the indexes declared by CRUD classes."""
+  try:
+    await IndexRegistry.reconcile(
+      MongoClient._client, background=settings.MONGO_INDEX_BACKGROUND
+    )
+  except Exception as e:
+    logger.error(
+      {"message": "[x] Failed to reconcile MongoDB indexes.", "detail": str(e)},
+      exc_info=True,
+    )
+
+
 # Initialize lifespan events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
   await RedisClient.connect()
   await MongoClient.connect()
-  
+
+  # Invalidate in-process caches on events published by other workers
+  RedisClient.subscribe(CategoryRegistry.CHANNEL, CategoryRegistry.expire)
+  RedisClient.subscribe(RevokedTokens.CHANNEL, RevokedTokens.receive)
+  RedisClient.start_listener()
+
+  try:
+    await CategoryRegistry.load(MongoClient.get_database("products"))
+  except Exception as e:
+    logger.error(
+      {"message": "[x] Failed to load product categories.", "detail": str(e)},
+      exc_info=True,
+    )
+
+  tasks = []
+
+  if settings.MONGO_SYNC_INDEXES:
+    if settings.MONGO_INDEX_BACKGROUND:
+      tasks.append(asyncio.create_task(sync_indexes()))
+    else:
+      await sync_indexes()
+
   try:
     yield
   finally:
+    for task in tasks:
+      task.cancel()
+
+    await route_limits.close()
+    Hash.close()
     await MongoClient.close()
     await RedisClient.close()
 
@@ -52,6 +102,8 @@ def create_app() -> FastAPI:
   # Attach limiter to the app
   app.state.limiter = limiter
   app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+  app.add_exception_handler(InvalidCursor, invalid_cursor_handler)
+  app.add_exception_handler(HashPoolBusy, hash_pool_busy_handler)
 
   # Set all CORS enabled origins
   if settings.all_cors_origins:
@@ -70,6 +122,9 @@ def create_app() -> FastAPI:
   # Include main router to the app
   app.include_router(api_main_router)
 
+  # Parse the rate limits of the routes once
+  route_limits.compile(app.routes, limit_dependency)
+
   return app
 
 
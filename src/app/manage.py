@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from functools import partial
+from typing import Awaitable, Callable
+
+import jwt
+import redis.asyncio as aioredis
+from core.config import settings
+from core.database import MongoClient
+from core.logger import logger
+from core.security.keys import KeyManager
+from core.services.rate_limits import RouteLimits, SharedMemoryLimits
+from crud import IndexRegistry, UserCRUD
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+from starlette.requests import Request
+
+
+async def migrate_users(args: argparse.Namespace):
+  """Moves users from per-role collections into the single users collection."""
+  users_db = MongoClient.get_database("users")
+  moved = await UserCRUD(users_db).migrate_to_single_collection(
+    drop=args.drop, batch_size=args.batch_size
+  )
+
+  logger.info(f"[+] Migrated {sum(moved.values())} users in total.")
+
+
+async def backfill_users(args: argparse.Namespace):
+  """Sets the normalized lookup fields on existing user profiles."""
+  users_db = MongoClient.get_database("users")
+  updated = await UserCRUD(users_db).backfill_lookup_keys(batch_size=args.batch_size)
+
+  logger.info(f"[+] Backfilled lookup fields of {updated} users.")
+
+
+async def indexes(args: argparse.Namespace):
+  """Reports drift between declared and existing indexes."""
+  if args.apply:
+    report = await IndexRegistry.reconcile(MongoClient._client, prune=args.prune)
+  else:
+    report = await IndexRegistry.drift(MongoClient._client)
+
+  print(json.dumps(report, indent=2))
+
+
+def _throughput(func: Callable[[], object], seconds: float) -> float:
+  """Returns how many times per second `func` runs."""
+  count, start = 0, time.perf_counter()
+
+  while (elapsed := time.perf_counter() - start) < seconds:
+    func()
+    count += 1
+
+  return count / elapsed
+
+
+async def bench_jwt(args: argparse.Namespace):
+  """Compares the JWT signing and verification throughput of the algorithms."""
+  payload = {
+    "sub": "benchmark",
+    "role": "customers",
+    "scopes": ["customer"],
+    "exp": int(time.time()) + 3600,
+  }
+  private_keys = {
+    "RS256": rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    "ES256": ec.generate_private_key(ec.SECP256R1()),
+    "EdDSA": ed25519.Ed25519PrivateKey.generate(),
+  }
+
+  print(f"{'algorithm':<18}{'sign/s':>12}{'verify/s':>12}")
+
+  for name, private_key in private_keys.items():
+    private_pem = private_key.private_bytes(
+      serialization.Encoding.PEM,
+      serialization.PrivateFormat.PKCS8,
+      serialization.NoEncryption(),
+    ).decode()
+    public_pem = (
+      private_key.public_key()
+      .public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+      )
+      .decode()
+    )
+    keys = KeyManager(private_pem)
+    headers = {"kid": keys.kid}
+    token = jwt.encode(payload, keys.private_key, keys.algorithm, headers)
+    key = keys.verification_key(token)
+
+    results = {
+      name: (
+        partial(jwt.encode, payload, keys.private_key, keys.algorithm, headers),
+        partial(jwt.decode, token, key.key, algorithms=[key.algorithm]),
+      ),
+    }
+
+    # PEM strings are parsed again by every call
+    if name == "RS256":
+      results[f"{name} (PEM)"] = (
+        partial(jwt.encode, payload, private_pem, name),
+        partial(jwt.decode, token, public_pem, algorithms=[name]),
+      )
+
+    for label, (sign, verify) in results.items():
+      print(
+        f"{label:<18}"
+        f"{_throughput(sign, args.seconds):>12.0f}"
+        f"{_throughput(verify, args.seconds):>12.0f}"
+      )
+
+
+async def _async_throughput(
+  func: Callable[[], Awaitable[object]], seconds: float
+) -> float:
+  """Returns how many times per second `func` is awaited."""
+  count, start = 0, time.perf_counter()
+
+  while (elapsed := time.perf_counter() - start) < seconds:
+    await func()
+    count += 1
+
+  return count / elapsed
+
+
+async def bench_limits(args: argparse.Namespace):
+  """
+  Compares building the rate limit of every request to compiled limits,
+  counted in moving windows, by GCRA in shared memory and, with a Redis
+  storage, by GCRA in Redis.
+  """
+  limiter = Limiter(key_func=get_remote_address, storage_uri=args.storage)
+  limits = {role: "1000000/minute" for role in settings.RATE_LIMITS}
+  moving_window = RouteLimits(limiter, limits, "moving-window")
+  gcra = RouteLimits(limiter, limits, "gcra")
+  directory = tempfile.TemporaryDirectory(
+    dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+  )
+  shared = RouteLimits(
+    limiter,
+    limits,
+    "gcra",
+    shared=SharedMemoryLimits(f"{directory.name}/limits", 65_536, 64, 0),
+  )
+  redis = aioredis.from_url(args.storage) if args.storage.startswith("redis") else None
+
+  async def endpoint(request: Request):
+    pass
+
+  def request() -> Request:
+    scope = {
+      "type": "http",
+      "method": "GET",
+      "path": "/benchmark",
+      "headers": [],
+      "client": ("127.0.0.1", 0),
+      "endpoint": endpoint,
+      "state": {"identifier": "customers:benchmark", "limit_role": "customers"},
+    }
+
+    return Request(scope)
+
+  async def per_request():
+    # How `limit_dependency` applied the limits before they were compiled
+    current = request()
+
+    async def dummy(request: Request):
+      pass
+
+    dummy.__module__, dummy.__name__ = endpoint.__module__, endpoint.__name__
+    limiter._route_limits.pop(f"{dummy.__module__}.{dummy.__name__}", None)
+
+    await limiter.limit(
+      limit_value=limits["customers"],
+      key_func=lambda request: request.state.identifier,
+    )(dummy)(current)
+
+  checks = {
+    "per request": per_request,
+    "moving-window": lambda: moving_window.check(request(), redis, "customers"),
+    "shared memory": lambda: shared.check(request(), redis, "customers"),
+  }
+
+  if redis is not None:
+    checks["gcra"] = lambda: gcra.check(request(), redis, "customers")
+
+  print(f"{'limits':<14}{'checks/s':>12}")
+
+  try:
+    for label, check in checks.items():
+      print(f"{label:<14}{await _async_throughput(check, args.seconds):>12.0f}")
+  finally:
+    await shared.close()
+    directory.cleanup()
+
+    if redis is not None:
+      await redis.aclose()
+
+
+async def main(args: argparse.Namespace):
+  if not args.database:
+    return await args.command(args)
+
+  await MongoClient.connect()
+
+  try:
+    await args.command(args)
+  finally:
+    await MongoClient.close()
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Management commands.")
+  parser.set_defaults(database=True)
+  subparsers = parser.add_subparsers(required=True)
+
+  migrate = subparsers.add_parser(
+    "migrate-users",
+    help="Move users from per-role collections into a single collection.",
+  )
+  migrate.add_argument(
+    "--drop",
+    action="store_true",
+    help="Drop the per-role collections after migrating them.",
+  )
+  migrate.add_argument("--batch-size", type=int, default=1000)
+  migrate.set_defaults(command=migrate_users)
+
+  backfill = subparsers.add_parser(
+    "backfill-users",
+    help="Set the normalized username/email lookup fields on existing users.",
+  )
+  backfill.add_argument("--batch-size", type=int, default=1000)
+  backfill.set_defaults(command=backfill_users)
+
+  index = subparsers.add_parser(
+    "indexes",
+    help="Report drift between the declared and existing MongoDB indexes.",
+  )
+  index.add_argument("--apply", action="store_true", help="Create the missing indexes.")
+  index.add_argument(
+    "--prune",
+    action="store_true",
+    help="Drop undeclared indexes (requires --apply).",
+  )
+  index.set_defaults(command=indexes)
+
+  bench = subparsers.add_parser(
+    "bench-jwt",
+    help="Compare the JWT throughput of the RS256, ES256 and EdDSA algorithms.",
+  )
+  bench.add_argument(
+    "--seconds", type=float, default=1.0, help="Duration of each measurement."
+  )
+  bench.set_defaults(command=bench_jwt, database=False)
+
+  bench_limit = subparsers.add_parser(
+    "bench-limits",
+    help="Compare per-request, compiled, shared memory and Redis rate limit checks.",
+  )
+  bench_limit.add_argument(
+    "--seconds", type=float, default=1.0, help="Duration of each measurement."
+  )
+  bench_limit.add_argument(
+    "--storage",
+    default="memory://",
+    help="Storage of the counters, e.g. redis://localhost:6379.",
+  )
+  bench_limit.set_defaults(command=bench_limits, database=False)
+
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  asyncio.run(main(parse_args()))
@@ -2,12 +2,16 @@ from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from api.dependencies import (
+  authorize_user,
   get_current_user,
   get_mongo_client,
   get_redis_client,
   limit_dependency,
 )
+from core.cache import local_cache
 from core.database import MongoClient
+from core.security.jwt import OAuthJWTBearer
+from core.services.categories import CategoryRegistry
 from fastapi.testclient import TestClient
 
 from app.main import app
@@ -39,7 +43,15 @@ def mock_mongo_client():
           coll.update_many = AsyncMock(return_value=MagicMock(modified_count=1))
           coll.delete_one = AsyncMock(return_value=MagicMock(deleted_count=1))
           coll.find_one_and_update = AsyncMock(return_value=None)
+          coll.find_one_and_delete = AsyncMock(return_value=None)
           coll.count_documents = AsyncMock(return_value=0)
+          coll.create_index = AsyncMock(return_value=None)
+          coll.create_indexes = AsyncMock(return_value=[])
+          coll.bulk_write = AsyncMock(return_value=MagicMock(bulk_api_result={}))
+          coll.index_information = AsyncMock(
+            return_value={"_id_": {"v": 2, "key": [("_id", 1)]}}
+          )
+          coll.drop_index = AsyncMock(return_value=None)
 
           mock_cursor = MagicMock()
           mock_cursor.to_list = AsyncMock(return_value=[])
@@ -97,6 +109,9 @@ def client(mock_mongo_client, mock_redis_client):
   app.dependency_overrides[limit_dependency] = lambda: None
 
   with TestClient(app) as c:
+    # Reload categories and cached entries from the mocks of the test
+    CategoryRegistry.expire()
+    local_cache.invalidate(None)
     yield c
 
   app.dependency_overrides = {}
@@ -112,6 +127,7 @@ def authorized_client(client):
     "scopes": ["admin", "seller", "customer"],
   }
   app.dependency_overrides[get_current_user] = lambda: user_data
+  app.dependency_overrides[authorize_user] = lambda: user_data
 
   return client
 
@@ -126,6 +142,7 @@ def seller_client(client):
     "scopes": ["seller"],
   }
   app.dependency_overrides[get_current_user] = lambda: user_data
+  app.dependency_overrides[authorize_user] = lambda: user_data
 
   return client
 
@@ -140,5 +157,24 @@ def customer_client(client):
     "scopes": ["customer"],
   }
   app.dependency_overrides[get_current_user] = lambda: user_data
+  app.dependency_overrides[authorize_user] = lambda: user_data
 
   return client
+
+
+@pytest.fixture
+def bearer_headers(mock_mongo_client):
+  """Authorization headers with a token of a customer seeded in the database."""
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one.return_value = {
+    "username": "testuser",
+    "role": "customers",
+    "scopes": ["customer"],
+  }
+
+  token = OAuthJWTBearer.encode(
+    {"sub": "testuser", "role": "customers", "scopes": ["customer"]}
+  )["jwt"]
+
+  return {"Authorization": f"Bearer {token}"}
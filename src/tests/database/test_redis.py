@@ -0,0 +1,171 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import redis.asyncio as aioredis
+from core.database import LuaScript, RedisClient
+from core.database.redis import AutoPipelineRedis
+from redis.exceptions import NoScriptError, ResponseError
+
+
+class FakePipeline:
+  """Pipeline answering the queued commands with `respond(*args)`."""
+
+  def __init__(self, respond):
+    self.respond = respond
+    self.commands = []
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    return None
+
+  def execute_command(self, *args, **options):
+    self.commands.append(args)
+
+  async def execute(self, raise_on_error: bool = True):
+    results = []
+
+    for args in self.commands:
+      try:
+        results.append(self.respond(*args))
+      except Exception as e:
+        results.append(e)
+
+    return results
+
+
+@pytest.fixture
+def redis(monkeypatch):
+  """Auto-pipelining client answering from `redis.respond`, recording batches."""
+  client = AutoPipelineRedis()
+  client.respond = lambda *args: args[-1]
+  client.batches = []
+
+  def pipeline(transaction: bool = True):
+    pipe = FakePipeline(lambda *args: client.respond(*args))
+    client.batches.append(pipe.commands)
+
+    return pipe
+
+  async def execute_command(self, *args, **options):
+    client.batches.append([args])
+
+    return client.respond(*args)
+
+  monkeypatch.setattr(client, "pipeline", pipeline)
+  monkeypatch.setattr(aioredis.Redis, "execute_command", execute_command)
+
+  return client
+
+
+async def test_concurrent_commands_share_a_pipeline(redis):
+  results = await asyncio.gather(*(redis.get(f"key:{i}") for i in range(3)))
+
+  assert results == ["key:0", "key:1", "key:2"]
+  assert redis.batches == [[("GET", f"key:{i}") for i in range(3)]]
+
+
+async def test_single_command_is_sent_alone(redis):
+  assert await redis.get("key") == "key"
+  assert await redis.get("other") == "other"
+  # Commands awaited one after the other aren't delayed into a pipeline
+  assert redis.batches == [[("GET", "key")], [("GET", "other")]]
+
+
+async def test_errors_are_raised_by_their_command(redis):
+  def respond(*args):
+    if args[-1] == "bad":
+      raise ResponseError("WRONGTYPE")
+
+    return args[-1]
+
+  redis.respond = respond
+
+  results = await asyncio.gather(
+    redis.get("good"), redis.get("bad"), redis.get("other"), return_exceptions=True
+  )
+
+  assert results[0] == "good"
+  assert isinstance(results[1], ResponseError)
+  assert results[2] == "other"
+
+
+async def test_lua_script_falls_back_to_eval(redis):
+  script = LuaScript("return ARGV[1]")
+
+  def respond(*args):
+    if args[0] == "EVALSHA":
+      raise NoScriptError("NOSCRIPT")
+
+    return args[-1]
+
+  redis.respond = respond
+
+  results = await asyncio.gather(script(redis, args=["a"]), redis.get("key"))
+
+  assert results == ["a", "key"]
+  # The missing script is sent again in a later batch, without failing
+  # the command pipelined with it
+  assert [[args[0] for args in batch] for batch in redis.batches] == [
+    ["EVALSHA", "GET"],
+    ["EVAL"],
+  ]
+
+
+async def test_cancelled_caller_doesnt_fail_the_batch(redis):
+  cancelled = asyncio.ensure_future(redis.get("cancelled"))
+  waiting = asyncio.ensure_future(redis.get("waiting"))
+  await asyncio.sleep(0)
+  cancelled.cancel()
+
+  assert await waiting == "waiting"
+  assert cancelled.cancelled()
+
+
+async def test_cancelled_batch_cancels_its_commands(redis):
+  sent = asyncio.Event()
+
+  async def execute(raise_on_error: bool = True):
+    sent.set()
+    await asyncio.Event().wait()
+
+  def pipeline(transaction: bool = True):
+    pipe = FakePipeline(None)
+    pipe.execute = execute
+
+    return pipe
+
+  redis.pipeline = pipeline
+  commands = asyncio.gather(redis.get("a"), redis.get("b"), return_exceptions=True)
+  await sent.wait()
+
+  for batch in redis._batches:
+    batch.cancel()
+
+  results = await commands
+
+  assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+
+def test_redis_client_pipeline(monkeypatch):
+  client = MagicMock()
+  monkeypatch.setattr(RedisClient, "_client", client)
+
+  pipe = RedisClient().pipeline(transaction=False)
+
+  assert pipe is client.pipeline.return_value
+  client.pipeline.assert_called_once_with(transaction=False)
+
+
+async def test_redis_client_pipeline_sends_commands_together(monkeypatch):
+  client = AsyncMock()
+  client.pipeline = MagicMock(return_value=FakePipeline(lambda *args: args[-1]))
+  monkeypatch.setattr(RedisClient, "_client", client)
+
+  async with RedisClient().pipeline(transaction=False) as pipe:
+    pipe.execute_command("GET", "a")
+    pipe.execute_command("GET", "b")
+
+    assert await pipe.execute() == ["a", "b"]
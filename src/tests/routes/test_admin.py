@@ -1,6 +1,11 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
+from core.config import settings
+from core.services.categories import CategoryRegistry
+from core.services.profiles import ProfileCache
+from crud import IndexRegistry, UserCRUD
 from fastapi import status
+from pymongo import UpdateOne
 
 
 def test_create_admin(client, mock_mongo_client):
@@ -53,6 +58,7 @@ def test_change_user_role(authorized_client, mock_mongo_client):
 
   # Mock user exists
   user_data = {
+    "_id": "id1",
     "username": "cust1",
     "role": "customers",
     "scopes": ["customer"],
@@ -67,3 +73,139 @@ def test_change_user_role(authorized_client, mock_mongo_client):
   assert (
     response.json()["message"] == "User cust1 role updated from customers to sellers"
   )
+  mock_db["customers"].delete_one.assert_awaited_once()
+  assert mock_db["customers"].delete_one.call_args.args[0] == {"_id": "id1"}
+
+
+def test_change_user_role_by_email_evicts_the_profile(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers", "sellers"]
+  mock_db["customers"].find_one.return_value = {
+    "_id": "id1",
+    "username": "cust1",
+    "email": "cust1@example.com",
+    "role": "customers",
+    "scopes": ["customer"],
+  }
+
+  response = authorized_client.patch(
+    "/api/v1/admin/users/cust1@example.com/role", json={"new_role": "sellers"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  # The profile of the token subject no longer grants the previous scopes
+  assert ProfileCache.cache.key("cust1") in mock_redis_client.delete.await_args.args
+
+
+def test_change_user_role_single_collection(
+  authorized_client, mock_mongo_client, monkeypatch
+):
+  monkeypatch.setattr(settings, "USERS_STORAGE_MODE", "single")
+
+  mock_db = mock_mongo_client.get_database("users")
+  users = mock_db[settings.USERS_COLLECTION]
+  users.find_one.return_value = {
+    "_id": "id1",
+    "username": "cust1",
+    "role": "customers",
+    "scopes": ["customer"],
+  }
+  mock_db.list_collection_names.reset_mock()
+
+  response = authorized_client.patch(
+    "/api/v1/admin/users/cust1/role", json={"new_role": "sellers"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  users.update_one.assert_awaited_once()
+  # Matched by the `_id` of the looked-up profile, not an unindexed field
+  assert users.update_one.call_args.args[0] == {"_id": "id1"}
+  assert users.update_one.call_args.args[1] == {
+    "$set": {"role": "sellers", "scopes": ["seller"]},
+    "$inc": {"version": 1},
+  }
+  mock_db.list_collection_names.assert_not_called()
+  mock_mongo_client.start_session.assert_not_called()
+
+
+def test_admin_dashboard_single_collection(
+  authorized_client, mock_mongo_client, monkeypatch
+):
+  monkeypatch.setattr(settings, "USERS_STORAGE_MODE", "single")
+
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db[settings.USERS_COLLECTION].count_documents.return_value = 3
+
+  response = authorized_client.get("/api/v1/admin/dashboard")
+
+  assert response.status_code == status.HTTP_200_OK
+  mock_db[settings.USERS_COLLECTION].count_documents.assert_any_await(
+    {"role": "sellers"}
+  )
+
+
+def test_index_drift(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db["customers"].index_information.return_value = {
+    "_id_": {"v": 2, "key": [("_id", 1)]},
+    "username_lc_unique": {
+      "v": 2,
+      "key": [("username_lc", 1)],
+      "unique": True,
+      "partialFilterExpression": {"username_lc": {"$type": "string"}},
+    },
+    "legacy": {"v": 2, "key": [("username", 1)]},
+  }
+
+  response = authorized_client.get("/api/v1/admin/indexes")
+
+  assert response.status_code == status.HTTP_200_OK
+  drift = {entry["collection"]: entry for entry in response.json()}
+  assert drift["customers"]["missing"] == ["email_lc_unique"]
+  assert drift["customers"]["changed"] == []
+  assert drift["customers"]["extra"] == ["legacy"]
+  assert drift["admins"]["missing"] == ["username_lc_unique", "email_lc_unique"]
+
+
+async def test_backfill_users(mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  legacy_user = {"_id": "id", "username": "Bob", "email": "Bob@example.com"}
+  mock_db["customers"].find.return_value.__aiter__.return_value = [legacy_user]
+
+  assert await UserCRUD(mock_db).backfill_lookup_keys() == 1
+
+  requests = mock_db["customers"].bulk_write.await_args.args[0]
+  assert requests == [
+    UpdateOne(
+      {"_id": "id"},
+      {"$set": {"username_lc": "bob", "email_lc": "bob@example.com"}},
+    )
+  ]
+
+
+async def test_index_reconciliation_doesnt_scan_users(mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+
+  await IndexRegistry.reconcile(mock_mongo_client)
+
+  # Backfilling is a one-off migration, not run by every worker
+  mock_db["customers"].find.assert_not_called()
+  mock_db["customers"].create_indexes.assert_awaited_once()
+
+
+def test_create_category(authorized_client, mock_mongo_client, mock_redis_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.create_collection = AsyncMock()
+
+  response = authorized_client.post("/api/v1/admin/categories", json={"name": "phones"})
+
+  assert response.status_code == status.HTTP_201_CREATED
+  mock_db.create_collection.assert_awaited_once_with("phones")
+  mock_db["phones"].create_indexes.assert_awaited_once()
+  mock_redis_client.publish.assert_awaited_once_with(
+    CategoryRegistry.CHANNEL, "invalidate"
+  )
@@ -1,4 +1,16 @@
+import base64
+import json
+import time
+from unittest.mock import MagicMock
+
+import jwt
+from core.config import settings
+from core.security.jwt import OAuthJWTBearer
+from core.security.keys import KeyManager
 from core.security.utils import Hash
+from core.services.revocations import RevokedTokens
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
 from fastapi import status
 
 
@@ -47,3 +59,179 @@ def test_login_invalid_credentials(client, mock_mongo_client):
   )
 
   assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_login_fails_fast_when_hashing_is_saturated(
+  client, mock_mongo_client, monkeypatch
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one.return_value = {
+    "username": "testuser",
+    "password": Hash.hash("password"),
+    "role": "customers",
+  }
+  monkeypatch.setattr(settings, "PASSWORD_HASH_MAX_PENDING", 0)
+
+  response = client.post(
+    "/api/v1/auth/login",
+    data={"username": "testuser", "password": "password"},
+  )
+
+  assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+  assert response.headers["Retry-After"] == "1"
+
+
+async def test_hash_pool_is_closed():
+  assert await Hash.averify("password", Hash.hash("password"))
+  executor = Hash._executor
+
+  Hash.close()
+
+  assert executor._shutdown
+  # Hashing again starts a new pool
+  assert await Hash.averify("password", Hash.hash("password"))
+  assert Hash._executor not in (None, executor)
+  Hash.close()
+
+
+def test_logout_decodes_token_once(
+  client, bearer_headers, mock_redis_client, monkeypatch
+):
+  mock_redis_client.exists.return_value = 0
+  decode = MagicMock(wraps=OAuthJWTBearer.decode)
+  monkeypatch.setattr(OAuthJWTBearer, "decode", decode)
+
+  response = client.post("/api/v1/auth/logout", headers=bearer_headers)
+
+  assert response.status_code == status.HTTP_200_OK
+  # Decoded by the middleware, reused by the dependencies and the route
+  decode.assert_called_once()
+  assert mock_redis_client.setex.await_args.args[0].startswith("session:blacklist:jti:")
+
+
+def test_verified_token_is_cached(
+  client, bearer_headers, mock_redis_client, monkeypatch
+):
+  mock_redis_client.exists.return_value = 0
+  verify = MagicMock(wraps=jwt.decode)
+  monkeypatch.setattr(jwt, "decode", verify)
+
+  for _ in range(2):
+    response = client.get("/api/v1/user/me", headers=bearer_headers)
+
+    assert response.status_code == status.HTTP_200_OK
+
+  # The signature is only verified by the first request
+  verify.assert_called_once()
+  assert "jwt_cache_hits_total" in client.get("/metrics").text
+
+
+def test_jwks_publishes_signing_key(client):
+  token = OAuthJWTBearer.encode({"sub": "testuser"})["jwt"]
+
+  response = client.get("/api/v1/auth/jwks.json")
+
+  assert response.status_code == status.HTTP_200_OK
+  (key,) = response.json()["keys"]
+  assert key["kid"] == jwt.get_unverified_header(token)["kid"]
+  assert key["alg"] == settings.JWT_ALGORITHM
+  assert jwt.PyJWK(key).key.public_numbers() == (
+    OAuthJWTBearer.keys.private_key.public_key().public_numbers()
+  )
+
+
+def test_rotated_keys_verify_previous_tokens(monkeypatch):
+  previous_token = OAuthJWTBearer.encode({"sub": "testuser"})["jwt"]
+
+  # Rotate to an Ed25519 key, keeping the previous public key
+  private_pem = (
+    ed25519.Ed25519PrivateKey.generate()
+    .private_bytes(
+      serialization.Encoding.PEM,
+      serialization.PrivateFormat.PKCS8,
+      serialization.NoEncryption(),
+    )
+    .decode()
+  )
+  monkeypatch.setattr(
+    OAuthJWTBearer, "keys", KeyManager(private_pem, [settings.PUBLIC_KEY_PEM])
+  )
+  token = OAuthJWTBearer.encode({"sub": "testuser"})["jwt"]
+
+  assert jwt.get_unverified_header(token)["alg"] == "EdDSA"
+  assert OAuthJWTBearer.decode(token)["sub"] == "testuser"
+  assert OAuthJWTBearer.decode(previous_token)["sub"] == "testuser"
+
+  # Tokens of removed keys are rejected
+  monkeypatch.setattr(OAuthJWTBearer, "keys", KeyManager(private_pem))
+  OAuthJWTBearer.claims_cache.clear()
+  assert OAuthJWTBearer.decode(previous_token) is None
+
+
+def test_malformed_token_headers_are_rejected(client):
+  def token(header: dict) -> str:
+    segments = [json.dumps(header), json.dumps({"sub": "testuser"}), "signature"]
+
+    return ".".join(
+      base64.urlsafe_b64encode(segment.encode()).decode().rstrip("=")
+      for segment in segments
+    )
+
+  for header in [
+    {"alg": "RS256", "kid": 5},
+    {"alg": "RS256", "kid": ["kid"]},
+    # The algorithm doesn't match the key
+    {"alg": "HS256", "kid": OAuthJWTBearer.keys.kid},
+  ]:
+    assert OAuthJWTBearer.decode(token(header)) is None
+
+    response = client.get(
+      "/api/v1/user/me", headers={"Authorization": f"Bearer {token(header)}"}
+    )
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_revoked_tokens_are_checked_locally(
+  client, bearer_headers, mock_redis_client, monkeypatch
+):
+  # The worker knows every revocation since the listener subscribed
+  monkeypatch.setattr(RevokedTokens, "is_synced", classmethod(lambda cls: True))
+  monkeypatch.setattr(RevokedTokens, "_synced_at", time.monotonic())
+  monkeypatch.setattr(RevokedTokens, "_revoked", {})
+  headers = bearer_headers
+
+  assert client.get("/api/v1/user/me", headers=headers).status_code == 200
+  assert client.post("/api/v1/auth/logout", headers=headers).status_code == 200
+  assert client.get("/api/v1/user/me", headers=headers).status_code == 401
+
+  mock_redis_client.exists.assert_not_awaited()
+  mock_redis_client.publish.assert_awaited_once()
+  assert mock_redis_client.publish.await_args.args[0] == RevokedTokens.CHANNEL
+
+
+def test_revocations_are_bucketed(
+  client, bearer_headers, mock_redis_client, monkeypatch
+):
+  monkeypatch.setattr(settings, "REVOCATION_STORAGE", "buckets")
+  # Revocations are looked up in Redis
+  monkeypatch.setattr(RevokedTokens, "is_synced", classmethod(lambda cls: False))
+  mock_redis_client.evalsha.return_value = 0
+  headers = bearer_headers
+  claims = OAuthJWTBearer.decode(headers["Authorization"].removeprefix("Bearer "))
+
+  assert client.post("/api/v1/auth/logout", headers=headers).status_code == 200
+
+  # The fingerprint is added to the set of the tokens expiring that minute
+  _, _, key, fingerprint, expires_at = mock_redis_client.evalsha.await_args.args
+  assert key == RevokedTokens.bucket(fingerprint, claims["exp"])
+  assert key.startswith(f"{RevokedTokens.BUCKET_PREFIX}{claims['exp'] // 60}:")
+  assert fingerprint == RevokedTokens.fingerprint(claims["jti"])
+  assert claims["exp"] < expires_at <= claims["exp"] + 60
+  mock_redis_client.setex.assert_not_awaited()
+
+  mock_redis_client.evalsha.return_value = 1
+
+  assert client.get("/api/v1/user/me", headers=headers).status_code == 401
+  mock_redis_client.exists.assert_not_awaited()
@@ -104,7 +104,7 @@ def test_delete_customer(authorized_client, mock_mongo_client):
   mock_db.list_collection_names.return_value = ["customers"]
   mock_cust = {"username": "cust1", "role": "customers"}
   mock_db["customers"].find_one.return_value = mock_cust
-  mock_db["customers"].delete_one.return_value = MagicMock(deleted_count=1)
+  mock_db["customers"].find_one_and_delete.return_value = {"username": "cust1"}
 
   response = authorized_client.delete("/api/v1/customers/cust1")
 
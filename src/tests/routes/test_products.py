@@ -1,7 +1,11 @@
+import json
+import time
 from unittest.mock import AsyncMock, MagicMock
 
 from bson import ObjectId
+from core.cache import LocalCache, local_cache
 from fastapi import status
+from pymongo.errors import BulkWriteError
 
 
 def test_create_product(seller_client, mock_mongo_client):
@@ -80,6 +84,37 @@ def test_get_product(client, mock_mongo_client):
   assert response.json()["title"] == "Laptop"
 
 
+def test_get_product_local_cache(client, mock_redis_client, monkeypatch):
+  monkeypatch.setattr(LocalCache, "enabled", True)
+  local_cache.invalidate(None)
+
+  pid = str(ObjectId())
+  product = {
+    "_id": pid,
+    "title": "Laptop",
+    "category": "electronics",
+    "item": "Laptop",
+    "brand": "BrandX",
+    "description": "Fast",
+    "price": 1000,
+  }
+  mock_redis_client.get.return_value = json.dumps({"v": product, "s": time.time() + 60})
+
+  for _ in range(2):
+    response = client.get(f"/api/v2/products/electronics/{pid}")
+    assert response.status_code == status.HTTP_200_OK
+
+  # The second read is served from worker memory
+  mock_redis_client.get.assert_awaited_once_with(f"cache:product:electronics:{pid}")
+
+  # Until Redis reports the key as modified
+  local_cache.invalidate([f"cache:product:electronics:{pid}"])
+  client.get(f"/api/v2/products/electronics/{pid}")
+
+  assert mock_redis_client.get.await_count == 2
+  local_cache.invalidate(None)
+
+
 def test_update_product(seller_client, mock_mongo_client):
   mock_db = mock_mongo_client.get_database("products")
   mock_db["electronics"].update_one.return_value = MagicMock(modified_count=1)
@@ -102,3 +137,268 @@ def test_delete_product(authorized_client, mock_mongo_client):
 
   assert response.status_code == status.HTTP_200_OK
   assert response.json()["message"] == "The product was deleted successfully."
+
+
+def test_get_products_keyset_pagination(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_collection = mock_db["electronics"]
+
+  ids = [ObjectId() for _ in range(3)]
+  mock_cursor = MagicMock()
+  mock_cursor.to_list = AsyncMock(
+    return_value=[
+      {
+        "_id": _id,
+        "title": f"P{i}",
+        "category": "electronics",
+        "item": "I",
+        "brand": "B",
+        "description": "D",
+        "price": 100 * i,
+      }
+      for i, _id in enumerate(ids)
+    ]
+  )
+  mock_collection.find.return_value = mock_cursor
+
+  response = authorized_client.get(
+    "/api/v2/products/electronics", params={"length": 2, "sort_by": "price"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  assert len(response.json()) == 2
+  cursor = response.headers.get("X-Next-Cursor")
+  assert cursor
+
+  response = authorized_client.get(
+    "/api/v2/products/electronics",
+    params={"length": 2, "sort_by": "price", "cursor": cursor},
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  args, kwargs = mock_collection.find.call_args
+  assert args[0] == {
+    "$or": [
+      {"price": {"$gt": 100}},
+      {"price": 100, "_id": {"$gt": ids[1]}},
+    ]
+  }
+  assert kwargs["sort"] == [("price", 1), ("_id", 1)]
+  assert kwargs["limit"] == 3
+
+
+def test_get_products_invalid_cursor(authorized_client):
+  response = authorized_client.get(
+    "/api/v2/products/electronics", params={"cursor": "not-a-cursor"}
+  )
+
+  assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_products_fields_projection(authorized_client, mock_mongo_client):
+  mock_collection = mock_mongo_client.get_database("products")["electronics"]
+
+  ids = [ObjectId() for _ in range(2)]
+  mock_cursor = MagicMock()
+  mock_cursor.to_list = AsyncMock(
+    return_value=[
+      {"_id": _id, "title": f"P{i}", "price": 100 * i} for i, _id in enumerate(ids)
+    ]
+  )
+  mock_collection.find.return_value = mock_cursor
+
+  response = authorized_client.get(
+    "/api/v2/products/electronics",
+    params={"length": 1, "sort_by": "price", "fields": "title"},
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json() == [{"_id": str(ids[0]), "title": "P0"}]
+  assert response.headers.get("X-Next-Cursor")
+  _, kwargs = mock_collection.find.call_args
+  assert kwargs["projection"] == {"title": True, "price": True}
+
+
+def test_get_products_unknown_fields(authorized_client):
+  response = authorized_client.get(
+    "/api/v2/products/electronics", params={"fields": "title,secret"}
+  )
+
+  assert response.status_code == status.HTTP_400_BAD_REQUEST
+  assert response.json()["detail"] == "Unknown fields: secret."
+
+
+def test_stream_products_ndjson(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_collection = mock_db["electronics"]
+
+  mock_cursor = MagicMock()
+  mock_cursor.__aiter__.return_value = [
+    {
+      "_id": ObjectId(),
+      "title": f"P{i}",
+      "category": "electronics",
+      "item": "I",
+      "brand": "B",
+      "description": "D",
+      "price": i,
+    }
+    for i in range(3)
+  ]
+  mock_collection.find.return_value = mock_cursor
+
+  response = authorized_client.get(
+    "/api/v2/products/electronics",
+    headers={"Accept": "application/x-ndjson"},
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.headers["content-type"] == "application/x-ndjson"
+  lines = response.text.splitlines()
+  assert [json.loads(line)["price"] for line in lines] == [0, 1, 2]
+  assert mock_collection.find.call_args.kwargs["batch_size"] > 0
+
+
+def test_bulk_create_products(seller_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["electronics"]
+  mock_db["electronics"].bulk_write.side_effect = BulkWriteError(
+    {
+      "nInserted": 1,
+      "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}],
+    }
+  )
+
+  product = {
+    "category": "electronics",
+    "item": "Laptop",
+    "brand": "BrandX",
+    "title": "Super Laptop",
+    "description": "Fast",
+    "price": 1000,
+    "date": "2023-01-01T00:00:00",
+  }
+  response = seller_client.post(
+    "/api/v2/products/electronics/bulk", json=[product, product]
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  data = response.json()
+  assert data["inserted"] == 1
+  assert [item["ok"] for item in data["items"]] == [True, False]
+  assert data["items"][1]["error"] == "duplicate key"
+  mock_db["electronics"].bulk_write.assert_awaited_once()
+  assert mock_db["electronics"].bulk_write.call_args.kwargs["ordered"] is False
+
+
+def test_bulk_delete_products(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["electronics"]
+  mock_db["electronics"].bulk_write.return_value = MagicMock(
+    bulk_api_result={"nRemoved": 2, "writeErrors": []}
+  )
+
+  pids = [str(ObjectId()), str(ObjectId())]
+  mock_db["electronics"].find.return_value.to_list.return_value = [
+    {"_id": ObjectId(pid)} for pid in pids
+  ]
+  response = authorized_client.request(
+    "DELETE", "/api/v2/products/electronics/bulk", json=pids
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json()["deleted"] == 2
+  assert [item["id"] for item in response.json()["items"]] == pids
+
+
+def test_bulk_writes_report_missing_products(seller_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["electronics"]
+  existing, missing = ObjectId(), ObjectId()
+  # Only the existing product is found, by a single query
+  mock_db["electronics"].find.return_value.to_list.return_value = [{"_id": existing}]
+  mock_db["electronics"].bulk_write.return_value = MagicMock(
+    bulk_api_result={"nMatched": 1, "nModified": 1, "writeErrors": []}
+  )
+
+  response = seller_client.patch(
+    "/api/v2/products/electronics/bulk",
+    json=[
+      {"id": str(existing), "update": {"price": 10}},
+      {"id": str(missing), "update": {"price": 20}},
+    ],
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  items = response.json()["items"]
+  assert [item["ok"] for item in items] == [True, False]
+  assert items[1]["error"] == "not found"
+  assert mock_db["electronics"].find.call_args.args[1] == {"_id": 1}
+
+  mock_db["electronics"].bulk_write.return_value = MagicMock(
+    bulk_api_result={"nRemoved": 1, "writeErrors": []}
+  )
+  response = seller_client.request(
+    "DELETE",
+    "/api/v2/products/electronics/bulk",
+    json=[str(existing), str(missing), str(existing)],
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  items = response.json()["items"]
+  # A repeated ID is only deleted once
+  assert [item["ok"] for item in items] == [True, False, False]
+  assert [item["error"] for item in items] == [None, "not found", "not found"]
+
+
+def test_create_product_uses_cached_categories(seller_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["electronics"]
+  mock_db.list_collection_names.reset_mock()
+
+  product = {
+    "category": "electronics",
+    "item": "Laptop",
+    "brand": "BrandX",
+    "title": "Super Laptop",
+    "description": "Fast",
+    "price": 1000,
+    "date": "2023-01-01T00:00:00",
+  }
+
+  for _ in range(3):
+    response = seller_client.post("/api/v2/products/", json=product)
+    assert response.status_code == status.HTTP_201_CREATED
+
+  assert mock_db.list_collection_names.await_count == 1
+  assert mock_db["electronics"].insert_one.await_count == 3
+
+
+def test_get_categories(client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["phones", "electronics"]
+
+  response = client.get("/api/v2/products/categories")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json() == ["electronics", "phones"]
+
+
+def test_bulk_writes_require_an_existing_category(seller_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("products")
+  mock_db.list_collection_names.return_value = ["electronics"]
+  pid = str(ObjectId())
+
+  response = seller_client.patch(
+    "/api/v2/products/unknown/bulk", json=[{"id": pid, "update": {"price": 10}}]
+  )
+
+  assert response.status_code == status.HTTP_404_NOT_FOUND
+
+  response = seller_client.request(
+    "DELETE", "/api/v2/products/unknown/bulk", json=[pid]
+  )
+
+  assert response.status_code == status.HTTP_404_NOT_FOUND
+  # No collection is created for the unknown category
+  mock_db["unknown"].bulk_write.assert_not_awaited()
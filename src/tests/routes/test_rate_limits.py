@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from api.dependencies import limit_dependency, route_limits
+from core.services import rate_limits
+from fastapi import status
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from app.main import app
+
+
+@pytest.fixture
+def limited_client(monkeypatch, authorized_client, mock_mongo_client):
+  """Rate limited client looking up a seeded user, with GCRA limits by default."""
+  # `monkeypatch` comes first so the limits are restored after the lifespan closes
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one.return_value = {
+    "username": "testuser",
+    "role": "customers",
+    "email": "test@example.com",
+    "first_name": "F",
+    "middle_name": "M",
+    "last_name": "L",
+    "account_date": "2023-01-01T00:00:00",
+  }
+
+  app.dependency_overrides.pop(limit_dependency)
+  monkeypatch.setattr(route_limits, "strategy", "gcra")
+  monkeypatch.setattr(route_limits, "_routes", {})
+
+  return authorized_client
+
+
+@pytest.fixture
+def limit_scripts(mock_redis_client):
+  """Calls of the rate limit scripts as (keys, args), answered by `reply`."""
+  scripts = SimpleNamespace(calls=[], reply=None)
+
+  async def evalsha(sha, numkeys, *keys_and_args):
+    keys, args = list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:])
+
+    if not keys or not keys[0].startswith(route_limits.PREFIX):
+      return None
+
+    scripts.calls.append((keys, args))
+
+    return scripts.reply(keys, args) if scripts.reply else None
+
+  mock_redis_client.evalsha.side_effect = evalsha
+
+  return scripts
+
+
+def test_route_limits_are_parsed_once(monkeypatch, limited_client):
+  monkeypatch.setattr(
+    route_limits,
+    "limiter",
+    Limiter(key_func=get_remote_address, storage_uri="memory://"),
+  )
+  monkeypatch.setattr(route_limits, "limits", {"anonymous": "2/minute"})
+  monkeypatch.setattr(route_limits, "strategy", "moving-window")
+  parse_many = MagicMock(wraps=rate_limits.parse_many)
+  monkeypatch.setattr(rate_limits, "parse_many", parse_many)
+
+  statuses = [
+    limited_client.get("/api/v1/users/testuser").status_code for _ in range(3)
+  ]
+
+  assert statuses == [200, 200, status.HTTP_429_TOO_MANY_REQUESTS]
+  parse_many.assert_called_once_with("2/minute")
+
+
+def test_gcra_rate_limit_headers(monkeypatch, limited_client, limit_scripts):
+  monkeypatch.setattr(route_limits, "limits", {"anonymous": "5/minute"})
+  # Limit index, remaining requests, ms until reset and until allowed
+  results = iter([[1, 4, 12000, 0], [1, 0, 60000, 1500]])
+  limit_scripts.reply = lambda keys, args: next(results)
+
+  response = limited_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.headers["RateLimit-Limit"] == "5"
+  assert response.headers["RateLimit-Remaining"] == "4"
+  assert response.headers["RateLimit-Reset"] == "12"
+  assert response.headers["RateLimit-Policy"] == "5;w=60"
+
+  # One script call per check, with a single key per identifier and limit
+  [([key], args)] = limit_scripts.calls
+  assert key.startswith(f"{route_limits.PREFIX}anonymous:")
+  assert key.endswith(":5/60")
+  assert args == [1, 12000.0, 60000]
+
+  response = limited_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+  assert response.headers["RateLimit-Remaining"] == "0"
+  assert response.headers["Retry-After"] == "2"
+
+
+def test_anonymous_rate_limits_are_counted_locally(
+  monkeypatch, limited_client, limit_scripts
+):
+  monkeypatch.setattr(route_limits, "limits", {"anonymous": "2/minute"})
+  # Each worker admits a single request between synchronizations
+  monkeypatch.setattr(route_limits, "local", rate_limits.LocalBuckets(60, 0.5))
+  # The other request allowed by the limit was admitted by another worker
+  limit_scripts.reply = lambda keys, args: [0]
+
+  response = limited_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.headers["RateLimit-Remaining"] == "1"
+  assert limit_scripts.calls == []
+
+  response = limited_client.get("/api/v1/users/testuser")
+
+  # Synchronized with the request admitted locally before rejecting
+  assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+  assert response.headers["Retry-After"] == "30"
+  assert [args for _, args in limit_scripts.calls] == [[30000.0, 60000, 1]]
+
+  response = limited_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+  assert len(limit_scripts.calls) == 1
+
+
+def test_rate_limits_are_shared_by_the_workers(
+  monkeypatch, tmp_path, limited_client, limit_scripts
+):
+  monkeypatch.setattr(route_limits, "limits", {"anonymous": "2/minute"})
+  # Two workers mapping the same file, without syncing with Redis
+  workers = [
+    rate_limits.SharedMemoryLimits(str(tmp_path / "limits"), 64, 4, 0) for _ in range(2)
+  ]
+
+  for worker, expected in zip(workers * 2, [200, 200, 429, 429]):
+    monkeypatch.setattr(route_limits, "shared", worker)
+    response = limited_client.get("/api/v1/users/testuser")
+
+    assert response.status_code == expected
+
+  assert response.headers["Retry-After"] == "30"
+  assert response.headers["RateLimit-Remaining"] == "0"
+  assert limit_scripts.calls == []
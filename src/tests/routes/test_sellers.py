@@ -1,6 +1,10 @@
 from unittest.mock import AsyncMock, MagicMock
 
+from core.cache import HashReadThroughCache
+from core.database import RedisClient
+from core.services.profiles import ProfileCache
 from fastapi import status
+from pymongo import ReturnDocument
 
 
 def test_create_seller(client, mock_mongo_client):
@@ -116,12 +120,98 @@ def test_update_seller(authorized_client, mock_mongo_client):
   assert response.json()["message"] == "The seller account has been updated."
 
 
+def test_update_seller_single_round_trip(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_collection = mock_db["sellers"]
+  mock_collection.find_one_and_update.return_value = {"username": "seller1"}
+  mock_db.list_collection_names.reset_mock()
+
+  response = authorized_client.patch(
+    "/api/v1/sellers/seller1", json={"business_name": "New Biz"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  mock_db.list_collection_names.assert_not_awaited()
+  mock_collection.find_one.assert_not_awaited()
+  args, kwargs = mock_collection.find_one_and_update.call_args
+  assert args[:2] == (
+    {"$or": [{"username_lc": "seller1"}, {"email_lc": "seller1"}]},
+    {"$set": {"business_name": "New Biz"}, "$inc": {"version": 1}},
+  )
+  assert kwargs["return_document"] == ReturnDocument.AFTER
+
+
+def test_update_seller_writes_through_cache(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db["sellers"].find_one_and_update.return_value = {
+    "username": "seller1",
+    "business_name": "New Biz",
+    "version": 3,
+  }
+
+  response = authorized_client.patch(
+    "/api/v1/sellers/seller1", json={"business_name": "New Biz"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  mock_redis_client.delete.assert_not_awaited()
+  args = mock_redis_client.evalsha.call_args.args
+  assert args[1:5] == (
+    2,
+    "cache:user:seller1:profile",
+    "cache:user:seller1:version",
+    3,
+  )
+  assert RedisClient.codec.decode(args[5])["v"] == {
+    "username": "seller1",
+    "business_name": "New Biz",
+  }
+
+
+def test_update_seller_writes_changed_fields(
+  authorized_client, mock_mongo_client, mock_redis_client, monkeypatch
+):
+  # Profiles cached with the "hash" layout
+  monkeypatch.setattr(
+    ProfileCache,
+    "cache",
+    HashReadThroughCache(
+      "cache:user:{}:fields", version_key="cache:user:{}:version", ttl=60
+    ),
+  )
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db["sellers"].find_one_and_update.return_value = {
+    "username": "seller1",
+    "business_name": "New Biz",
+    "version": 3,
+  }
+
+  response = authorized_client.patch(
+    "/api/v1/sellers/seller1", json={"business_name": "New Biz"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  args = mock_redis_client.evalsha.call_args.args
+  assert args[1:6] == (
+    2,
+    "cache:user:seller1:fields",
+    "cache:user:seller1:version",
+    3,
+    "~missing",
+  )
+  assert args[6] == "business_name"
+  assert RedisClient.codec.decode(args[7]) == "New Biz"
+  assert len(args) == 8
+
+
 def test_delete_seller(authorized_client, mock_mongo_client):
   mock_db = mock_mongo_client.get_database("users")
   mock_db.list_collection_names.return_value = ["sellers"]
   mock_seller = {"username": "seller1", "role": "sellers"}
   mock_db["sellers"].find_one.return_value = mock_seller
-  mock_db["sellers"].delete_one.return_value = MagicMock(deleted_count=1)
+  mock_db["sellers"].find_one_and_delete.return_value = {"username": "seller1"}
 
   response = authorized_client.delete("/api/v1/sellers/seller1")
 
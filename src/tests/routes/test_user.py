@@ -1,3 +1,4 @@
+from bson import ObjectId
 from core.security.utils import Hash
 from fastapi import status
 
@@ -36,7 +37,12 @@ def test_update_password(authorized_client, mock_mongo_client):
   # Need to verify current password first
   # So we need mock user with hashed password
   hashed_pwd = Hash.hash("oldpassword")
-  user_data = {"username": "admin", "password": hashed_pwd, "role": "admins"}
+  user_data = {
+    "_id": ObjectId(),
+    "username": "admin",
+    "password": hashed_pwd,
+    "role": "admins",
+  }
 
   mock_db = mock_mongo_client.get_database("users")
   mock_db.list_collection_names.return_value = ["admins"]
@@ -60,7 +66,12 @@ def test_update_password(authorized_client, mock_mongo_client):
 def test_update_email(authorized_client, mock_mongo_client):
   # Requires password verification
   hashed_pwd = Hash.hash("password")
-  user_data = {"username": "admin", "password": hashed_pwd, "role": "admins"}
+  user_data = {
+    "_id": ObjectId(),
+    "username": "admin",
+    "password": hashed_pwd,
+    "role": "admins",
+  }
 
   mock_db = mock_mongo_client.get_database("users")
   mock_db.list_collection_names.return_value = ["admins"]
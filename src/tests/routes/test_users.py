@@ -1,5 +1,11 @@
+import json
+import time
+from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock
 
+from core.database import RedisClient
+from core.services.profiles import ProfileCache
+from crud import UserCRUD
 from fastapi import status
 
 
@@ -76,14 +82,235 @@ def test_update_user(authorized_client, mock_mongo_client):
   assert response.json()["message"] == "The user account has been updated."
 
 
+def test_update_user_writes_the_stored_username(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one_and_update.return_value = {
+    "username": "testuser",
+    "role": "customers",
+    "version": 2,
+  }
+
+  response = authorized_client.patch(
+    "/api/v1/users/TestUser", json={"first_name": "Updated"}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  # The profile read by `get_current_user` from the token subject is
+  # written, and the one cached under the path is dropped
+  written = {call.args[2] for call in mock_redis_client.evalsha.await_args_list}
+  assert ProfileCache.cache.key("testuser") in written
+  mock_redis_client.delete.assert_awaited_once_with(ProfileCache.cache.key("TestUser"))
+
+  mock_redis_client.delete.reset_mock()
+  mock_db["customers"].find_one_and_delete.return_value = {"username": "testuser"}
+
+  response = authorized_client.delete("/api/v1/users/TestUser")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert {
+    ProfileCache.cache.key("testuser"),
+    ProfileCache.cache.key("TestUser"),
+  } <= set(mock_redis_client.delete.await_args.args)
+
+
 def test_delete_user(authorized_client, mock_mongo_client):
   mock_db = mock_mongo_client.get_database("users")
   mock_db.list_collection_names.return_value = ["customers"]
   mock_user = {"username": "testuser", "role": "customers"}
   mock_db["customers"].find_one.return_value = mock_user
-  mock_db["customers"].delete_one.return_value = MagicMock(deleted_count=1)
+  mock_db["customers"].find_one_and_delete.return_value = {"username": "testuser"}
 
   response = authorized_client.delete("/api/v1/users/testuser")
 
   assert response.status_code == status.HTTP_200_OK
   assert response.json()["message"] == "The user account was deleted successfully."
+
+
+def test_deleted_user_can_sign_up_again(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one.return_value = {
+    "username": "testuser",
+    "role": "customers",
+  }
+  mock_db["customers"].find_one_and_delete.return_value = {"username": "testuser"}
+
+  response = authorized_client.delete("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_200_OK
+  # The version of the deleted profile would reject the profiles of the
+  # new account until it expires
+  mock_redis_client.delete.assert_awaited_once_with(
+    ProfileCache.cache.key("testuser"), "cache:user:testuser:version"
+  )
+
+  mock_db["customers"].find_one.return_value = None
+  response = authorized_client.post(
+    "/api/v1/customers",
+    json={
+      "first_name": "Test",
+      "middle_name": "M",
+      "last_name": "Customer",
+      "username": "testuser",
+      "email": "test@example.com",
+      "password": "password123",
+      "account_date": "2023-01-01T00:00:00",
+      "scopes": ["customer"],
+    },
+  )
+
+  assert response.status_code == status.HTTP_201_CREATED
+  # Only the cached miss of the new username is evicted
+  assert "cache:user:testuser:version" not in mock_redis_client.delete.await_args.args
+
+
+def test_get_user_uses_exact_lookup(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+
+  response = authorized_client.get("/api/v1/users/Bob")
+
+  assert response.status_code == status.HTTP_404_NOT_FOUND
+  mock_db["customers"].find_one.assert_awaited_once_with(
+    {"$or": [{"username_lc": "bob"}, {"email_lc": "bob"}]},
+    projection={
+      "_id": False,
+      "password": False,
+      "username_lc": False,
+      "email_lc": False,
+    },
+  )
+
+
+def test_get_user_falls_back_to_raw_fields(
+  monkeypatch, authorized_client, mock_mongo_client
+):
+  monkeypatch.setattr(UserCRUD, "lookup_fallback", True)
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  legacy_user = {
+    "username": "Bob",
+    "role": "customers",
+    "email": "bob@example.com",
+    "first_name": "F",
+    "middle_name": "M",
+    "last_name": "L",
+    "account_date": "2023-01-01T00:00:00",
+  }
+
+  # Profiles created before the lookup fields only match by raw fields
+  async def find_one(filter, **kwargs):
+    return legacy_user if "username_lc" in filter else None
+
+  mock_db["customers"].find_one.side_effect = find_one
+
+  response = authorized_client.get("/api/v1/users/Bob")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json()["username"] == "Bob"
+  assert mock_db["customers"].find_one.await_args.args[0] == {
+    "username_lc": {"$exists": False},
+    "$or": [
+      {field: {"$in": sorted(["Bob", "bob"])}}
+      for field in ("username", "email", "email.address")
+    ],
+  }
+
+
+def test_lookup_filter_without_keys_matches_nothing():
+  assert UserCRUD.lookup_filter(None) == {
+    "$or": [{"username_lc": {"$in": []}}, {"email_lc": {"$in": []}}]
+  }
+
+
+def test_stream_users_json_array(authorized_client, mock_mongo_client):
+  mock_db = mock_mongo_client.get_database("users")
+
+  mock_cursor = MagicMock()
+  mock_cursor.__aiter__.return_value = [
+    {
+      "username": f"u{i}",
+      "role": "customers",
+      "email": f"u{i}@e.com",
+      "first_name": "F",
+      "middle_name": "M",
+      "last_name": "L",
+      "account_date": "2023-01-01T00:00:00",
+    }
+    for i in range(2)
+  ]
+  mock_db["customers"].find.return_value = mock_cursor
+
+  response = authorized_client.get(
+    "/api/v1/users/all/customers", params={"stream": True}
+  )
+
+  assert response.status_code == status.HTTP_200_OK
+  assert [user["username"] for user in response.json()] == ["u0", "u1"]
+
+
+def test_get_user_caches_misses(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  mock_db = mock_mongo_client.get_database("users")
+  mock_db.list_collection_names.return_value = ["customers"]
+  mock_db["customers"].find_one.return_value = None
+
+  response = authorized_client.get("/api/v1/users/ghost")
+
+  assert response.status_code == status.HTTP_404_NOT_FOUND
+  args, kwargs = mock_redis_client.set.call_args
+  assert args[0] == "cache:user:ghost:profile"
+  assert RedisClient.codec.decode(args[1])["v"] is None
+  assert kwargs["nx"] is True
+
+
+def test_get_user_serves_stale_profile(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  profile = {
+    "username": "testuser",
+    "role": "customers",
+    "email": "test@example.com",
+    "first_name": "F",
+    "middle_name": "M",
+    "last_name": "L",
+    "account_date": "2023-01-01T00:00:00",
+  }
+  mock_redis_client.get.return_value = json.dumps({"v": profile, "s": time.time() - 1})
+  # Another worker is already refreshing the profile
+  mock_redis_client.set.return_value = False
+
+  response = authorized_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json()["username"] == "testuser"
+  mock_mongo_client.get_database("users")["customers"].find_one.assert_not_awaited()
+
+
+def test_get_user_decodes_binary_profile(
+  authorized_client, mock_mongo_client, mock_redis_client
+):
+  profile = {
+    "username": "testuser",
+    "role": "customers",
+    "email": "test@example.com",
+    "first_name": "F",
+    "middle_name": "M",
+    "last_name": "L",
+    "account_date": datetime(2023, 1, 1),
+  }
+  mock_redis_client.get.return_value = RedisClient.codec.encode(
+    {"v": profile, "s": time.time() + 60}
+  )
+
+  response = authorized_client.get("/api/v1/users/testuser")
+
+  assert response.status_code == status.HTTP_200_OK
+  assert response.json()["account_date"] == "2023-01-01T00:00:00"
+  mock_mongo_client.get_database("users")["customers"].find_one.assert_not_awaited()